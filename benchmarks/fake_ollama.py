@@ -0,0 +1,297 @@
+"""
+Minimal fake Ollama HTTP server for benchmarks and offline experiments.
+Implements just enough of the Ollama REST API (/api/chat, /api/tags,
+/api/ps, /api/version) for the server's LLM service to talk to it, and can
+inject failures: error responses and connections dropped mid-stream.
+"""
+
+import asyncio
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Optional, Tuple
+
+
+@dataclass
+class FakeOllamaConfig:
+    prefill_delay: float = 0.5      # Seconds before the first token is produced
+    prefill_rate: float = 0.0       # Prompt tokens evaluated per second on top of the delay, 0 ignores prompt size
+    tokens_per_second: float = 50.0  # Decode rate once generation has started
+    response_tokens: int = 20       # Number of tokens in every reply
+    error_rate: float = 0.0         # Share of chat requests answered with HTTP 500
+    drop_rate: float = 0.0          # Share of chat requests whose connection is closed halfway through the reply
+    seed: Optional[int] = None      # Seed for failure injection, None for a random one
+    model: str = "codellama"
+
+
+class FakeOllama:
+    """
+    Asyncio based fake of the Ollama API.
+    Replies to chat requests with a fixed number of tokens after a configurable delay.
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 11434, config: Optional[FakeOllamaConfig] = None):
+        """
+        Initialize the fake server
+        @param host: Interface to bind to
+        @param port: Port to bind to, 0 selects a free port
+        @param config: Timing and reply settings
+        """
+        self.host = host
+        self.port = port
+        self.config = config or FakeOllamaConfig()
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.connections = set()
+        self.requests = 0
+        self.active = 0
+        self.failures = 0
+        self.random = random.Random(self.config.seed)
+
+    @property
+    def url(self) -> str:
+        """Base URL of the running server"""
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self) -> None:
+        """Start listening for connections"""
+        self.server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        """Stop the server and close all connections"""
+        if self.server:
+            self.server.close()
+            for task in list(self.connections):
+                task.cancel()
+            await asyncio.gather(*self.connections, return_exceptions=True)
+            await self.server.wait_closed()
+            self.server = None
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Tuple[str, str, bytes]]:
+        """
+        Read one HTTP/1.1 request from the connection
+        @param reader: Stream to read from
+        @returns: Tuple of method, path and body, or None when the peer closed the connection
+        """
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        method, path, _ = request_line.decode().split(" ", 2)
+        length = 0
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode().partition(":")
+            if name.strip().lower() == "content-length":
+                length = int(value.strip())
+        body = await reader.readexactly(length) if length else b""
+        return method, path, body
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Serve requests on a keep-alive connection until the client disconnects
+        @param reader: Connection reader
+        @param writer: Connection writer
+        """
+        task = asyncio.current_task()
+        self.connections.add(task)
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, path, body = request
+                if path == "/api/chat":
+                    await self._chat(writer, json.loads(body or b"{}"))
+                elif path == "/api/tags":
+                    await self._send_json(writer, {"models": [{"name": f"{self.config.model}:latest", "model": f"{self.config.model}:latest"}]})
+                elif path == "/api/ps":
+                    await self._send_json(writer, {"models": [{"name": f"{self.config.model}:latest", "model": f"{self.config.model}:latest"}]})
+                elif path == "/api/version":
+                    await self._send_json(writer, {"version": "0.0.0-fake"})
+                else:
+                    await self._send_json(writer, {"error": f"unknown path {path}"}, status=404)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            self.connections.discard(task)
+            writer.close()
+
+    async def _send_json(self, writer: asyncio.StreamWriter, payload: dict, status: int = 200) -> None:
+        """
+        Send a complete JSON response
+        @param writer: Connection writer
+        @param payload: JSON serializable response body
+        @param status: HTTP status code
+        """
+        body = json.dumps(payload).encode()
+        reason = "OK" if status == 200 else "Error"
+        writer.write(
+            f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+
+    def _prefill_seconds(self, request: dict) -> float:
+        """
+        Time to evaluate the prompt, growing with its size when a prefill rate is set
+        @param request: Decoded chat request
+        @returns: Seconds before the first token
+        """
+        if self.config.prefill_rate <= 0:
+            return self.config.prefill_delay
+        # Same rough estimate of 4 characters per token the server uses
+        characters = sum(len(message.get("content") or "") for message in request.get("messages", []))
+        return self.config.prefill_delay + characters / 4 / self.config.prefill_rate
+
+    def _chunk(self, content: str, done: bool, started: float, prefill: float = 0.0) -> dict:
+        """Build one chat response object in Ollama's format"""
+        chunk = {
+            "model": self.config.model,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "message": {"role": "assistant", "content": content},
+            "done": done,
+        }
+        if done:
+            elapsed = int((time.perf_counter() - started) * 1e9)
+            chunk.update({
+                "done_reason": "stop",
+                "total_duration": elapsed,
+                "prompt_eval_count": 1,
+                "prompt_eval_duration": int(prefill * 1e9),
+                "eval_count": self.config.response_tokens,
+                "eval_duration": max(elapsed - int(prefill * 1e9), 0),
+            })
+        return chunk
+
+    async def _chat(self, writer: asyncio.StreamWriter, request: dict) -> None:
+        """
+        Answer a chat request, streamed as NDJSON or as a single object
+        @param writer: Connection writer
+        @param request: Decoded request body
+        """
+        self.requests += 1
+        self.active += 1
+        started = time.perf_counter()
+        try:
+            # An empty message list only loads the model
+            if not request.get("messages"):
+                await self._send_json(writer, self._chunk("", True, started))
+                return
+
+            failure = self.random.random()
+            if failure < self.config.error_rate:
+                self.failures += 1
+                await self._send_json(writer, {"error": "injected failure"}, status=500)
+                return
+            drop = failure < self.config.error_rate + self.config.drop_rate
+
+            prefill = self._prefill_seconds(request)
+            await asyncio.sleep(prefill)
+            token_delay = 1.0 / self.config.tokens_per_second if self.config.tokens_per_second > 0 else 0.0
+            tokens = [f"tok{i} " for i in range(self.config.response_tokens)]
+
+            if request.get("stream", True):
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nTransfer-Encoding: chunked\r\n\r\n")
+                for index, token in enumerate(tokens):
+                    if drop and index == len(tokens) // 2:
+                        self.failures += 1
+                        # Leaves the client with a truncated chunked response
+                        writer.close()
+                        raise ConnectionResetError("injected disconnect")
+                    await self._write_chunk(writer, self._chunk(token, False, started))
+                    await asyncio.sleep(token_delay)
+                await self._write_chunk(writer, self._chunk("", True, started, prefill))
+                writer.write(b"0\r\n\r\n")
+                await writer.drain()
+            else:
+                await asyncio.sleep(token_delay * len(tokens))
+                if drop:
+                    self.failures += 1
+                    writer.close()
+                    raise ConnectionResetError("injected disconnect")
+                await self._send_json(writer, self._chunk("".join(tokens), True, started, prefill))
+        finally:
+            self.active -= 1
+
+    async def _write_chunk(self, writer: asyncio.StreamWriter, payload: dict) -> None:
+        """Write one NDJSON line as an HTTP chunk"""
+        line = json.dumps(payload).encode() + b"\n"
+        writer.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+        await writer.drain()
+
+
+class FakeOllamaThread:
+    """
+    Runs a FakeOllama server on its own event loop in a background thread,
+    so that blocking clients in the main thread cannot stall it.
+    """
+    def __init__(self, config: Optional[FakeOllamaConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        """
+        Initialize the threaded server
+        @param config: Timing and reply settings
+        @param host: Interface to bind to
+        @param port: Port to bind to, 0 selects a free port
+        """
+        self.server = FakeOllama(host, port, config)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        """Base URL of the running server"""
+        return self.server.url
+
+    def start(self) -> None:
+        """Start the loop thread and wait until the server is listening"""
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self.server.start(), self.loop).result()
+
+    def stop(self) -> None:
+        """Stop the server and its loop thread"""
+        asyncio.run_coroutine_threadsafe(self.server.stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+async def serve(host: str, port: int, config: FakeOllamaConfig) -> None:
+    """Run the fake server until cancelled"""
+    server = FakeOllama(host, port, config)
+    await server.start()
+    print(f"Fake Ollama listening on {server.url}")
+    try:
+        await asyncio.Future()
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a fake Ollama server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--prefill-delay", type=float, default=0.5)
+    parser.add_argument("--prefill-rate", type=float, default=0.0, help="Prompt tokens per second, 0 ignores prompt size")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--response-tokens", type=int, default=20)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of chat requests failing with HTTP 500")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="Share of chat requests dropped mid-stream")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args.host, args.port, FakeOllamaConfig(
+            prefill_delay=args.prefill_delay,
+            prefill_rate=args.prefill_rate,
+            tokens_per_second=args.tokens_per_second,
+            response_tokens=args.response_tokens,
+            error_rate=args.error_rate,
+            drop_rate=args.drop_rate,
+            seed=args.seed,
+        )))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,129 @@
+"""
+Benchmark for concurrent LLM generation.
+Runs N simulated sessions against a local fake Ollama server and reports the
+aggregate throughput together with the worst event loop stall observed while
+the generations were in flight.
+
+Usage:
+    python benchmarks/llm_concurrency.py --sessions 1 5 20 --requests 3
+"""
+
+import argparse
+import asyncio
+import logging
+import sys
+import time
+from pathlib import Path
+
+# Make the server modules importable the same way server/main.py does
+server_dir = Path(__file__).resolve().parent.parent / "server"
+sys.path.insert(0, str(server_dir))
+
+from modules.config.config import Config
+from modules.utils.logger import logger
+from modules.llm.llm import LLM
+
+from fake_ollama import FakeOllamaConfig, FakeOllamaThread
+
+
+class BlockingLLM(LLM):
+    """
+    Reproduces the previous behaviour of calling the synchronous client
+    from inside the coroutine, used as the baseline for comparison.
+    """
+    def __init__(self):
+        super().__init__()
+        from ollama import Client
+        self.sync_client = Client(host=Config.LLM_HOSTS[0])
+        self.history = {}
+
+    async def generate_response(self, session_id: str, prompt: str) -> dict:
+        messages = self.history.setdefault(session_id, [])
+        messages.append({"role": "user", "content": prompt})
+        response = self.sync_client.chat(model=Config.LLM_MODEL, messages=messages, stream=False)
+        messages.append(response["message"])
+        return {"session_id": session_id, "message": response["message"]["content"]}
+
+
+async def measure_loop_lag(stop: asyncio.Event, interval: float = 0.01) -> float:
+    """
+    Measure the largest delay between scheduled wake-ups of the event loop
+    @param stop: Event that ends the measurement
+    @param interval: Sleep interval between samples
+    @returns: Worst observed lag in seconds
+    """
+    worst = 0.0
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - started - interval)
+    return worst
+
+
+async def run_sessions(llm: LLM, sessions: int, requests: int) -> dict:
+    """
+    Run the given number of sessions concurrently, each sending several prompts
+    @param llm: LLM service under test
+    @param sessions: Number of concurrent sessions
+    @param requests: Prompts sent sequentially by every session
+    @returns: Benchmark result for this run
+    """
+    async def session(index: int) -> None:
+        for turn in range(requests):
+            await llm.generate_response(f"bench-{index}", f"Question {turn} from session {index}")
+
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(measure_loop_lag(stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(session(i) for i in range(sessions)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    worst_lag = await lag_task
+
+    total = sessions * requests
+    return {
+        "sessions": sessions,
+        "requests": total,
+        "seconds": elapsed,
+        "throughput": total / elapsed,
+        "max_loop_lag": worst_lag,
+    }
+
+
+async def main(args: argparse.Namespace) -> None:
+    # The fake server runs in its own thread so the blocking baseline cannot stall it
+    fake = FakeOllamaThread(FakeOllamaConfig(
+        prefill_delay=args.prefill_delay,
+        tokens_per_second=args.tokens_per_second,
+        response_tokens=args.response_tokens,
+    ))
+    fake.start()
+    Config.LLM_HOSTS = [fake.url]
+    logger.setLevel(logging.WARNING)
+
+    implementations = [("async", LLM)]
+    if args.baseline:
+        implementations.insert(0, ("blocking", BlockingLLM))
+
+    print(f"{'impl':>9} {'sessions':>8} {'requests':>8} {'seconds':>8} {'req/s':>8} {'max lag':>8}")
+    try:
+        for name, implementation in implementations:
+            for sessions in args.sessions:
+                result = await run_sessions(implementation(), sessions, args.requests)
+                print(
+                    f"{name:>9} {result['sessions']:>8} {result['requests']:>8} "
+                    f"{result['seconds']:>8.2f} {result['throughput']:>8.2f} {result['max_loop_lag']:>7.3f}s"
+                )
+    finally:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark concurrent LLM generation")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 5, 20])
+    parser.add_argument("--requests", type=int, default=3, help="Prompts per session")
+    parser.add_argument("--prefill-delay", type=float, default=0.2)
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--response-tokens", type=int, default=20)
+    parser.add_argument("--baseline", action="store_true", help="Also run the blocking client for comparison")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,455 @@
+"""
+Load test for the WebSocket server.
+Starts server/main.py against a local fake Ollama server and drives N
+concurrent simulated extension clients, each sending a series of prompts
+drawn from a mix of sizes, from a short question to several large source
+files. Reports latency and time-to-first-token percentiles, throughput,
+errors and the resident memory of the server processes. Everything runs
+locally, no model or network access is needed.
+
+Usage:
+    python benchmarks/load_test.py --clients 50 --requests 5 --mix small=6 medium=3 large=1
+    python benchmarks/load_test.py --clients 20 --error-rate 0.05 --drop-rate 0.05 --output load.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import websockets
+
+from fake_ollama import FakeOllamaConfig, FakeOllamaThread
+
+server_dir = Path(__file__).resolve().parent.parent / "server"
+
+
+@dataclass
+class Profile:
+    """Shape of one kind of prompt"""
+    files: int        # Number of attached files
+    file_bytes: int   # Size of every attached file
+    words: int        # Length of the question
+
+
+PROFILES: Dict[str, Profile] = {
+    "small": Profile(files=0, file_bytes=0, words=12),
+    "medium": Profile(files=2, file_bytes=8_000, words=40),
+    "large": Profile(files=4, file_bytes=60_000, words=80),
+}
+
+
+@dataclass
+class Sample:
+    """Outcome of a single prompt"""
+    profile: str
+    ok: bool
+    latency: Optional[float] = None  # Seconds from sending the prompt to the final response
+    ttft: Optional[float] = None     # Seconds from sending the prompt to the first chunk or response
+    chunks: int = 0
+    error: Optional[str] = None
+
+
+@dataclass
+class MemoryStats:
+    """Resident memory of the server process tree in bytes"""
+    idle: Optional[int] = None
+    peak: Optional[int] = None
+    end: Optional[int] = None
+    samples: List[int] = field(default_factory=list)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def process_tree_rss(pid: int) -> Optional[int]:
+    """
+    Resident memory of a process and all its descendants, e.g. the worker processes
+    @param pid: Root process
+    @returns: Bytes, None if it cannot be determined on this platform
+    """
+    try:
+        output = subprocess.run(
+            ["ps", "-A", "-o", "pid=,ppid=,rss="], capture_output=True, text=True, check=True
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    children: Dict[int, List[int]] = {}
+    rss: Dict[int, int] = {}
+    for line in output.splitlines():
+        parts = line.split()
+        if len(parts) != 3:
+            continue
+        child, parent, kilobytes = (int(part) for part in parts)
+        children.setdefault(parent, []).append(child)
+        rss[child] = kilobytes * 1024
+    if pid not in rss:
+        return None
+    total, pending = 0, [pid]
+    while pending:
+        current = pending.pop()
+        total += rss.get(current, 0)
+        pending.extend(children.get(current, ()))
+    return total
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """
+    Nearest-rank percentile
+    @param values: Observations
+    @param pct: Percentile between 0 and 100
+    @returns: The percentile, None without observations
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(int(round(pct / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+class SourcePool:
+    """Builds attachments of a given size from the server's own source files"""
+    def __init__(self, rng: random.Random):
+        self.rng = rng
+        self.sources = [
+            (path.name, path.read_text(encoding="utf-8"))
+            for path in sorted(server_dir.rglob("*.py"))
+            if path.stat().st_size > 0
+        ]
+
+    def file(self, size: int) -> dict:
+        """
+        Pick a source file and repeat or cut it to the requested size
+        @param size: Characters of content
+        @returns: Attachment in the extension's format
+        """
+        name, content = self.rng.choice(self.sources)
+        repeated = content * (size // len(content) + 1)
+        # Cut at a line break so large Python files stay parseable
+        cut = repeated.rfind("\n", 0, size) + 1 or size
+        return {"filename": name, "content": repeated[:cut]}
+
+    def question(self, words: int) -> str:
+        vocabulary = ("why", "does", "this", "function", "fail", "when", "the", "session", "is", "resumed",
+                      "after", "a", "reconnect", "and", "how", "can", "I", "fix", "it", "safely")
+        return " ".join(self.rng.choice(vocabulary) for _ in range(words)) + "?"
+
+
+def build_message(pool: SourcePool, profile: Profile, stream: bool) -> dict:
+    message = {"message": pool.question(profile.words), "stream": stream}
+    if profile.files:
+        message["files"] = [pool.file(profile.file_bytes) for _ in range(profile.files)]
+    return message
+
+
+async def ask(websocket, frame: str, sample: Sample) -> None:
+    """
+    Send a prompt and read replies until the final response or an error
+    @param websocket: Open client connection
+    @param frame: Encoded prompt
+    @param sample: Filled in with the timings and outcome
+    """
+    sent = time.perf_counter()
+    await websocket.send(frame)
+    while True:
+        reply = json.loads(await websocket.recv())
+        kind = reply.get("type")
+        if kind in ("response_chunk", "response") and sample.ttft is None:
+            sample.ttft = time.perf_counter() - sent
+        if kind == "response_chunk":
+            sample.chunks += 1
+        elif kind == "response":
+            sample.latency = time.perf_counter() - sent
+            # The server answers failed generations with a response carrying the error text
+            sample.ok = not reply.get("message", "").startswith("Error generating response")
+            if not sample.ok:
+                sample.error = "llm"
+            return
+        elif kind == "error":
+            sample.latency = time.perf_counter() - sent
+            sample.error = reply.get("message", "error")
+            return
+
+
+async def run_client(index: int, url: str, plan: List[str], args: argparse.Namespace,
+                     samples: List[Sample]) -> None:
+    """
+    Simulate one extension client sending its prompts one after another
+    @param index: Client number, used to stagger the start
+    @param url: Server URL
+    @param plan: Profile names of the prompts to send
+    @param args: Command line arguments
+    @param samples: Receives one sample per prompt
+    """
+    rng = random.Random(f"{args.seed}-{index}")
+    pool = SourcePool(rng)
+    await asyncio.sleep(args.ramp * index / max(args.clients, 1))
+    answered = 0
+    try:
+        async with websockets.connect(url, max_size=None, open_timeout=args.timeout) as websocket:
+            json.loads(await websocket.recv())  # Session announcement
+            for position, name in enumerate(plan):
+                sample = Sample(profile=name, ok=False)
+                frame = json.dumps(build_message(pool, PROFILES[name], not args.no_stream))
+                try:
+                    await asyncio.wait_for(ask(websocket, frame, sample), args.timeout)
+                except asyncio.TimeoutError:
+                    sample.error = "timeout"
+                samples.append(sample)
+                answered += 1
+                if sample.error == "timeout":
+                    # Replies of the timed out prompt would be mistaken for the next one's
+                    samples.extend(Sample(profile=rest, ok=False, error="skipped") for rest in plan[position + 1:])
+                    return
+                if args.think_time:
+                    await asyncio.sleep(rng.expovariate(1 / args.think_time))
+    except (OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException) as e:
+        error = f"connection: {type(e).__name__}"
+        samples.extend(Sample(profile=name, ok=False, error=error) for name in plan[answered:])
+
+
+async def sample_memory(pid: int, stats: MemoryStats, stop: asyncio.Event, interval: float) -> None:
+    """
+    Record the server's resident memory until stopped
+    @param pid: Server process
+    @param stats: Receives the samples and the peak
+    @param stop: Event that ends the sampling
+    @param interval: Seconds between samples
+    """
+    while not stop.is_set():
+        rss = await asyncio.to_thread(process_tree_rss, pid)
+        if rss is not None:
+            stats.samples.append(rss)
+            stats.peak = max(stats.peak or 0, rss)
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+class ServerProcess:
+    """server/main.py running as a child process"""
+    def __init__(self, port: int, ollama_url: str, args: argparse.Namespace):
+        self.port = port
+        self.workers = args.workers
+        self.env = {
+            **os.environ,
+            "SERVER_PORT": str(port),
+            "SERVER_WORKERS": str(args.workers),
+            "OLLAMA_HOSTS": ollama_url,
+            "LOG_LEVEL": args.server_log_level,
+            "TRACE_FILE": args.traces or "",
+        }
+        self.log_path = args.server_log
+        self.process: Optional[subprocess.Popen] = None
+
+    @property
+    def pid(self) -> int:
+        return self.process.pid
+
+    async def start(self, timeout: float) -> None:
+        """
+        Start the server and wait until it accepts connections
+        @param timeout: Seconds to wait for the port to open
+        @raises RuntimeError: If the server exits or does not open the port in time
+        """
+        log = open(self.log_path, "ab")
+        self.process = subprocess.Popen(
+            [sys.executable, "main.py"], cwd=server_dir, env=self.env, stdout=log, stderr=subprocess.STDOUT
+        )
+        log.close()
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Server exited with code {self.process.returncode}, see {self.log_path}")
+            try:
+                # A complete handshake, a bare TCP probe makes the server log a failed handshake
+                async with websockets.connect(f"ws://127.0.0.1:{self.port}", open_timeout=5):
+                    return
+            except (OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException):
+                await asyncio.sleep(0.2)
+        raise RuntimeError(f"Server did not open port {self.port} within {timeout:.0f}s")
+
+    def stop(self) -> None:
+        """Shut the server down the way an operator would, killing it if it hangs"""
+        if self.process is None or self.process.poll() is not None:
+            return
+        if os.name == "nt":
+            self.process.terminate()
+        else:
+            # The worker supervisor forwards SIGTERM, a single process handles Ctrl+C
+            self.process.send_signal(signal.SIGTERM if self.workers > 1 else signal.SIGINT)
+        try:
+            self.process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+def make_plan(args: argparse.Namespace) -> List[List[str]]:
+    """
+    Draw the profile of every prompt of every client from the mix
+    @param args: Command line arguments
+    @returns: Profile names per client
+    """
+    weights = {}
+    for entry in args.mix:
+        name, _, weight = entry.partition("=")
+        if name not in PROFILES:
+            raise SystemExit(f"Unknown profile {name}, choose from {', '.join(PROFILES)}")
+        weights[name] = float(weight or 1)
+    rng = random.Random(args.seed)
+    names, values = list(weights), list(weights.values())
+    return [rng.choices(names, values, k=args.requests) for _ in range(args.clients)]
+
+
+def summarize(samples: List[Sample], elapsed: float) -> dict:
+    """
+    Aggregate samples into percentiles, throughput and error counts
+    @param samples: Outcomes of the prompts
+    @param elapsed: Wall time of the load phase in seconds
+    @returns: Summary
+    """
+    ok = [sample for sample in samples if sample.ok]
+    latencies = [sample.latency for sample in ok]
+    ttfts = [sample.ttft for sample in ok if sample.ttft is not None]
+    errors: Dict[str, int] = {}
+    for sample in samples:
+        if not sample.ok:
+            errors[sample.error or "unknown"] = errors.get(sample.error or "unknown", 0) + 1
+    return {
+        "requests": len(samples),
+        "ok": len(ok),
+        "errors": errors,
+        "latency": {f"p{pct}": percentile(latencies, pct) for pct in (50, 95, 99)},
+        "ttft": {f"p{pct}": percentile(ttfts, pct) for pct in (50, 95, 99)},
+        "throughput": len(ok) / elapsed if elapsed else 0.0,
+        "chunks_per_second": sum(sample.chunks for sample in ok) / elapsed if elapsed else 0.0,
+    }
+
+
+def _ms(value: Optional[float]) -> str:
+    return f"{value * 1000:>8.0f}" if value is not None else f"{'-':>8}"
+
+
+def _mb(value: Optional[int]) -> str:
+    return f"{value / 2**20:.1f} MB" if value is not None else "n/a"
+
+
+def report(summary: dict, by_profile: Dict[str, dict], memory: MemoryStats, elapsed: float) -> None:
+    print(f"\n{'profile':>8} {'reqs':>6} {'ok':>6} {'lat p50':>8} {'p95':>8} {'p99':>8} "
+          f"{'ttft p50':>8} {'p95':>8} {'p99':>8}  (ms)")
+    for name, result in [*by_profile.items(), ("all", summary)]:
+        print(
+            f"{name:>8} {result['requests']:>6} {result['ok']:>6} "
+            f"{_ms(result['latency']['p50'])} {_ms(result['latency']['p95'])} {_ms(result['latency']['p99'])} "
+            f"{_ms(result['ttft']['p50'])} {_ms(result['ttft']['p95'])} {_ms(result['ttft']['p99'])}"
+        )
+    print(f"\nElapsed {elapsed:.2f}s, {summary['throughput']:.2f} req/s, {summary['chunks_per_second']:.1f} chunks/s")
+    if summary["errors"]:
+        print("Errors: " + ", ".join(f"{name} {count}" for name, count in sorted(summary["errors"].items())))
+    print(f"Server RSS: idle {_mb(memory.idle)}, peak {_mb(memory.peak)}, end {_mb(memory.end)}")
+
+
+async def main(args: argparse.Namespace) -> None:
+    fake = FakeOllamaThread(FakeOllamaConfig(
+        prefill_delay=args.prefill_delay,
+        prefill_rate=args.prefill_rate,
+        tokens_per_second=args.tokens_per_second,
+        response_tokens=args.response_tokens,
+        error_rate=args.error_rate,
+        drop_rate=args.drop_rate,
+        seed=args.seed,
+    ))
+    fake.start()
+    server = None
+    memory = MemoryStats()
+    try:
+        if args.url:
+            url = args.url
+        else:
+            port = args.port or free_port()
+            server = ServerProcess(port, fake.url, args)
+            await server.start(args.startup_timeout)
+            url = f"ws://127.0.0.1:{port}"
+            memory.idle = process_tree_rss(server.pid)
+        print(f"{args.clients} clients x {args.requests} prompts against {url}, fake Ollama at {fake.url}")
+
+        plans = make_plan(args)
+        samples: List[Sample] = []
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(sample_memory(server.pid, memory, stop, args.memory_interval)) if server else None
+        started = time.perf_counter()
+        await asyncio.gather(*(run_client(index, url, plan, args, samples) for index, plan in enumerate(plans)))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        if sampler is not None:
+            await sampler
+            memory.end = process_tree_rss(server.pid)
+    finally:
+        if server is not None:
+            server.stop()
+        fake.stop()
+
+    summary = summarize(samples, elapsed)
+    by_profile = {
+        name: summarize([sample for sample in samples if sample.profile == name], elapsed)
+        for name in PROFILES if any(sample.profile == name for sample in samples)
+    }
+    report(summary, by_profile, memory, elapsed)
+    print(f"Fake Ollama served {fake.server.requests} chat requests, {fake.server.failures} injected failures")
+
+    if args.output:
+        result = {
+            "arguments": vars(args),
+            "elapsed": elapsed,
+            "summary": summary,
+            "profiles": by_profile,
+            "memory": {key: value for key, value in asdict(memory).items() if key != "samples"},
+            "memory_samples": memory.samples,
+        }
+        Path(args.output).write_text(json.dumps(result, indent=2), encoding="utf-8")
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the server with simulated extension clients")
+    parser.add_argument("--clients", type=int, default=20, help="Concurrent client connections")
+    parser.add_argument("--requests", type=int, default=5, help="Prompts sent by every client")
+    parser.add_argument("--mix", nargs="+", default=["small=6", "medium=3", "large=1"],
+                        help=f"Weighted prompt profiles as name=weight, profiles: {', '.join(PROFILES)}")
+    parser.add_argument("--no-stream", action="store_true", help="Ask for complete responses instead of chunks")
+    parser.add_argument("--ramp", type=float, default=1.0, help="Seconds over which the clients connect")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Mean seconds a client waits between prompts")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Seconds a single prompt may take")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    # Server under test
+    parser.add_argument("--url", help="Test an already running server instead of starting one, RSS is not reported")
+    parser.add_argument("--port", type=int, default=0, help="Port for the started server, 0 picks a free one")
+    parser.add_argument("--workers", type=int, default=1, help="Server worker processes")
+    parser.add_argument("--server-log", default=os.devnull, help="File receiving the server's output")
+    parser.add_argument("--server-log-level", default="WARNING")
+    parser.add_argument("--traces", help="Trace file of the started server, disabled by default")
+    parser.add_argument("--startup-timeout", type=float, default=60.0)
+    parser.add_argument("--memory-interval", type=float, default=0.5, help="Seconds between RSS samples")
+    # Fake Ollama
+    parser.add_argument("--prefill-delay", type=float, default=0.2)
+    parser.add_argument("--prefill-rate", type=float, default=5000.0, help="Prompt tokens per second, 0 ignores prompt size")
+    parser.add_argument("--tokens-per-second", type=float, default=100.0)
+    parser.add_argument("--response-tokens", type=int, default=40)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of chat requests failing with HTTP 500")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="Share of chat requests dropped mid-stream")
+    asyncio.run(main(parser.parse_args()))
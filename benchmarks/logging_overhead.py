@@ -0,0 +1,126 @@
+"""
+Benchmark for the logging pipeline.
+Measures the time a log call costs the calling thread (the event loop in the
+server) for the previous synchronous setup, a colorlog handler on the logger
+with f-string messages, and for the queued setup with lazy formatting,
+truncation and per call site rate limits. The time the background thread
+needs to drain the queue is reported separately.
+
+Output goes to os.devnull so terminal speed does not distort the numbers.
+
+Usage:
+    python benchmarks/logging_overhead.py --count 2000 --payload 1000000
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Tuple
+
+# Make the server modules importable the same way server/main.py does
+server_dir = Path(__file__).resolve().parent.parent / "server"
+sys.path.insert(0, str(server_dir))
+
+import colorlog
+
+from modules.config.config import Config
+from modules.utils.logger import RateLimitFilter, TruncateFilter, queued
+
+
+def make_handler(stream) -> logging.Handler:
+    """
+    Build the colored console handler the server uses
+    @param stream: Output stream
+    @returns: The handler
+    """
+    handler = colorlog.StreamHandler(stream)
+    handler.setFormatter(colorlog.ColoredFormatter(
+        '%(log_color)s%(asctime)s - %(filename)s[%(lineno)d]\t- %(levelname)s | %(message)s',
+        datefmt='%H:%M:%S'
+    ))
+    return handler
+
+
+def make_logger(name: str, level: int) -> logging.Logger:
+    logger = logging.getLogger(name)
+    logger.handlers.clear()
+    logger.propagate = False
+    logger.setLevel(level)
+    return logger
+
+
+def synchronous(stream, level: int) -> Tuple[logging.Logger, Callable[[], None]]:
+    """The previous setup: formatting and I/O in the calling thread"""
+    logger = make_logger("bench.sync", level)
+    logger.addHandler(make_handler(stream))
+    return logger, lambda: None
+
+
+def pipelined(stream, level: int, rate_limit: int) -> Tuple[logging.Logger, Callable[[], None]]:
+    """The queued setup as configured in modules.utils.logger"""
+    logger = make_logger(f"bench.queued.{rate_limit}", level)
+    handler = make_handler(stream)
+    handler.addFilter(TruncateFilter(Config.LOG_MAX_MESSAGE_CHARS))
+    queue_handler = queued(handler)
+    queue_handler.addFilter(RateLimitFilter(rate_limit))
+    logger.addHandler(queue_handler)
+
+    def drain() -> None:
+        # Wait until the listener has written everything that was queued
+        while not queue_handler.queue.empty():
+            time.sleep(0.001)
+
+    return logger, drain
+
+
+def run(name: str, logger: logging.Logger, drain: Callable[[], None], data: dict, count: int, lazy: bool) -> None:
+    """
+    Log a message many times and print the cost per call
+    @param name: Label of the setup
+    @param logger: Logger under test
+    @param drain: Waits until background output is complete
+    @param data: Payload logged with every message
+    @param count: Number of log calls
+    @param lazy: Pass the payload as an argument instead of formatting it into an f-string
+    """
+    started = time.perf_counter()
+    for _ in range(count):
+        if lazy:
+            logger.debug("Received message: %s", data)
+        else:
+            logger.debug(f"Received message: {data}")
+    called = time.perf_counter()
+    drain()
+    drained = time.perf_counter()
+    level = logging.getLevelName(logger.level)
+    print(
+        f"{name:>22} {level:>6} {(called - started) / count * 1e6:>12.1f} "
+        f"{(drained - started) / count * 1e6:>12.1f}"
+    )
+
+
+def main(args: argparse.Namespace) -> None:
+    data = {
+        "message": "Why does this crash?",
+        "files": [{"filename": "big.py", "content": "x = 1\n" * (args.payload // 6)}],
+    }
+    print(f"{args.count} calls, payload {args.payload} bytes")
+    print(f"{'setup':>22} {'level':>6} {'caller us':>12} {'total us':>12}")
+    with open(os.devnull, "w") as stream:
+        for level in (logging.DEBUG, logging.INFO):
+            logger, drain = synchronous(stream, level)
+            run("sync f-string", logger, drain, data, args.count, lazy=False)
+            logger, drain = pipelined(stream, level, rate_limit=0)
+            run("queued lazy", logger, drain, data, args.count, lazy=True)
+            logger, drain = pipelined(stream, level, rate_limit=Config.LOG_RATE_LIMIT)
+            run("queued lazy, limited", logger, drain, data, args.count, lazy=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the per-message cost of logging")
+    parser.add_argument("--count", type=int, default=2000, help="Log calls per setup")
+    parser.add_argument("--payload", type=int, default=1_000_000, help="Bytes of file content in the logged message")
+    main(parser.parse_args())
@@ -0,0 +1,295 @@
+"""
+Microbenchmarks for the pure-Python hot paths.
+Times prompt assembly with many or large files, session churn, history
+trimming, transcription segment handling in the extension client and its
+int16 to float32 audio conversion. Every benchmark reports the time per
+operation over several repeats, and the results are written as JSON together
+with the commit and machine they were measured on, so runs of two commits
+on the same machine can be compared.
+
+Usage:
+    python benchmarks/microbench.py
+    python benchmarks/microbench.py --filter prompt --compare benchmarks/results/1a2b3c4.json
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import timeit
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, List
+
+# Make the server modules importable the same way server/main.py does
+root_dir = Path(__file__).resolve().parent.parent
+server_dir = root_dir / "server"
+sys.path.insert(0, str(server_dir))
+sys.path.insert(0, str(root_dir / "extension" / "python"))
+
+from modules.config.config import Config
+from modules.utils.logger import logger
+from modules.api.message_handler import MessageHandler
+from modules.api.session import SessionManager
+from modules.conversation.store import Conversation
+
+try:
+    import client as extension_client
+except ImportError as e:  # numpy and pyaudio are only installed with the extension's requirements
+    extension_client = None
+    extension_error = str(e)
+
+
+@dataclass
+class Benchmark:
+    name: str
+    setup: Callable[..., Callable[[], object]]  # Builds the operation to time from the parameters
+    params: Dict[str, object] = field(default_factory=dict)
+    requires_client: bool = False
+
+
+BENCHMARKS: List[Benchmark] = []
+
+
+def benchmark(name: str, requires_client: bool = False, **params):
+    """
+    Register a benchmark
+    @param name: Unique name, used for filtering and comparing
+    @param requires_client: Needs the extension client module and its dependencies
+    @param params: Arguments passed to the decorated setup function
+    """
+    def register(setup):
+        BENCHMARKS.append(Benchmark(name, setup, params, requires_client))
+        return setup
+    return register
+
+
+def source_files(count: int, size: int, seed: int = 0) -> List[dict]:
+    """
+    Attachments built from the server's own source files
+    @param count: Number of files
+    @param size: Characters per file, sources are repeated or cut to it at a line break
+    @param seed: Selects the source files
+    @returns: Files in the extension's format
+    """
+    rng = random.Random(seed)
+    sources = [path for path in sorted(server_dir.rglob("*.py")) if path.stat().st_size > 0]
+    files = []
+    for index in range(count):
+        path = rng.choice(sources)
+        content = path.read_text(encoding="utf-8")
+        repeated = content * (size // len(content) + 1)
+        cut = repeated.rfind("\n", 0, size) + 1 or size
+        files.append({"filename": f"{index}_{path.name}", "content": repeated[:cut]})
+    return files
+
+
+def assemble(handler: MessageHandler, session_id: str, message: str, files: List[dict]) -> str:
+    """
+    Run the synchronous prompt stages of MessageHandler.process_message
+    @returns: The prompt
+    """
+    # The decoder hands every prompt over as fresh dicts
+    data = {"message": message, "files": [dict(file) for file in files]}
+    data = handler.resolve_patches(session_id, data)
+    if Config.OUTLINE_ENABLED and any(handler.needs_outline(file) for file in data["files"]):
+        handler.outline_files(data)
+    indexed = handler.index_files(session_id, data) if Config.RETRIEVAL_ENABLED else None
+    prompt, _, _ = handler.build_prompt(session_id, data, indexed)
+    return prompt
+
+
+@benchmark("prompt.large_files", files=4, size=200_000)
+@benchmark("prompt.many_files", files=100, size=2_000)
+def prompt_assembly(files: int, size: int):
+    sessions = SessionManager()
+    handler = MessageHandler(sessions, None)
+    session_id = sessions.create_session()
+    attached = source_files(files, size)
+    return lambda: assemble(handler, session_id, "Why does the reconnect fail?", attached)
+
+
+@benchmark("prompt.resent_files", files=20, size=8_000)
+def prompt_resent(files: int, size: int):
+    """Files already held in the history, as on every follow-up question"""
+    sessions = SessionManager()
+    handler = MessageHandler(sessions, None)
+    session_id = sessions.create_session()
+    attached = source_files(files, size)
+    prompt = assemble(handler, session_id, "First question", attached)
+    # Record the first prompt the way the LLM service does, so the files are referred back to
+    hashes = [hashlib.sha256(file["content"].encode("utf-8")).hexdigest() for file in attached]
+    sessions.store.get_or_create(session_id).append("user", prompt, hashes)
+    return lambda: assemble(handler, session_id, "And what about this?", attached)
+
+
+@benchmark("session.churn", messages=5)
+def session_churn(messages: int):
+    """Create a session, store a few messages and close it again"""
+    sessions = SessionManager()
+
+    def churn():
+        session_id = sessions.create_session()
+        # Messages are recorded the way the LLM service does it
+        conversation = sessions.store.get_or_create(session_id)
+        for index in range(messages):
+            conversation.append("user", f"Message {index} of the session")
+            sessions.store.evict()
+        sessions.close_session(session_id)
+    return churn
+
+
+@benchmark("history.trim_large", message_tokens=2_000)
+@benchmark("history.trim_small", message_tokens=50)
+def history_trim(message_tokens: int):
+    """Append to a conversation at its token budget, as every prompt and reply does"""
+    conversation = Conversation()
+    content = "word " * (message_tokens * 4 // 5)
+    # Fill the history until appending starts to trim
+    for _ in range(conversation.budget // message_tokens + 2):
+        conversation.append("user", content)
+
+    def append():
+        conversation.append("user", content)
+        conversation.append("assistant", content)
+    return append
+
+
+@benchmark("transcription.segments", requires_client=True, segments=500)
+def transcription_segments(segments: int):
+    # Without __init__, which would start the connection thread
+    transcriber = extension_client.TranscriptionClient.__new__(extension_client.TranscriptionClient)
+    transcriber.current_session_id = "bench"
+    transcriber.current_transcription = None
+    message = json.dumps({
+        "uid": "bench",
+        "segments": [
+            {"start": f"{index * 1.5:.3f}", "end": f"{index * 1.5 + 1.4:.3f}", "text": f" segment number {index} of the talk "}
+            for index in range(segments)
+        ]
+    })
+    return lambda: transcriber.process_transcription(message)
+
+
+@benchmark("audio.pcm16_to_float32_1s", requires_client=True, frames=16_000)
+@benchmark("audio.pcm16_to_float32", requires_client=True, frames=1024)
+def audio_conversion(frames: int):
+    """One PyAudio buffer as recorded by the client, and one second of audio"""
+    data = random.Random(0).randbytes(frames * 2)
+    return lambda: extension_client.pcm16_to_float32(data)
+
+
+def measure(operation: Callable[[], object], repeat: int, min_time: float) -> Dict[str, float]:
+    """
+    Time an operation
+    @param operation: Callable running one operation
+    @param repeat: Number of timed rounds
+    @param min_time: Seconds every round should take at least
+    @returns: Statistics of the seconds per operation
+    """
+    timer = timeit.Timer(operation)
+    number = 1
+    while True:
+        if timer.timeit(number) >= min_time:
+            break
+        number *= 2
+    per_op = [total / number for total in timer.repeat(repeat=repeat, number=number)]
+    return {
+        "number": number,
+        "min": min(per_op),
+        "median": statistics.median(per_op),
+        "mean": statistics.mean(per_op),
+        "stdev": statistics.stdev(per_op) if len(per_op) > 1 else 0.0,
+    }
+
+
+def git_revision() -> Dict[str, object]:
+    def git(*args: str) -> str:
+        return subprocess.run(["git", *args], cwd=root_dir, capture_output=True, text=True).stdout.strip()
+    try:
+        return {"commit": git("rev-parse", "HEAD") or None, "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+    except OSError:
+        return {"commit": None, "dirty": None}
+
+
+def machine() -> Dict[str, str]:
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "node": platform.node(),
+    }
+
+
+def compare(results: Dict[str, dict], baseline_path: str, threshold: float) -> None:
+    """
+    Print the change of every benchmark against an earlier run
+    @param results: Current results by benchmark name
+    @param baseline_path: JSON file of the earlier run
+    @param threshold: Relative slowdown of the median reported as a regression
+    """
+    baseline = json.loads(Path(baseline_path).read_text(encoding="utf-8"))
+    if baseline.get("machine", {}).get("node") != machine()["node"]:
+        print("Warning: the baseline was measured on a different machine")
+    print(f"\nCompared to {baseline.get('revision', {}).get('commit') or baseline_path}")
+    for name, result in results.items():
+        previous = baseline.get("benchmarks", {}).get(name)
+        if not previous or "median" not in previous or "median" not in result:
+            continue
+        ratio = result["median"] / previous["median"]
+        flag = "  REGRESSION" if ratio > 1 + threshold else "  faster" if ratio < 1 - threshold else ""
+        print(f"{name:>30} {previous['median'] * 1e6:>12.1f} -> {result['median'] * 1e6:>12.1f} us  x{ratio:.2f}{flag}")
+
+
+def main(args: argparse.Namespace) -> None:
+    logger.setLevel(logging.WARNING)
+    results: Dict[str, dict] = {}
+    print(f"{'benchmark':>30} {'median us':>12} {'min us':>12} {'stdev':>8}")
+    for bench in BENCHMARKS:
+        if args.filter and not any(pattern in bench.name for pattern in args.filter):
+            continue
+        if bench.requires_client and extension_client is None:
+            results[bench.name] = {"params": bench.params, "skipped": extension_error}
+            print(f"{bench.name:>30} skipped: {extension_error}")
+            continue
+        stats = measure(bench.setup(**bench.params), args.repeat, args.min_time)
+        results[bench.name] = {"params": bench.params, **stats}
+        print(
+            f"{bench.name:>30} {stats['median'] * 1e6:>12.1f} {stats['min'] * 1e6:>12.1f} "
+            f"{stats['stdev'] / stats['median'] * 100 if stats['median'] else 0:>7.1f}%"
+        )
+
+    revision = git_revision()
+    output = Path(args.output) if args.output else (
+        root_dir / "benchmarks" / "results" / f"{(revision['commit'] or 'unknown')[:12]}{'-dirty' if revision['dirty'] else ''}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps({
+        "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "revision": revision,
+        "machine": machine(),
+        "repeat": args.repeat,
+        "benchmarks": results,
+    }, indent=2), encoding="utf-8")
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        compare(results, args.compare, args.threshold)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the microbenchmarks of the hot paths")
+    parser.add_argument("--filter", nargs="+", help="Only run benchmarks whose name contains one of these")
+    parser.add_argument("--repeat", type=int, default=7, help="Timed rounds per benchmark")
+    parser.add_argument("--min-time", type=float, default=0.2, help="Seconds every round takes at least")
+    parser.add_argument("--output", help="JSON file for the results, defaults to benchmarks/results/<commit>.json")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative change reported as a regression")
+    main(parser.parse_args())
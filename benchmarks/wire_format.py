@@ -0,0 +1,134 @@
+"""
+Benchmark for the WebSocket wire formats.
+Encodes a typical message stream (prompts with source file attachments,
+streamed response chunks, final responses) with every available codec, with
+and without permessage-deflate, and reports the bytes on the wire and the CPU
+time per message for sending and receiving.
+
+Compression is reproduced with zlib exactly as permessage-deflate applies it:
+a raw deflate stream per direction with context takeover, flushed after every
+message with the trailing 4 bytes removed.
+
+Usage:
+    python benchmarks/wire_format.py --levels 1 6 --window-bits 12 15
+"""
+
+import argparse
+import json
+import sys
+import time
+import zlib
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+# Make the server modules importable the same way server/main.py does
+server_dir = Path(__file__).resolve().parent.parent / "server"
+sys.path.insert(0, str(server_dir))
+
+from modules.api.codec import CODECS, Codec
+
+
+class StdlibJSONCodec(Codec):
+    """The previous serialization with the standard json module, used as the baseline"""
+    name = "json-stdlib"
+
+    def encode(self, message: dict):
+        return json.dumps(message)
+
+    def decode(self, frame):
+        return json.loads(frame)
+
+
+def sample_messages(files: int, chunks: int) -> List[dict]:
+    """
+    Build a message stream resembling one conversation turn
+    @param files: Number of source files attached to the prompt
+    @param chunks: Number of streamed response chunks
+    @returns: Messages in the order they travel
+    """
+    sources = sorted(server_dir.rglob("*.py"))[:files]
+    response = " ".join(f"token{index % 50}" for index in range(chunks))
+    messages = [{
+        "message": "Why does this code not handle reconnects?",
+        "files": [{"filename": path.name, "content": path.read_text(encoding="utf-8")} for path in sources],
+        "stream": True,
+    }]
+    for index in range(chunks):
+        messages.append({"type": "response_chunk", "message": f"token{index % 50} ", "session_id": "0" * 36})
+    messages.append({"type": "response", "message": response, "session_id": "0" * 36})
+    return messages
+
+
+def frame_overhead(size: int) -> int:
+    """
+    WebSocket frame header size for a payload, client frames also carry a 4 byte mask
+    @param size: Payload size in bytes
+    @returns: Header size in bytes
+    """
+    return 2 + (2 if size > 125 else 0) + (6 if size > 65535 else 0)
+
+
+def run(codec: Codec, messages: List[dict], level: Optional[int], window_bits: int,
+        rounds: int) -> Tuple[int, int, float, float]:
+    """
+    Send the message stream through a codec and optional compression
+    @param codec: Codec under test
+    @param messages: Message stream
+    @param level: zlib level, None disables compression
+    @param window_bits: Compression window
+    @param rounds: Repetitions used for the timing
+    @returns: Tuple of payload bytes, wire bytes, microseconds per message to send and to receive
+    """
+    payload_bytes = wire_bytes = 0
+    send_time = receive_time = 0.0
+    for _ in range(rounds):
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -window_bits, 5) if level is not None else None
+        decompressor = zlib.decompressobj(-window_bits) if level is not None else None
+        payload_bytes = wire_bytes = 0
+        for message in messages:
+            started = time.perf_counter()
+            frame = codec.encode(message)
+            data = frame.encode("utf-8") if isinstance(frame, str) else frame
+            payload_bytes += len(data)
+            if compressor is not None:
+                data = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+                data = data[:-4]
+            encoded = time.perf_counter()
+            if decompressor is not None:
+                raw = decompressor.decompress(data + b"\x00\x00\xff\xff")
+            else:
+                raw = data
+            codec.decode(raw.decode("utf-8") if not codec.binary else raw)
+            decoded = time.perf_counter()
+            send_time += encoded - started
+            receive_time += decoded - encoded
+            wire_bytes += len(data) + frame_overhead(len(data))
+    count = len(messages) * rounds
+    return payload_bytes, wire_bytes, send_time / count * 1e6, receive_time / count * 1e6
+
+
+def main(args: argparse.Namespace) -> None:
+    messages = sample_messages(args.files, args.chunks)
+    codecs = [StdlibJSONCodec()] + list(CODECS.values())
+    settings = [(None, 15)] + [(level, bits) for level in args.levels for bits in args.window_bits]
+
+    print(f"{len(messages)} messages, {args.files} attached files, {args.rounds} rounds")
+    print(f"{'format':>12} {'deflate':>10} {'payload':>10} {'wire':>10} {'ratio':>6} {'send us':>8} {'recv us':>8}")
+    for codec in codecs:
+        for level, bits in settings:
+            payload, wire, send_us, receive_us = run(codec, messages, level, bits, args.rounds)
+            deflate = "off" if level is None else f"l{level}/w{bits}"
+            print(
+                f"{codec.name:>12} {deflate:>10} {payload:>10} {wire:>10} "
+                f"{payload / wire:>5.1f}x {send_us:>8.1f} {receive_us:>8.1f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark WebSocket wire formats and compression")
+    parser.add_argument("--files", type=int, default=5, help="Source files attached to the prompt")
+    parser.add_argument("--chunks", type=int, default=200, help="Streamed response chunks")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 6], help="zlib compression levels")
+    parser.add_argument("--window-bits", type=int, nargs="+", default=[12, 15], help="Compression windows")
+    parser.add_argument("--rounds", type=int, default=20)
+    main(parser.parse_args())
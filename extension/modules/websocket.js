@@ -6,6 +6,76 @@
 const vscode = require("vscode");
 const WebSocket = require("ws");
 const marked = require('marked');
+const crypto = require("crypto");
+
+// Attachments larger than this are sent as chunked binary uploads
+const UPLOAD_THRESHOLD = 512 * 1024;
+const UPLOAD_CHUNK_SIZE = 256 * 1024;
+
+// Lines of unchanged context around the change in a diff update
+const DIFF_CONTEXT = 3;
+
+/**
+ * Computes the SHA-256 of a text as the server does
+ * @param {string} text - File content
+ * @returns {string} Hex digest of the UTF-8 encoded text
+ */
+function sha256(text) {
+	return crypto.createHash("sha256").update(text, "utf8").digest("hex");
+}
+
+/**
+ * Creates a unified diff with a single hunk between two versions of a file
+ * @param {string} filename - Name of the file
+ * @param {string} oldText - Version the server holds
+ * @param {string} newText - Current version
+ * @returns {string} The diff
+ */
+function makeDiff(filename, oldText, newText) {
+	const split = (text) => {
+		const lines = text.split("\n");
+		const newline = lines[lines.length - 1] === "";
+		if (newline) {
+			lines.pop();
+		}
+		// Mark a last line without newline so it never equals one with a newline
+		return lines.map((line, i) => (i === lines.length - 1 && !newline ? line + "\n\\ No newline at end of file" : line));
+	};
+	const a = split(oldText);
+	const b = split(newText);
+	let prefix = 0;
+	while (prefix < a.length && prefix < b.length && a[prefix] === b[prefix]) {
+		prefix++;
+	}
+	let suffix = 0;
+	while (
+		suffix < a.length - prefix &&
+		suffix < b.length - prefix &&
+		a[a.length - 1 - suffix] === b[b.length - 1 - suffix]
+	) {
+		suffix++;
+	}
+	const start = Math.max(0, prefix - DIFF_CONTEXT);
+	const after = Math.min(suffix, DIFF_CONTEXT);
+	const endA = a.length - suffix + after;
+	const endB = b.length - suffix + after;
+	// An empty range is given as the line before it
+	const range = (end) => (end > start ? `${start + 1},${end - start}` : `${start},0`);
+	const lines = [`--- a/${filename}`, `+++ b/${filename}`, `@@ -${range(endA)} +${range(endB)} @@`];
+	for (let i = start; i < prefix; i++) {
+		lines.push(" " + a[i]);
+	}
+	for (let i = prefix; i < a.length - suffix; i++) {
+		lines.push("-" + a[i]);
+	}
+	for (let i = prefix; i < b.length - suffix; i++) {
+		lines.push("+" + b[i]);
+	}
+	for (let i = a.length - suffix; i < endA; i++) {
+		lines.push(" " + a[i]);
+	}
+	return lines.join("\n") + "\n";
+}
 
 /**
  * WebSocketManager class handles all WebSocket-related operations
@@ -28,6 +98,15 @@ class WebSocketManager {
 		this._pendingMessage = null;
 		this._resendAttempt = 0;
 		this._maxResendAttempts = 2;
+
+		// Text of the response currently being streamed
+		this._streamBuffer = "";
+
+		// Token issued by the server to resume the session after a reconnect
+		this._resumeToken = null;
+
+		// Last version of each attached file the server holds, as bases for diff updates
+		this._sentFiles = new Map();
 		
 		// UI reference
 		this._provider = null;
@@ -53,10 +132,23 @@ class WebSocketManager {
 		}
 
 		this._isConnecting = true;
-		this._ws = new WebSocket(this._wsUrl);
+		this._ws = new WebSocket(this.connectionUrl());
 		this.eventHandlers();
 	}
 
+	/**
+	 * Builds the server URL, asking to resume the previous session if there is one
+	 * @returns {string} URL to connect to
+	 */
+	connectionUrl() {
+		if (!this._resumeToken) {
+			return this._wsUrl;
+		}
+		const url = new URL(this._wsUrl);
+		url.searchParams.set("resume", this._resumeToken);
+		return url.toString();
+	}
+
 	/**
 	 * Handles reconnection attempts with delay
 	 */
@@ -116,6 +208,7 @@ class WebSocketManager {
 				type: "text",
 				message: message.text,
 				files: message.context ? [message.context] : [],
+				stream: true,
 			};
 		}
 
@@ -128,7 +221,9 @@ class WebSocketManager {
 
 		if (this._ws.readyState === WebSocket.OPEN) {
 			try {
-				this._ws.send(JSON.stringify(this._pendingMessage));
+				const files = this._pendingMessage.files.map((file) => this.uploadIfLarge(this.diffIfSent(file)));
+				this._ws.send(JSON.stringify({ ...this._pendingMessage, files }));
+				this.rememberFiles(this._pendingMessage.files);
 				console.log("WebSocket: Message sent:", this._pendingMessage);
 				this._resendAttempt = 0;
 				this.notifyWebview("sendSuccess", true);
@@ -142,12 +237,79 @@ class WebSocketManager {
 		}
 	}
 
+	/**
+	 * Replaces an attachment by a diff against the version sent before, if that is smaller.
+	 * The diff is a single hunk spanning all changed lines.
+	 * @param {Object} file - Attachment with filename and content
+	 * @returns {Object} The attachment itself, or a diff update of it
+	 */
+	diffIfSent(file) {
+		const sent = this._sentFiles.get(file.filename);
+		if (!sent || sent.content === file.content) {
+			return file;
+		}
+		const diff = makeDiff(file.filename, sent.content, file.content);
+		if (diff.length * 2 > file.content.length) {
+			return file;
+		}
+		return {
+			filename: file.filename,
+			base: sent.sha256,
+			diff: diff,
+			sha256: sha256(file.content),
+		};
+	}
+
+	/**
+	 * Remembers the attachments the server now holds
+	 * @param {Object[]} files - Attachments with filename and content
+	 */
+	rememberFiles(files) {
+		for (const file of files) {
+			this._sentFiles.set(file.filename, { content: file.content, sha256: sha256(file.content) });
+		}
+	}
+
+	/**
+	 * Sends a large attachment as binary frames ahead of the message that uses it.
+	 * Each frame is the length of the upload ID, the upload ID and a slice of the file.
+	 * @param {Object} file - Attachment with filename and content, or a diff update from diffIfSent
+	 * @returns {Object} The attachment itself, or a reference to the upload
+	 */
+	uploadIfLarge(file) {
+		// Diff updates carry no content, they are small enough to send inline
+		if (file.content === undefined) {
+			return file;
+		}
+		const content = Buffer.from(file.content, "utf8");
+		if (content.length <= UPLOAD_THRESHOLD) {
+			return file;
+		}
+
+		const uploadId = crypto.randomUUID();
+		this._ws.send(JSON.stringify({
+			type: "upload_start",
+			upload_id: uploadId,
+			filename: file.filename,
+			size: content.length,
+		}));
+		const id = Buffer.from(uploadId, "utf8");
+		const header = Buffer.concat([Buffer.from([id.length]), id]);
+		for (let offset = 0; offset < content.length; offset += UPLOAD_CHUNK_SIZE) {
+			this._ws.send(Buffer.concat([header, content.subarray(offset, offset + UPLOAD_CHUNK_SIZE)]));
+		}
+		console.log(`WebSocket: Uploaded ${file.filename} in chunks (${content.length} bytes)`);
+		return { filename: file.filename, upload_id: uploadId };
+	}
+
 	/**
 	 * Handles successful WebSocket connection
 	 */
 	handleConnection() {
 		console.log("WebSocket: Connected");
 		this._isConnecting = false;
+		// File versions are held per connection, send files in full again
+		this._sentFiles.clear();
 		this.notifyWebview("wsStatus", true);
 	}
 
@@ -178,6 +340,34 @@ class WebSocketManager {
 		const message = JSON.parse(messageString);
 		console.log("WebSocket: Received message:", message);
 
+		// Remember how to get back into this session after a dropped connection
+		if (message.type === "session") {
+			this._resumeToken = message.resume_token;
+			return;
+		}
+
+		// Accumulate streamed chunks and render the partial response
+		if (message.type === "response_chunk") {
+			this._streamBuffer += message.message;
+			if (this._provider && this._provider._view) {
+				this._provider._view.webview.postMessage({
+					command: "receiveChunk",
+					text: marked.parse(this._streamBuffer),
+				});
+			}
+			return;
+		}
+
+		// Only final responses and errors are shown in the chat
+		if (message.type !== "response" && message.type !== "error") {
+			return;
+		}
+		this._streamBuffer = "";
+		if (message.type === "error") {
+			// The server may have lost a base version, send files in full next time
+			this._sentFiles.clear();
+		}
+
 		// Convert markdown content to HTML
 		const htmlContent = marked.parse(message.message);
 
@@ -213,9 +403,10 @@ class WebSocketManager {
 	}
 
 	/**
-	 * Closes the WebSocket connection
+	 * Closes the WebSocket connection and ends the session
 	 */
 	closeConnection() {
+		this._resumeToken = null;
 		if (this._ws) {
 			this._ws.close();
 		}
@@ -110,7 +110,7 @@ window.addEventListener('DOMContentLoaded', () => {
 		Array.from(dots).forEach(dot => dot.remove());
 	}
 	// Append a message to the chat history
-	function updateChat(sender = null, text = null, failed = false) {
+	function updateChat(sender = null, text = null, failed = false, streaming = false) {
 		if (failed) {
 			// Create retry button if message failed to send
 			const retryButton = document.createElement("button");
@@ -148,10 +148,14 @@ window.addEventListener('DOMContentLoaded', () => {
 			addProcessingIndicator();
 		} else if (sender === aiName) {
 			removeProcessingIndicator();
-			const messageElement = document.createElement("div");
-			messageElement.className = "message-container";
+			// Reuse the element of a streamed response if there is one
+			let messageElement = chatHistory.querySelector(".message-container.streaming");
+			if (!messageElement) {
+				messageElement = document.createElement("div");
+				chatHistory.appendChild(messageElement);
+			}
+			messageElement.className = streaming ? "message-container streaming" : "message-container";
 			messageElement.innerHTML = `<p class="sender">${sender}:</p><p>${text}</p>`;
-			chatHistory.appendChild(messageElement);
 		}
 		
 		scrollToBottom();
@@ -218,6 +222,10 @@ window.addEventListener('DOMContentLoaded', () => {
 				updateChat(aiName, message.text);
 				break;
 
+			case "receiveChunk":
+				updateChat(aiName, message.text, false, true);
+				break;
+
 			case "transcription":
 				messageInput.value = message.text;
 				vscode.setState({ messageInputState: messageInput.value });
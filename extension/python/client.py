@@ -10,7 +10,19 @@ import asyncio
 import websockets
 import pyaudio
 import time
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, Optional, Tuple, Union
+from urllib.parse import parse_qs, urlparse
+from websockets.extensions.permessage_deflate import ServerPerMessageDeflateFactory
+
+try:
+    import orjson
+except ImportError:  # Optional, the standard library is used instead
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # Optional, clients asking for MessagePack get JSON
+    msgpack = None
 
 import logging
 import uuid
@@ -20,6 +32,17 @@ import numpy as np
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def pcm16_to_float32(data: bytes) -> np.ndarray:
+    """
+    Convert 16-bit PCM audio to float32 samples in [-1, 1) as WhisperLive expects them
+    @param data: Little-endian int16 samples from PyAudio
+    @returns: The samples as float32
+    """
+    samples = np.frombuffer(data, dtype=np.int16).astype(np.float32)
+    # Scale in place instead of allocating a second array
+    samples /= 32768.0
+    return samples
+
 # Placeholder for TranscriptionClient
 class TranscriptionClient:
     """
@@ -137,7 +160,7 @@ class TranscriptionClient:
 
         try:
             # Convert audio data to float32 numpy array
-            audio_data = np.frombuffer(data, dtype=np.int16).astype(np.float32) / 32768.0
+            audio_data = pcm16_to_float32(data)
             
             future = asyncio.run_coroutine_threadsafe(
                 self.ws.send(audio_data.tobytes()),
@@ -261,11 +284,15 @@ class CommandServer:
     WebSocket server that handles control commands for the transcription client.
     Provides an interface for starting/stopping recording and managing input devices.
     """
-    def __init__(self, client, host='localhost', port=8765):
+    def __init__(self, client, host='localhost', port=8765, compression=True, deflate_level=6, deflate_window_bits=12):
         self.client = client
         self.host = host
         self.port = port
         self.clients = set()  # Set of connected WebSocket clients
+        self.formats = {}  # Wire format of each client, "json" or "msgpack"
+        self.compression = compression  # Offer permessage-deflate
+        self.deflate_level = deflate_level  # zlib compression level
+        self.deflate_window_bits = deflate_window_bits  # Compression window, 2^bits bytes per connection
         self.loop = asyncio.new_event_loop()
         self.thread = threading.Thread(target=self._run_server, daemon=True)
         self.thread.start()
@@ -283,85 +310,140 @@ class CommandServer:
         Broadcasts a message to all connected clients
         """
         if self.clients:  # only try to broadcast if there are connected clients
-            message_str = json.dumps(message)
+            # Serialize once per wire format in use
+            payloads = {}
+            for client in self.clients:
+                fmt = self.formats.get(client, "json")
+                if fmt not in payloads:
+                    payloads[fmt] = self.encode(fmt, message)
             await asyncio.gather(
-                *[client.send(message_str) for client in self.clients],
+                *[client.send(payloads[self.formats.get(client, "json")]) for client in self.clients],
                 return_exceptions=True
             )
 
+    @staticmethod
+    def encode(fmt: str, message: dict) -> Union[str, bytes]:
+        """
+        Serialize a message in a wire format
+        """
+        if fmt == "msgpack":
+            return msgpack.packb(message)
+        if orjson is not None:
+            return orjson.dumps(message).decode("utf-8")
+        return json.dumps(message)
+
+    @staticmethod
+    def decode(fmt: str, message: Union[str, bytes]) -> dict:
+        """
+        Parse a message in a wire format, raises ValueError if it is invalid
+        """
+        if fmt == "msgpack":
+            try:
+                return msgpack.unpackb(message)
+            except Exception as e:
+                raise ValueError(str(e)) from e
+        if orjson is not None:
+            return orjson.loads(message)
+        return json.loads(message)
+
+    async def send(self, websocket, message: dict):
+        """
+        Sends a message to one client in its wire format
+        """
+        await websocket.send(self.encode(self.formats.get(websocket, "json"), message))
+
+    def select_format(self, websocket) -> str:
+        """
+        Reads the wire format from the "format" query parameter of the connection URL
+        """
+        request = getattr(websocket, "request", None)
+        path = request.path if request is not None else getattr(websocket, "path", "/")
+        fmt = parse_qs(urlparse(path).query).get("format", ["json"])[0]
+        return "msgpack" if fmt == "msgpack" and msgpack is not None else "json"
+
     async def handler(self, websocket):
+        fmt = self.select_format(websocket)
         try:
             self.clients.add(websocket)
-            logger.info(f"Client connected: {websocket.remote_address[0]}")
+            self.formats[websocket] = fmt
+            logger.info(f"Client connected: {websocket.remote_address[0]} ({fmt})")
             
             async for message in websocket:
                 try:
-                    data = json.loads(message)
-                    command = data.get('command')
-                    args = data.get('args', {})
-
-                    logger.debug(f"Received command: {command} with args: {args}")
-
-                    if command == 'list_input_devices':
-                        devices = self.client.list_input_devices()
-                        await websocket.send(json.dumps({'status': 'success', 'devices': devices}))
-
-                    elif command == 'change_input_device':
-                        device_id = args.get('device_id')
-                        if device_id is None:
-                            await websocket.send(json.dumps({'status': 'error', 'message': 'device_id is required.'}))
-                        else:
-                            success, msg = self.client.change_input_device(device_id)
-                            if success:
-                                await websocket.send(json.dumps({'status': 'success', 'message': msg}))
-                            else:
-                                await websocket.send(json.dumps({'status': 'error', 'message': msg}))
-
-                    elif command == 'start_recording':
-                        success, msg = self.client.start_recording()
+                    data = self.decode(fmt, message)
+                except ValueError:
+                    data = None
+                if not isinstance(data, dict) or not isinstance(data.get('args', {}), dict):
+                    await self.send(websocket, {
+                        "status": "error",
+                        "message": "Invalid message format"
+                    })
+                    continue
+                command = data.get('command')
+                args = data.get('args', {})
+
+                logger.debug(f"Received command: {command} with args: {args}")
+
+                if command == 'list_input_devices':
+                    devices = self.client.list_input_devices()
+                    await self.send(websocket, {'status': 'success', 'devices': devices})
+
+                elif command == 'change_input_device':
+                    device_id = args.get('device_id')
+                    if device_id is None:
+                        await self.send(websocket, {'status': 'error', 'message': 'device_id is required.'})
+                    else:
+                        success, msg = self.client.change_input_device(device_id)
                         if success:
-                            await websocket.send(json.dumps({'status': 'success', 'message': msg}))
+                            await self.send(websocket, {'status': 'success', 'message': msg})
                         else:
-                            await websocket.send(json.dumps({'status': 'error', 'message': msg}))
+                            await self.send(websocket, {'status': 'error', 'message': msg})
 
-                    elif command == 'stop_recording':
-                        success, msg = self.client.stop_recording()
-                        if success:
-                            await websocket.send(json.dumps({'status': 'success', 'message': msg}))
-                        else:
-                            await websocket.send(json.dumps({'status': 'error', 'message': msg}))
+                elif command == 'start_recording':
+                    success, msg = self.client.start_recording()
+                    if success:
+                        await self.send(websocket, {'status': 'success', 'message': msg})
+                    else:
+                        await self.send(websocket, {'status': 'error', 'message': msg})
 
-                    elif command == 'pause_recording':
-                        success, msg = self.client.pause_recording()
-                        if success:
-                            await websocket.send(json.dumps({'status': 'success', 'message': msg}))
-                        else:
-                            await websocket.send(json.dumps({'status': 'error', 'message': msg}))
+                elif command == 'stop_recording':
+                    success, msg = self.client.stop_recording()
+                    if success:
+                        await self.send(websocket, {'status': 'success', 'message': msg})
+                    else:
+                        await self.send(websocket, {'status': 'error', 'message': msg})
 
-                    elif command == 'resume_recording':
-                        success, msg = self.client.resume_recording()
-                        if success:
-                            await websocket.send(json.dumps({'status': 'success', 'message': msg}))
-                        else:
-                            await websocket.send(json.dumps({'status': 'error', 'message': msg}))
+                elif command == 'pause_recording':
+                    success, msg = self.client.pause_recording()
+                    if success:
+                        await self.send(websocket, {'status': 'success', 'message': msg})
+                    else:
+                        await self.send(websocket, {'status': 'error', 'message': msg})
 
+                elif command == 'resume_recording':
+                    success, msg = self.client.resume_recording()
+                    if success:
+                        await self.send(websocket, {'status': 'success', 'message': msg})
                     else:
-                        await websocket.send(json.dumps({'status': 'error', 'message': 'Unknown command'}))
+                        await self.send(websocket, {'status': 'error', 'message': msg})
 
-                except json.JSONDecodeError:
-                    await websocket.send(json.dumps({
-                        "status": "error",
-                        "message": "Invalid JSON format"
-                    }))
+                else:
+                    await self.send(websocket, {'status': 'error', 'message': 'Unknown command'})
         finally:
             self.clients.remove(websocket)
+            self.formats.pop(websocket, None)
 
     async def start_server_async(self):
         self.server = await websockets.serve(
             self.handler,
             self.host,
             self.port,
-            ping_interval=None
+            ping_interval=None,
+            compression=None,
+            extensions=[ServerPerMessageDeflateFactory(
+                server_max_window_bits=self.deflate_window_bits,
+                compress_settings={"level": self.deflate_level, "memLevel": 5}
+            )] if self.compression else []
         )
         logger.info(f"CommandServer started on ws://{self.host}:{self.port}")
 
@@ -1,8 +1,15 @@
 #!/bin/sh
 
+MODEL="${OLLAMA_MODEL:-codellama}"
+
 ./bin/ollama serve &
 pid=$!
-sleep 5
 
-ollama run codellama
-wait $pid
\ No newline at end of file
+# Wait until the API answers instead of sleeping for a fixed time
+until ollama list >/dev/null 2>&1; do
+    sleep 1
+done
+
+# The server preloads the model and keeps it resident once it is available
+ollama pull "$MODEL"
+wait $pid
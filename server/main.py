@@ -1,8 +1,15 @@
 # Main entry point for the server. Starts the WebSocket server and listens for incoming requests.
 # Handles initialization of core services and graceful shutdown.
+# With Config.SERVER_WORKERS > 1 several worker processes share the port and the conversations.
 
+import os
 import sys
+import time
+import signal
+import socket
+import secrets
 import asyncio
+import multiprocessing
 from pathlib import Path
 
 # Add server directory to Python path for module imports
@@ -10,38 +17,69 @@ server_dir = Path(__file__).parent
 sys.path.insert(0, str(server_dir))
 
 from modules.utils.logger import logger
+from modules.config.config import Config
 from modules.api import WebSocketAPI
 from modules.llm.llm import LLM
 from modules.api.session import SessionManager
+from modules.conversation.store import ConversationStore
+from modules.conversation.backends import SharedBackend, SharedStoreManager, SQLiteBackend
 
 class Core:
     """
     Core application class that manages service initialization and lifecycle.
     Provides centralized management of LLM and session services.
     """
-    def __init__(self):
+    def __init__(self, store_address=None, store_authkey: bytes = None):
+        """
+        Create the core without starting any service
+        @param store_address: Address of the shared store manager when running as one of several workers
+        @param store_authkey: Authentication key of the shared store manager
+        """
         logger.info("Initializing application core")
         self.llm_service = None  # Language model service instance
         self.session_manager = None  # Session management service instance
+        self.conversation_store = None  # Chat history shared by sessions and LLM
+        self.store_address = store_address
+        self.store_authkey = store_authkey
         
     async def initialize(self):
         """Initialize all core services"""
         logger.info("Starting core services")
+        started = time.perf_counter()
         
+        # Both services read and write the same conversation history,
+        # workers additionally record it in the shared store so any worker can pick it up
+        backend = None
+        if self.store_address is not None:
+            backend = SharedBackend(self.store_address, self.store_authkey)
+        elif Config.SESSION_DB_PATH:
+            backend = SQLiteBackend()
+        self.conversation_store = ConversationStore(backend=backend)
+
         # Initialize LLM first as other services depend on it
-        self.llm_service = LLM()
+        self.llm_service = LLM(self.conversation_store)
         
         # Initialize session management
-        self.session_manager = SessionManager()
+        self.session_manager = SessionManager(self.conversation_store)
+
+        # Load the model before accepting connections
+        logger.info(f"Warming up model {Config.LLM_MODEL}")
+        if not await self.llm_service.warm_up():
+            logger.warning(f"Accepting connections before model {Config.LLM_MODEL} is loaded, first requests may fail or be slow")
         
-        logger.info("Core services initialized successfully")
+        logger.info(f"Core services initialized successfully in {time.perf_counter() - started:.2f}s")
         
     async def shutdown(self):
         """Cleanup and shutdown all services"""
         logger.info("Shutting down core services")
         # Add cleanup for services that need it
+        if self.llm_service:
+            await self.llm_service.close()
+        if self.conversation_store:
+            self.conversation_store.close()
         self.llm_service = None
         self.session_manager = None
+        self.conversation_store = None
 
 async def cleanup(api=None, core=None):
     """
@@ -55,20 +93,23 @@ async def cleanup(api=None, core=None):
         await core.shutdown()
     logger.info("Server stopped by user.")
 
-async def main():
+async def main(store_address=None, store_authkey: bytes = None, worker: int = None):
     """
     Main application entry point.
     Initializes core services and starts the WebSocket server.
+    @param store_address: Address of the shared store manager when running as one of several workers
+    @param store_authkey: Authentication key of the shared store manager
+    @param worker: Index of this worker process when running several
     """
     api = None
     core = None
     try:
         # Initialize core services first
-        core = Core()
+        core = Core(store_address, store_authkey)
         await core.initialize()
         
         # Start the API with initialized services
-        api = WebSocketAPI(core)
+        api = WebSocketAPI(core, worker)
         await api.run_server()
         
     except asyncio.CancelledError:
@@ -78,20 +119,83 @@ async def main():
     finally:
         await cleanup(api, core)
 
-async def run_with_cleanup():
+async def run_with_cleanup(store_address=None, store_authkey: bytes = None, worker: int = None):
     """
     Run the main coroutine with proper cleanup on cancellation.
     Handles keyboard interrupts gracefully.
+    @param store_address: Address of the shared store manager when running as one of several workers
+    @param store_authkey: Authentication key of the shared store manager
+    @param worker: Index of this worker process when running several
     """
     try:
-        await main()
+        await main(store_address, store_authkey, worker)
     except KeyboardInterrupt:
         logger.info("Received keyboard interrupt...")
 
-if __name__ == "__main__":
+def run_worker(store_address=None, store_authkey: bytes = None, worker: int = None):
+    """
+    Run one server process until it is interrupted
+    @param store_address: Address of the shared store manager when running as one of several workers
+    @param store_authkey: Authentication key of the shared store manager
+    @param worker: Index of this worker process when running several
+    """
     try:
-        asyncio.run(run_with_cleanup())
+        asyncio.run(run_with_cleanup(store_address, store_authkey, worker))
     except KeyboardInterrupt:
         pass  # Already handled in run_with_cleanup
     except Exception as e:
-        logger.error(f"Unexpected error: {e}")
\ No newline at end of file
+        logger.error(f"Unexpected error: {e}")
+
+def _ignore_sigint():
+    """Keep the store manager alive on Ctrl+C until the workers have flushed their writes"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def run_workers(count: int):
+    """
+    Start worker processes that accept connections on the same port and
+    share their conversations through a store manager process.
+    @param count: Number of worker processes
+    """
+    authkey = os.urandom(32)
+    # Resume tokens issued by one worker must verify on all of them
+    if not Config.SESSION_SECRET:
+        Config.SESSION_SECRET = os.environ["SESSION_SECRET"] = secrets.token_hex(32)
+    manager = SharedStoreManager(address=("127.0.0.1", 0), authkey=authkey)
+    manager.start(_ignore_sigint)
+    logger.info(f"Shared session store listening on {manager.address}")
+
+    workers = [
+        multiprocessing.Process(target=run_worker, args=(manager.address, authkey, index), name=f"worker-{index}")
+        for index in range(count)
+    ]
+    for worker in workers:
+        worker.start()
+    logger.info(f"Started {count} server workers on port {Config.PORT}")
+    if Config.METRICS_ENABLED:
+        logger.info(f"Worker metrics served on ports {Config.METRICS_WORKER_PORT}-{Config.METRICS_WORKER_PORT + count - 1}")
+
+    # Forward termination to the workers so each one shuts down cleanly
+    def stop_workers(signum, frame):
+        for worker in workers:
+            if worker.is_alive():
+                os.kill(worker.pid, signal.SIGINT)
+    signal.signal(signal.SIGTERM, stop_workers)
+
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        # Ctrl+C reaches the workers directly, wait for them to finish
+        for worker in workers:
+            worker.join()
+    finally:
+        manager.shutdown()
+
+if __name__ == "__main__":
+    if Config.SERVER_WORKERS > 1 and not hasattr(socket, "SO_REUSEPORT"):
+        logger.warning("SO_REUSEPORT is not supported on this platform, running a single worker")
+        Config.SERVER_WORKERS = 1
+    if Config.SERVER_WORKERS > 1:
+        run_workers(Config.SERVER_WORKERS)
+    else:
+        run_worker()
\ No newline at end of file
@@ -2,6 +2,10 @@ from .main import WebSocketAPI
 from .types import ServerConfig, Session, MessageType, WebSocketResponse
 from .session import SessionManager
 from .message_handler import MessageHandler
+from .uploads import Upload, UploadError, UploadManager
+from .patches import FileVersions, PatchError, apply_patch, make_diff
+from .codec import Codec, JSONCodec, MessagePackCodec, select_codec
+from .keepalive import Keepalive
 
 __all__ = [
     'WebSocketAPI',
@@ -10,5 +14,17 @@ __all__ = [
     'MessageType',
     'WebSocketResponse',
     'SessionManager',
-    'MessageHandler'
+    'MessageHandler',
+    'Upload',
+    'UploadError',
+    'UploadManager',
+    'FileVersions',
+    'PatchError',
+    'apply_patch',
+    'make_diff',
+    'Codec',
+    'JSONCodec',
+    'MessagePackCodec',
+    'select_codec',
+    'Keepalive'
 ]
@@ -0,0 +1,101 @@
+"""
+Wire formats for WebSocket messages.
+Clients pick a format with the "format" query parameter of the connection URL.
+JSON is the default and uses orjson when it is installed, MessagePack is
+available when the msgpack package is installed.
+"""
+
+import json
+from abc import ABC, abstractmethod
+from typing import Dict, Optional, Union
+
+try:
+    import orjson
+except ImportError:  # Optional, the standard library is used instead
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # Optional, MessagePack is not offered without it
+    msgpack = None
+
+from modules.config.config import Config
+
+Frame = Union[str, bytes]
+
+
+class Codec(ABC):
+    """Encodes outgoing and decodes incoming messages of one wire format"""
+    name = ""
+    binary = False  # Whether messages travel in binary frames
+
+    @abstractmethod
+    def encode(self, message: dict) -> Frame:
+        """
+        Serialize a message
+        @param message: Message to send
+        @returns: Frame payload
+        """
+
+    @abstractmethod
+    def decode(self, frame: Frame) -> dict:
+        """
+        Parse a received message
+        @param frame: Frame payload
+        @returns: Parsed message
+        @raises ValueError: If the payload is not a valid message
+        """
+
+
+class JSONCodec(Codec):
+    """JSON in text frames, serialized with orjson when available"""
+    name = "json"
+
+    def encode(self, message: dict) -> Frame:
+        if orjson is not None:
+            return orjson.dumps(message).decode("utf-8")
+        return json.dumps(message)
+
+    def decode(self, frame: Frame) -> dict:
+        message = orjson.loads(frame) if orjson is not None else json.loads(frame)
+        if not isinstance(message, dict):
+            raise ValueError("Message must be an object")
+        return message
+
+
+class MessagePackCodec(Codec):
+    """MessagePack in binary frames"""
+    name = "msgpack"
+    binary = True
+
+    def encode(self, message: dict) -> Frame:
+        return msgpack.packb(message)
+
+    def decode(self, frame: Frame) -> dict:
+        if isinstance(frame, str):
+            raise ValueError("MessagePack messages must be sent as binary frames")
+        try:
+            message = msgpack.unpackb(frame)
+        except Exception as e:
+            raise ValueError(str(e)) from e
+        if not isinstance(message, dict):
+            raise ValueError("Message must be a map")
+        return message
+
+
+JSON = JSONCodec()
+
+CODECS: Dict[str, Codec] = {JSON.name: JSON}
+if msgpack is not None:
+    CODECS[MessagePackCodec.name] = MessagePackCodec()
+
+
+def select_codec(name: Optional[str]) -> Codec:
+    """
+    Find the codec for a requested wire format
+    @param name: Format requested by the client, None for the default
+    @returns: The codec, JSON if the format is unknown, unavailable or disabled
+    """
+    if name and name in Config.WS_FORMATS:
+        return CODECS.get(name, JSON)
+    return JSON
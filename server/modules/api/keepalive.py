@@ -0,0 +1,93 @@
+"""
+Keepalive and idle timeout of WebSocket connections.
+A connection that has been quiet for the ping interval is pinged, and closed
+when the pong does not arrive within a generous timeout, e.g. because the
+laptop at the other end went to sleep. Pings pause while a response is being
+generated for the session, so a slow generation cannot make a busy client
+look dead. Connections without messages for the idle timeout are closed as
+well, which ends their session and frees its memory.
+"""
+
+import asyncio
+import time
+from typing import Callable, Optional
+
+import websockets
+
+from modules.utils.logger import logger
+from modules.utils.metrics import metrics
+
+PING_RTT_SECONDS = metrics.histogram("rubberduck_ping_rtt_seconds", "Round trip time of keepalive pings")
+REAPED_HELP = "Connections closed by the server for missing pongs or staying idle"
+REAPED_DEAD = metrics.counter("rubberduck_connections_reaped_total", REAPED_HELP, reason="ping_timeout")
+REAPED_IDLE = metrics.counter("rubberduck_connections_reaped_total", REAPED_HELP, reason="idle")
+
+
+class Keepalive:
+    """Watches one connection for liveness and activity"""
+    def __init__(self, websocket: websockets.WebSocketServerProtocol, session_id: str,
+                 generating: Callable[[], bool], interval: Optional[float], timeout: Optional[float],
+                 idle_timeout: Optional[float]):
+        """
+        Initialize the watcher
+        @param websocket: Connection to watch
+        @param session_id: Session of the connection, for logging
+        @param generating: Returns whether a response is being generated for the session
+        @param interval: Quiet seconds before the connection is pinged, None disables pings
+        @param timeout: Seconds to wait for the pong, None waits indefinitely
+        @param idle_timeout: Seconds without messages before the connection is closed, None keeps it open
+        """
+        self.websocket = websocket
+        self.session_id = session_id
+        self.generating = generating
+        self.interval = interval
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.last_seen = time.monotonic()  # When the client last sent a frame or a generation was in flight
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.interval or self.idle_timeout)
+
+    def touch(self) -> None:
+        """Record activity of the client"""
+        self.last_seen = time.monotonic()
+
+    async def run(self) -> None:
+        """Watch the connection until it is closed"""
+        period = min(value for value in (self.interval, self.idle_timeout) if value)
+        try:
+            while True:
+                await asyncio.sleep(period)
+                if self.generating():
+                    # The idle clock starts again once the response is delivered
+                    self.touch()
+                    continue
+                quiet = time.monotonic() - self.last_seen
+                if self.idle_timeout and quiet >= self.idle_timeout:
+                    REAPED_IDLE.inc()
+                    logger.info(f"Closing connection idle for {quiet:.0f}s - Session: {self.session_id}")
+                    await self.websocket.close(1000, "idle timeout")
+                    return
+                if self.interval and quiet >= self.interval and not await self._ping():
+                    REAPED_DEAD.inc()
+                    logger.warning(f"No pong within {self.timeout:g}s, closing connection - Session: {self.session_id}")
+                    await self.websocket.close(1011, "keepalive ping timeout")
+                    return
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    async def _ping(self) -> bool:
+        """
+        Ping the client and wait for the pong
+        @returns: False if the pong did not arrive in time
+        """
+        started = time.perf_counter()
+        pong = await self.websocket.ping()
+        try:
+            await asyncio.wait_for(pong, self.timeout)
+        except asyncio.TimeoutError:
+            # A generation may have started while waiting, its frames can delay the pong
+            return self.generating()
+        PING_RTT_SECONDS.observe(time.perf_counter() - started)
+        return True
@@ -4,16 +4,32 @@ Provides the main WebSocket server implementation and connection handling logic.
 """
 
 import asyncio
+import time
 import websockets
-import json
 from contextlib import asynccontextmanager
-from typing import Optional, AsyncGenerator
+from typing import Dict, List, Optional, AsyncGenerator, Tuple
+from urllib.parse import parse_qs, urlparse
+from websockets.asyncio.server import ServerConnection
+from websockets.extensions.permessage_deflate import ServerPerMessageDeflateFactory
+from websockets.http11 import Request, Response
 
 from modules.config.config import Config 
 from modules.utils.logger import logger
+from modules.utils.metrics import metrics, stage
+from modules.utils.tracing import Trace
 from .types import ServerConfig
+from .codec import Codec, select_codec
+from .keepalive import Keepalive
 from .message_handler import MessageHandler
 
+RECEIVE_SECONDS = stage("receive")
+PARSE_SECONDS = stage("parse")
+CONNECTIONS = metrics.counter("rubberduck_connections_total", "WebSocket connections accepted")
+FRAMES_RECEIVED = metrics.counter("rubberduck_frames_received_total", "WebSocket frames received")
+BYTES_RECEIVED = metrics.counter("rubberduck_received_bytes_total", "Payload bytes of received WebSocket frames")
+INVALID_MESSAGES = metrics.counter("rubberduck_invalid_messages_total", "Received messages that failed to parse")
+
+
 class WebSocketAPI:
     """
     WebSocket server implementation that handles client connections and message routing.
@@ -21,20 +37,22 @@ class WebSocketAPI:
     """
     _instance = None
     
-    def __new__(cls, core=None):
+    def __new__(cls, core=None, worker: Optional[int] = None):
         """
         Singleton pattern implementation to ensure only one server instance
         @param core: Core application instance
+        @param worker: Index of this worker process when running several
         """
         if cls._instance is None:
             cls._instance = super().__new__(cls)
             cls._instance._initialized = False
         return cls._instance
 
-    def __init__(self, core=None):
+    def __init__(self, core=None, worker: Optional[int] = None):
         """
         Initialize the WebSocket API with core services
         @param core: Core application instance containing required services
+        @param worker: Index of this worker process when running several
         """
         if not getattr(self, '_initialized', False):
             if core is None:
@@ -49,14 +67,67 @@ class WebSocketAPI:
             
             # Initialize server config
             self.server: Optional[websockets.WebSocketServer] = None
+            self.metrics_server: Optional[websockets.WebSocketServer] = None  # Per-worker metrics endpoint
+            self.shutting_down = False  # Connections closed by a shutdown keep their history
+            self._closing = set()  # Superseded connections being closed in the background
             self.config = ServerConfig(
                 host=Config.HOST,
-                port=Config.PORT
+                port=Config.PORT,
+                reuse_port=Config.SERVER_WORKERS > 1,
+                worker=worker,
+                metrics_port=Config.METRICS_WORKER_PORT + worker if worker is not None else None
             )
             
+            # The shared port reaches a different worker on every scrape, so each one reports on its own
+            if worker is not None:
+                metrics.label_all(worker=str(worker))
+            self._register_metrics()
             self._initialized = True
             logger.info("WebSocket API initialized")
 
+    def _register_metrics(self) -> None:
+        """Expose the server's state as gauges and the totals kept by its modules as counters, read when scraped"""
+        handler = self.message_handler
+        session_manager = self.core.session_manager
+        store = session_manager.store
+        scheduler = self.core.llm_service.scheduler
+        cache = self.core.llm_service.cache
+        metrics.gauge("rubberduck_active_connections", "Open WebSocket connections",
+                      lambda: len(handler.active_connections))
+        metrics.gauge("rubberduck_active_sessions", "Sessions held by this worker, including detached ones",
+                      lambda: len(session_manager.sessions))
+        metrics.gauge("rubberduck_history_bytes", "Bytes of chat history held in memory",
+                      lambda: session_manager.store.total_bytes)
+        metrics.gauge("rubberduck_llm_queue_depth", "LLM requests waiting for a backend slot",
+                      lambda: scheduler.depth)
+        metrics.gauge("rubberduck_llm_inflight", "LLM requests running on a backend",
+                      lambda: scheduler.inflight)
+
+        metrics.counter_from("rubberduck_evicted_sessions_total", "Conversations evicted from memory",
+                             lambda: store.evicted_sessions)
+        metrics.counter_from("rubberduck_evicted_bytes_total", "Bytes of chat history reclaimed by eviction",
+                             lambda: store.bytes_reclaimed)
+        saved_tokens = "Estimated prompt tokens saved by sending less than the full attached files"
+        metrics.counter_from("rubberduck_prompt_bytes_saved_total", "Prompt bytes saved by referring back to unchanged files",
+                             lambda: handler.dedup_bytes_saved)
+        metrics.counter_from("rubberduck_upload_bytes_saved_total", "Upload bytes saved by clients sending diffs instead of files",
+                             lambda: handler.patch_bytes_saved)
+        metrics.counter_from("rubberduck_prompt_tokens_saved_total", saved_tokens,
+                             lambda: handler.dedup_tokens_saved, method="dedup")
+        metrics.counter_from("rubberduck_prompt_tokens_saved_total", saved_tokens,
+                             lambda: handler.patch_tokens_saved, method="patch")
+        metrics.counter_from("rubberduck_prompt_tokens_saved_total", saved_tokens,
+                             lambda: handler.retrieval_tokens_saved, method="retrieval")
+        metrics.counter_from("rubberduck_outline_source_tokens_total", "Estimated tokens of files sent as an outline",
+                             lambda: handler.outline_source_tokens)
+        metrics.counter_from("rubberduck_outline_tokens_total", "Estimated tokens of the outlines sent instead",
+                             lambda: handler.outline_tokens)
+        if cache is not None:
+            metrics.counter_from("rubberduck_response_cache_requests_total", "Response cache lookups",
+                                 lambda: cache.hits, result="hit")
+            metrics.counter_from("rubberduck_response_cache_requests_total", "Response cache lookups",
+                                 lambda: cache.misses, result="miss")
+
     async def _initialize_server(self) -> None:
         """Initialize WebSocket server with configured settings"""
         if not self.server:
@@ -66,17 +137,88 @@ class WebSocketAPI:
                 self.config.port,
                 max_size=self.config.max_size,
                 max_queue=self.config.max_connections,
-                ping_interval=None,  # Disable ping/pong timeouts
-                ping_timeout=None    # Disable ping/pong timeouts
+                ping_interval=None,  # Pings are sent by Keepalive, which pauses them during generation
+                ping_timeout=None,
+                compression=None,
+                extensions=self._extensions(),
+                process_request=self._process_request if Config.METRICS_ENABLED else None,
+                reuse_port=self.config.reuse_port or None
             )
             logger.info(f"WebSocket server started at ws://{self.config.host}:{self.config.port}")
+        if Config.METRICS_ENABLED and self.config.metrics_port is not None and not self.metrics_server:
+            self.metrics_server = await websockets.serve(
+                self.websocket_handler,  # Never reached, _serve_metrics answers every request
+                self.config.host,
+                self.config.metrics_port,
+                process_request=self._serve_metrics
+            )
+            logger.info(
+                f"Metrics of worker {self.config.worker} served at "
+                f"http://{self.config.host}:{self.config.metrics_port}{Config.METRICS_PATH}"
+            )
+
+    def _extensions(self) -> List[ServerPerMessageDeflateFactory]:
+        """
+        Build the permessage-deflate extension offered to clients
+        @returns: Extension factories, empty if compression is disabled
+        """
+        if not self.config.compression:
+            return []
+        return [ServerPerMessageDeflateFactory(
+            server_max_window_bits=self.config.deflate_window_bits,
+            compress_settings={"level": self.config.deflate_level, "memLevel": self.config.deflate_mem_level}
+        )]
+
+    def _process_request(self, connection: ServerConnection, request: Request) -> Optional[Response]:
+        """
+        Answer plain HTTP requests for the metrics before the WebSocket handshake
+        @param connection: Connection the request arrived on
+        @param request: HTTP request
+        @returns: The metrics response, or None to continue with the handshake
+        """
+        if request.path.split("?", 1)[0] != Config.METRICS_PATH:
+            return None
+        if self.config.metrics_port is not None:
+            first = Config.METRICS_WORKER_PORT
+            return connection.respond(
+                404, f"Metrics are served per worker on ports {first}-{first + Config.SERVER_WORKERS - 1}\n"
+            )
+        return self._metrics_response(connection)
+
+    def _serve_metrics(self, connection: ServerConnection, request: Request) -> Response:
+        """
+        Answer every request to a worker's metrics port
+        @param connection: Connection the request arrived on
+        @param request: HTTP request
+        @returns: The metrics response, or 404 for other paths
+        """
+        if request.path.split("?", 1)[0] != Config.METRICS_PATH:
+            return connection.respond(404, "Not found\n")
+        return self._metrics_response(connection)
+
+    @staticmethod
+    def _metrics_response(connection: ServerConnection) -> Response:
+        """
+        Render the metrics of this process
+        @param connection: Connection the request arrived on
+        @returns: The response in the Prometheus text format
+        """
+        response = connection.respond(200, metrics.render())
+        del response.headers["Content-Type"]
+        response.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+        return response
 
     async def shutdown(self) -> None:
         """Cleanup server resources and close connections"""
+        self.shutting_down = True
         if self.server:
             self.server.close()
             await self.server.wait_closed()
             logger.info("WebSocket server stopped.")
+        if self.metrics_server:
+            self.metrics_server.close()
+            await self.metrics_server.wait_closed()
+            self.metrics_server = None
 
     async def websocket_handler(self, websocket: websockets.WebSocketServerProtocol, path: str = '/') -> None:
         """
@@ -84,40 +226,69 @@ class WebSocketAPI:
         @param websocket: WebSocket connection instance
         @param path: Connection URL path
         """
-        session_id = self.core.session_manager.create_session()
-        logger.info(f"New WebSocket connection established - Session ID: {session_id}")
+        query = self._query(websocket)
+        codec = select_codec(query.get("format"))
+        session_id, resumed = await self._attach_session(websocket, query.get("resume"), codec)
+        dropped = False  # Connection lost without a close frame, the client may resume
+        CONNECTIONS.inc()
+        keepalive = Keepalive(
+            websocket, session_id, lambda: session_id in self.message_handler.active_tasks,
+            self.config.ping_interval, self.config.ping_timeout, self.config.timeout
+        )
+        watcher = asyncio.create_task(keepalive.run()) if keepalive.enabled else None
         
         try:
+            await self.message_handler.send_session(
+                websocket, session_id, self.core.session_manager.issue_resume_token(session_id), resumed
+            )
+
             while True:
                 try:
                     # Receive messages without timeout
                     message = await websocket.recv()
                     
+                    received = time.perf_counter()
+                    keepalive.touch()
+                    FRAMES_RECEIVED.inc()
+                    BYTES_RECEIVED.inc(len(message))
                     if not message:
                         logger.warning(f"Empty message received - Session: {session_id}")
                         continue
 
+                    # Binary frames of text formats carry chunks of file uploads
+                    if isinstance(message, bytes) and not codec.binary:
+                        await self.message_handler.receive_frame(websocket, session_id, message)
+                        RECEIVE_SECONDS.observe(time.perf_counter() - received)
+                        continue
+
                     try:
                         # Parse incoming message
-                        data = json.loads(message)
-                        logger.debug(f"Received message: {data}")
-                    except json.JSONDecodeError as e:
-                        logger.error(f"Invalid JSON format - Session {session_id}: {str(e)}")
+                        data = codec.decode(message)
+                        trace = Trace(session_id, received)
+                        trace.add("parse", received)
+                        PARSE_SECONDS.observe(trace.last - received)
+                        logger.debug("Received message: %s", data)
+                    except ValueError as e:
+                        INVALID_MESSAGES.inc()
+                        logger.error(f"Invalid {codec.name} message - Session {session_id}: {str(e)}")
                         await self.message_handler.send_error(websocket, "Invalid message format", session_id)
                         continue
 
-                    # Process message through handler
-                    await self.message_handler.process_message(websocket, session_id, data)
+                    # Route message through handler
+                    await self.message_handler.dispatch(websocket, session_id, data, trace)
+                    RECEIVE_SECONDS.observe(time.perf_counter() - received)
 
                 except websockets.exceptions.ConnectionClosedOK:
                     logger.info(f"Client disconnected normally - Session: {session_id}")
                     break
                 except websockets.exceptions.ConnectionClosedError as e:
                     logger.warning(f"Connection closed with error - Session {session_id}: {str(e)}")
+                    dropped = True
                     break
                 except Exception as e:
                     if "no close frame received or sent" in str(e):
                         logger.info(f"Connection closed by client - Session: {session_id}")
+                        dropped = True
                         break
                     logger.error(f"Error receiving message - Session {session_id}: {str(e)}")
                     continue
@@ -125,14 +296,65 @@ class WebSocketAPI:
         except Exception as e:
             logger.error(f"Unexpected error - Session {session_id}: {str(e)}")
         finally:
+            if watcher is not None:
+                watcher.cancel()
+            # A resumed connection took over the session, leave it alone
+            superseded = self.message_handler.active_connections.get(session_id) is not websocket
+
             # Clean up resources on connection close
+            if not superseded:
+                await self.message_handler.cancel_generation(session_id)
             try:
                 await websocket.close()
             except:
                 pass
-            self.core.session_manager.close_session(session_id)
-            self.message_handler.unregister_connection(session_id)
-            logger.info(f"Session closed: {session_id}")
+            if superseded:
+                logger.info(f"Connection replaced by a resumed one - Session: {session_id}")
+            elif dropped and not self.shutting_down:
+                self.core.session_manager.detach_session(session_id)
+                self.message_handler.unregister_connection(session_id)
+            else:
+                self.core.session_manager.close_session(session_id, keep_history=self.shutting_down)
+                self.message_handler.unregister_connection(session_id)
+                logger.info(f"Session closed: {session_id}")
+
+    async def _attach_session(self, websocket: websockets.WebSocketServerProtocol, token: Optional[str],
+                              codec: Codec) -> Tuple[str, bool]:
+        """
+        Resume the session named by the connection's resume token or create a new one
+        @param websocket: Newly opened WebSocket connection
+        @param token: Resume token sent by the client, if any
+        @param codec: Wire format of the connection
+        @returns: Tuple of the attached session's ID and whether it was resumed
+        """
+        session_manager = self.core.session_manager
+        session_id = await session_manager.resume_session(token) if token else None
+        resumed = session_id is not None
+        if resumed:
+            # A reconnecting client may arrive before its old connection is noticed as dead
+            previous = self.message_handler.active_connections.get(session_id)
+            await self.message_handler.cancel_generation(session_id)
+            if previous is not None and previous is not websocket:
+                task = asyncio.create_task(previous.close())
+                self._closing.add(task)
+                task.add_done_callback(self._closing.discard)
+            logger.info(f"WebSocket connection resumed - Session ID: {session_id}")
+        else:
+            session_id = session_manager.create_session()
+            logger.info(f"New WebSocket connection established - Session ID: {session_id}")
+        self.message_handler.register_connection(session_id, websocket, codec)
+        return session_id, resumed
+
+    @staticmethod
+    def _query(websocket: websockets.WebSocketServerProtocol) -> Dict[str, str]:
+        """
+        Read the query parameters of the connection URL, e.g. "resume" and "format"
+        @param websocket: WebSocket connection
+        @returns: First value of every parameter
+        """
+        request = getattr(websocket, "request", None)
+        path = request.path if request is not None else getattr(websocket, "path", "/")
+        return {name: values[0] for name, values in parse_qs(urlparse(path).query).items()}
 
     @asynccontextmanager
     async def server_context(self) -> AsyncGenerator[websockets.WebSocketServer, None]:
@@ -1,14 +1,31 @@
 # Message handler module for processing WebSocket messages and managing client communication.
 # Handles message routing, file processing, and response generation.
 
-import json
+import asyncio
+import hashlib
+import time
 import websockets
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Tuple
 from modules.utils.logger import logger
+from modules.utils.metrics import metrics, stage
+from modules.utils.tracing import Trace, finish
 from modules.config.config import Config
+from modules.conversation.store import estimate_tokens
+from modules.llm.scheduler import SchedulerBusyError
+from modules.retrieval import BM25Index, Chunk, Outline, OutlineCache
+from .codec import JSON, Codec
+from .patches import FileVersions, PatchError, apply_patch, make_diff
 from .session import SessionManager
+from .uploads import Upload, UploadError, UploadManager
 from datetime import datetime
 
+PROMPT_SECONDS = stage("prompt")
+SEND_SECONDS = stage("send")
+MESSAGES_SENT = metrics.counter("rubberduck_messages_sent_total", "WebSocket messages sent")
+PROMPTS = metrics.counter("rubberduck_prompts_total", "Prompts received")
+ERRORS = metrics.counter("rubberduck_errors_total", "Error responses sent")
+
+
 class MessageHandler:
     """
     Handles processing and routing of WebSocket messages.
@@ -23,81 +40,585 @@ class MessageHandler:
         self.session_manager = session_manager
         self.llm_service = llm_service
         self.active_connections: Dict[str, websockets.WebSocketServerProtocol] = {}
+        self.codecs: Dict[str, Codec] = {}  # Wire format chosen by each session's connection
+        self.active_tasks: Dict[str, asyncio.Task] = {}  # In-flight generation per session
+        self.dedup_bytes_saved = 0  # Prompt bytes avoided by referring back to unchanged files
+        self.dedup_tokens_saved = 0  # Estimated prompt tokens avoided the same way
+        self.uploads = UploadManager()  # Files sent as binary frames, waiting to be attached
+        self.indexes: Dict[str, BM25Index] = {}  # Retrieval index over each session's large files
+        self.retrieval_tokens_saved = 0  # Estimated prompt tokens avoided by sending excerpts of large files
+        self.outlines = OutlineCache()  # Parsed outlines of oversized Python files by content hash
+        self.outline_source_tokens = 0  # Estimated prompt tokens of the files replaced by outlines
+        self.outline_tokens = 0  # Estimated prompt tokens of the outlines, the ratio to the above is the compression
+        self.versions = FileVersions()  # File contents by hash, bases for diff updates
+        self.patch_bytes_saved = 0  # Upload bytes avoided by clients sending diffs instead of files
+        self.patch_tokens_saved = 0  # Estimated prompt tokens avoided by describing changed files by their diff
 
-    def register_connection(self, session_id: str, websocket: websockets.WebSocketServerProtocol) -> None:
+    def register_connection(self, session_id: str, websocket: websockets.WebSocketServerProtocol,
+                            codec: Optional[Codec] = None) -> None:
         """
         Register an active WebSocket connection for a session
         @param session_id: Unique identifier for the session
         @param websocket: WebSocket connection to register
+        @param codec: Wire format of the connection, keeps the current one if not given
         """
         self.active_connections[session_id] = websocket
+        if codec is not None:
+            self.codecs[session_id] = codec
+
+    async def send(self, websocket: websockets.WebSocketServerProtocol, session_id: str, message: dict) -> None:
+        """
+        Send a message in the wire format of the session's connection
+        @param websocket: Active WebSocket connection
+        @param session_id: Current session identifier
+        @param message: Message to send
+        """
+        frame = self.codecs.get(session_id, JSON).encode(message)
+        started = time.perf_counter()
+        await websocket.send(frame)
+        SEND_SECONDS.observe(time.perf_counter() - started)
+        MESSAGES_SENT.inc()
 
     def unregister_connection(self, session_id: str) -> None:
         """
-        Unregister a WebSocket connection when it's closed
+        Unregister a WebSocket connection when it's closed.
+        Its unfinished uploads, file versions and retrieval index are dropped,
+        they cannot be continued on another connection.
         @param session_id: ID of the session to unregister
         """
         if session_id in self.active_connections:
             del self.active_connections[session_id]
+        self.codecs.pop(session_id, None)
+        self.uploads.discard_session(session_id)
+        self.indexes.pop(session_id, None)
+        self.versions.discard_session(session_id)
+
+    async def dispatch(self, websocket: websockets.WebSocketServerProtocol, session_id: str, data: dict,
+                       trace: Optional[Trace] = None) -> None:
+        """
+        Route an incoming message by its type.
+        Prompts are processed in a background task so that the connection keeps
+        receiving (e.g. cancel requests) while a response is being generated.
+        @param websocket: Active WebSocket connection
+        @param session_id: Current session identifier
+        @param data: Parsed message data
+        @param trace: Trace started when the message arrived, continued for prompts
+        """
+        if data.get("type") == "cancel":
+            cancelled = await self.cancel_generation(session_id)
+            await self.send(websocket, session_id, {
+                "type": "cancelled",
+                "message": Config.CANCELLED_MESSAGE if cancelled else Config.NOTHING_TO_CANCEL_MESSAGE,
+                "session_id": session_id
+            })
+            return
+
+        if data.get("type") == "upload_start":
+            await self.start_upload(websocket, session_id, data)
+            return
+
+        if data.get("type") == "upload_chunk":
+            chunk = data.get("data")
+            if not isinstance(chunk, bytes):
+                await self.send_error(websocket, "Upload chunk data must be binary", session_id)
+                return
+            await self.receive_upload_data(websocket, session_id, str(data.get("upload_id", "")), chunk)
+            return
+
+        # Only an actual prompt supersedes the one still being answered
+        if "message" not in data:
+            await self.send_error(websocket, Config.ERROR_MESSAGE_REQUIRED, session_id)
+            return
+        await self.cancel_generation(session_id)
+        task = asyncio.create_task(self.process_message(websocket, session_id, data, trace))
+        self.active_tasks[session_id] = task
+        task.add_done_callback(lambda done: self._forget_task(session_id, done))
+
+    def _forget_task(self, session_id: str, task: asyncio.Task) -> None:
+        """
+        Remove a finished generation task from the active tasks
+        @param session_id: Session the task belongs to
+        @param task: Finished task
+        """
+        if self.active_tasks.get(session_id) is task:
+            del self.active_tasks[session_id]
+
+    async def start_upload(self, websocket: websockets.WebSocketServerProtocol, session_id: str, data: dict) -> None:
+        """
+        Begin a chunked file upload announced by the client
+        @param websocket: Active WebSocket connection
+        @param session_id: Current session identifier
+        @param data: Message with "upload_id", "filename" and "size"
+        """
+        try:
+            upload = self.uploads.start(session_id, str(data.get("upload_id", "")), str(data.get("filename", "")), data.get("size"))
+        except UploadError as e:
+            await self.send_error(websocket, str(e), session_id)
+            return
+        if upload.complete:
+            # An empty file is complete without any data frame
+            await self.confirm_upload(websocket, session_id, upload)
+
+    async def receive_frame(self, websocket: websockets.WebSocketServerProtocol, session_id: str, frame: bytes) -> None:
+        """
+        Append a raw binary upload frame to its upload
+        @param websocket: Active WebSocket connection
+        @param session_id: Current session identifier
+        @param frame: Raw binary frame
+        """
+        try:
+            upload_id, data = UploadManager.parse_frame(frame)
+        except UploadError as e:
+            await self.send_error(websocket, str(e), session_id)
+            return
+        await self.receive_upload_data(websocket, session_id, upload_id, data)
+
+    async def receive_upload_data(self, websocket: websockets.WebSocketServerProtocol, session_id: str,
+                                  upload_id: str, data: bytes) -> None:
+        """
+        Append data to an upload and confirm finished uploads
+        @param websocket: Active WebSocket connection
+        @param session_id: Current session identifier
+        @param upload_id: Identifier of the upload
+        @param data: Next bytes of the file
+        """
+        try:
+            upload = self.uploads.receive(session_id, upload_id, data)
+        except UploadError as e:
+            await self.send_error(websocket, str(e), session_id)
+            return
+        if upload.complete:
+            await self.confirm_upload(websocket, session_id, upload)
+
+    async def confirm_upload(self, websocket: websockets.WebSocketServerProtocol, session_id: str, upload: Upload) -> None:
+        """
+        Tell the client that an upload is complete
+        @param websocket: Active WebSocket connection
+        @param session_id: Current session identifier
+        @param upload: The finished upload
+        """
+        logger.info(f"Upload {upload.upload_id} complete for session {session_id}: {upload.size} bytes")
+        await self.send(websocket, session_id, {
+            "type": "upload_complete",
+            "upload_id": upload.upload_id,
+            "size": upload.size,
+            "sha256": upload.sha256.hexdigest(),
+            "session_id": session_id
+        })
+
+    async def resolve_uploads(self, session_id: str, data: dict) -> dict:
+        """
+        Replace files referenced by upload ID with their content.
+        Uploads are consumed and read outside the event loop.
+        @param session_id: Current session identifier
+        @param data: Message data whose "files" may contain {"filename", "upload_id"} entries
+        @returns: Message data with the content of every referenced upload filled in
+        @raises UploadError: If a referenced upload is unknown or incomplete
+        """
+        files = data.get("files")
+        if not isinstance(files, list) or not any(isinstance(file, dict) and "upload_id" in file for file in files):
+            return data
+        # Check every referenced upload before taking any, so a bad reference keeps the others usable
+        uploads = self.uploads.take_all(
+            session_id, [str(file["upload_id"]) for file in files if isinstance(file, dict) and "upload_id" in file]
+        )
+        try:
+            contents = {upload_id: await asyncio.to_thread(upload.read_text) for upload_id, upload in uploads.items()}
+        finally:
+            for upload in uploads.values():
+                upload.close()
+        resolved = []
+        for file in files:
+            if isinstance(file, dict) and "upload_id" in file:
+                upload = uploads[str(file["upload_id"])]
+                file = {"filename": file.get("filename", upload.filename), "content": contents[upload.upload_id]}
+            resolved.append(file)
+        return {**data, "files": resolved}
+
+    def resolve_patches(self, session_id: str, data: dict) -> dict:
+        """
+        Hash every attached file and rebuild files sent as a diff.
+        A file {"filename", "base", "diff"} is patched from the version whose
+        content hash is "base"; an optional "sha256" of the result or of a
+        full file is verified.
+        Rebuilt files carry the change since the version last shown in full
+        to the model ("anchor", "change") for build_prompt.
+        @param session_id: Current session identifier
+        @param data: Message data whose "files" may contain diffs
+        @returns: Message data with full contents and a "sha256" for every file
+        @raises PatchError: If a base version is unknown or a diff does not apply
+        """
+        files = data.get("files")
+        if not isinstance(files, list):
+            return data
+        resolved = []
+        for file in files:
+            if not isinstance(file, dict) or 'filename' not in file:
+                resolved.append(file)
+                continue
+            if "diff" in file and "base" in file:
+                base = self.versions.get(session_id, str(file["base"]))
+                if base is None:
+                    raise PatchError(Config.ERROR_UNKNOWN_BASE.format(filename=file['filename']))
+                base_content, anchor = base
+                content = apply_patch(base_content, str(file["diff"]))
+                digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+                if file.get("sha256", digest) != digest:
+                    raise PatchError(f"Patched {file['filename']} does not match its hash")
+                update = {"filename": file['filename'], "content": content, "sha256": digest}
+                # Describe the change against the version the model last saw in full
+                if anchor == file["base"]:
+                    update.update(anchor=anchor, change=str(file["diff"]))
+                elif anchor is not None and self.versions.get(session_id, anchor) is not None:
+                    anchor_content = self.versions.get(session_id, anchor)[0]
+                    update.update(anchor=anchor, change=make_diff(file['filename'], anchor_content, content))
+                self.patch_bytes_saved += len(content.encode("utf-8")) - len(str(file["diff"]).encode("utf-8"))
+                file = update
+            elif 'content' in file and isinstance(file['content'], str):
+                # The hash keys deduplication and diff bases, so a digest sent by the client is only checked
+                digest = hashlib.sha256(file['content'].encode("utf-8")).hexdigest()
+                if file.get("sha256", digest) != digest:
+                    raise PatchError(f"{file['filename']} does not match its hash")
+                file = {"filename": file['filename'], "content": file['content'], "sha256": digest}
+            resolved.append(file)
+        return {**data, "files": resolved}
 
-    async def process_message(self, websocket: websockets.WebSocketServerProtocol, session_id: str, data: dict) -> None:
+    async def cancel_generation(self, session_id: str) -> bool:
         """
-        Process incoming websocket messages and generate responses
+        Cancel the in-flight generation of a session and wait for it to unwind
+        @param session_id: Session whose generation should be cancelled
+        @returns: True if a running generation was cancelled
+        """
+        task = self.active_tasks.pop(session_id, None)
+        if task is None or task.done():
+            return False
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        logger.info(f"Cancelled generation for session {session_id}")
+        return True
+
+    async def process_message(self, websocket: websockets.WebSocketServerProtocol, session_id: str, data: dict,
+                              trace: Optional[Trace] = None) -> None:
+        """
+        Process incoming websocket messages and generate responses.
+        The request's trace is emitted when processing ends.
         @param websocket: Active WebSocket connection
         @param session_id: Current session identifier
         @param data: Message data to process
+        @param trace: Trace started when the message arrived, a new one is started if not given
         """
+        trace = trace if trace is not None else Trace(session_id)
+        status = "error"
         try:
             # Validate required message field
             if "message" not in data:
                 await self.send_error(websocket, Config.ERROR_MESSAGE_REQUIRED, session_id)
                 return
+            PROMPTS.inc()
+            started = time.perf_counter()
+            # Time the prompt waited for this task to start
+            trace.add("dispatch", trace.last, started)
                 
-            # Extract message content and prepare for processing
-            prompt = data["message"]
-            files = []
-            
-            # Process attached files if present
-            if "files" in data and isinstance(data["files"], list) and data["files"]:
-                files = data["files"]
-                prompt += Config.PROMPT_FILE_HEADER
-                for file in files:
-                    # Validate file data structure
-                    if not isinstance(file, dict) or 'filename' not in file or 'content' not in file:
-                        continue
-                    # Extract language from file extension
-                    ext = file["filename"].split(".")[-1] if "." in file["filename"] else ""
-                    language = Config.LANGUAGE_EXTENSIONS.get(ext, "")
-                    
-                    # Format file content into prompt
-                    prompt += Config.PROMPT_FILE_FORMAT.format(
-                        filename=file['filename'],
-                        language=language,
-                        content=file['content']
-                    )
+            # Fill in files sent as chunked uploads or as diffs against an earlier version
+            try:
+                with trace.span("files"):
+                    data = await self.resolve_uploads(session_id, data)
+                    data = await asyncio.to_thread(self.resolve_patches, session_id, data)
+            except (UploadError, PatchError) as e:
+                await self.send_error(websocket, str(e), session_id)
+                return
+
+            # Parse oversized Python files off the event loop so they can be sent as outlines
+            files = data.get("files")
+            if Config.OUTLINE_ENABLED and isinstance(files, list) and any(
+                isinstance(file, dict) and 'filename' in file and 'content' in file and self.needs_outline(file)
+                for file in files
+            ):
+                with trace.span("outline"):
+                    await asyncio.to_thread(self.outline_files, data)
+
+            # Index large files off the event loop so only relevant excerpts are sent
+            indexed = None
+            if Config.RETRIEVAL_ENABLED:
+                with trace.span("index"):
+                    indexed = await asyncio.to_thread(self.index_files, session_id, data)
+
+            # Rehydrate an evicted history off the event loop, the prompt refers back to it
+            await self.session_manager.store.load(session_id)
+
+            # Files referred back to must stay in the history until the prompt is answered
+            with self.session_manager.store.hold(session_id):
+                # Extract message content and attached files into the prompt
+                with trace.span("build_prompt"):
+                    prompt, attachments, references = self.build_prompt(session_id, data, indexed)
+                PROMPT_SECONDS.observe(time.perf_counter() - started)
+                trace.set(prompt_chars=len(prompt), files=len(data.get("files") or ()))
             
-            # Save the formatted prompt to session history
-            self.session_manager.save_message(session_id, prompt)
+                # The formatted prompt is recorded in the shared conversation store by the LLM service
             
-            # Register connection for response delivery
-            self.register_connection(session_id, websocket)
+                # Register connection for response delivery
+                self.register_connection(session_id, websocket)
             
-            # Optional acknowledgment of message receipt
-            #await self.send_acknowledgement(websocket, Config.ACK_MESSAGE, session_id)
+                # Optional acknowledgment of message receipt
+                #await self.send_acknowledgement(websocket, Config.ACK_MESSAGE, session_id)
             
-            # Generate response using LLM service
-            response = await self.llm_service.generate_response(session_id, prompt)
+                # Stream token chunks to the client if requested
+                on_chunk = None
+                if data.get("stream", Config.LLM_STREAM):
+                    async def on_chunk(chunk: str) -> None:
+                        await self.send(websocket, session_id, {
+                            "type": "response_chunk",
+                            "message": chunk,
+                            "session_id": session_id
+                        })
+
+                # Keep the client informed while waiting for a free LLM slot
+                async def on_queue(position: int) -> None:
+                    await self.send(websocket, session_id, {
+                        "type": "queue",
+                        "position": position,
+                        "session_id": session_id
+                    })
+
+                # Generate response using LLM service
+                try:
+                    response = await self.llm_service.generate_response(
+                        session_id, prompt, on_chunk=on_chunk, on_queue=on_queue,
+                        attachments=attachments, references=references, trace=trace
+                    )
+                except SchedulerBusyError:
+                    status = "busy"
+                    await self.send_error(websocket, Config.ERROR_BUSY, session_id)
+                    return
             
-            # Send response to client
-            await websocket.send(json.dumps({
-                "type": "response",
-                "message": response["message"],
-                "session_id": session_id
-            }))
+            # Send the assembled response to client
+            with trace.span("send"):
+                await self.send(websocket, session_id, {
+                    "type": "response",
+                    "message": response["message"],
+                    "session_id": session_id,
+                    "request_id": trace.request_id
+                })
+            status = "error" if "error" in trace.fields else "ok"
             
+        except asyncio.CancelledError:
+            status = "cancelled"
+            raise
         except Exception as e:
             logger.error(f"Error processing message: {str(e)}")
+            trace.set(error=str(e))
             await self.send_error(websocket, Config.ERROR_INTERNAL, session_id)
+        finally:
+            finish(trace, status)
+
+    @staticmethod
+    def needs_outline(file: dict) -> bool:
+        """
+        Check whether an attached file is a Python file over the outline token budget
+        @param file: Attached file with filename and content
+        @returns: True if the file should be sent as an outline
+        """
+        return (
+            file['filename'].endswith(".py")
+            and estimate_tokens(file['content']) > Config.OUTLINE_FILE_TOKEN_BUDGET
+        )
+
+    def outline_files(self, data: dict) -> None:
+        """
+        Parse the oversized Python files of a message into the outline cache.
+        Files parsed before cost only a cache lookup.
+        @param data: Message data containing "message" and optional "files"
+        """
+        files = data.get("files")
+        if not isinstance(files, list):
+            return
+        for file in files:
+            if not isinstance(file, dict) or 'filename' not in file or 'content' not in file:
+                continue
+            if self.needs_outline(file):
+                digest = file.get("sha256") or hashlib.sha256(file['content'].encode("utf-8")).hexdigest()
+                self.outlines.get(digest, file['content'])
+
+    def index_files(self, session_id: str, data: dict) -> Dict[int, str]:
+        """
+        Add the large attached files of a message to the session's retrieval index.
+        Files already indexed are skipped, so a file attached again costs only its hash.
+        @param session_id: Current session identifier
+        @param data: Message data containing "message" and optional "files"
+        @returns: Content hashes of the indexed files by their position in "files"
+        """
+        indexed: Dict[int, str] = {}
+        files = data.get("files")
+        if not isinstance(files, list):
+            return indexed
+        index = self.indexes.get(session_id)
+        for position, file in enumerate(files):
+            if not isinstance(file, dict) or 'filename' not in file or 'content' not in file:
+                continue
+            if estimate_tokens(file['content']) < Config.RETRIEVAL_MIN_FILE_TOKENS:
+                continue
+            if index is None:
+                index = self.indexes[session_id] = BM25Index()
+            digest = file.get("sha256") or hashlib.sha256(file['content'].encode("utf-8")).hexdigest()
+            added = index.add_file(file['filename'], file['content'], digest)
+            if added:
+                logger.debug(f"Indexed {file['filename']} for session {session_id}: {added} chunks")
+            indexed[position] = digest
+        return indexed
+
+    def build_prompt(self, session_id: str, data: dict,
+                     indexed: Optional[Dict[int, str]] = None) -> Tuple[str, List[str], List[str]]:
+        """
+        Format the user message and its attached files into a prompt.
+        Files whose content is already held in full in the session history are
+        referred back to instead of being repeated, changed files by their diff
+        when an earlier version is held in full. Oversized Python files parsed
+        by outline_files are replaced by their outline, indexed files by the
+        excerpts most relevant to the message.
+        @param session_id: Current session identifier
+        @param data: Message data containing "message" and optional "files"
+        @param indexed: Content hashes of files in the retrieval index by position, see index_files
+        @returns: Tuple of the prompt, hashes of files included in full and hashes of files referred back to
+        """
+        prompt = data["message"]
+        attachments: List[str] = []
+        references: List[str] = []
+        indexed = indexed or {}
+
+        # Process attached files if present
+        if "files" in data and isinstance(data["files"], list) and data["files"]:
+            prompt += Config.PROMPT_FILE_HEADER
+            saved_bytes = 0
+            saved_tokens = 0
+            patch_tokens = 0
+            retrieved: Dict[str, int] = {}  # Content hash of files to excerpt -> prompt tokens in full
+            for position, file in enumerate(data["files"]):
+                # Validate file data structure
+                if not isinstance(file, dict) or 'filename' not in file or 'content' not in file:
+                    continue
+                # Extract language from file extension
+                ext = file["filename"].split(".")[-1] if "." in file["filename"] else ""
+                language = Config.LANGUAGE_EXTENSIONS.get(ext, "")
+
+                # Format file content into prompt
+                block = Config.PROMPT_FILE_FORMAT.format(
+                    filename=file['filename'],
+                    language=language,
+                    content=file['content']
+                )
+                digest = file.get("sha256") or hashlib.sha256(file['content'].encode("utf-8")).hexdigest()
+                anchor = file.get("anchor")
+                outline: Optional[Outline] = None
+                outlined: Optional[str] = None
+                if Config.OUTLINE_ENABLED and self.needs_outline(file):
+                    _, outline = self.outlines.peek(digest)
+                    if outline is not None:
+                        outlined = outline.render(data["message"], file['filename'])
+                    # Excerpts of an indexed file fit the budget better than an outline that exceeds it
+                    if (
+                        outlined is not None and position in indexed
+                        and estimate_tokens(outlined) > Config.OUTLINE_FILE_TOKEN_BUDGET
+                    ):
+                        outlined = None
+                if not Config.DEDUPLICATE_FILES and position not in indexed and outlined is None:
+                    prompt += block
+                    self.versions.add(session_id, digest, file['content'], digest)
+                    continue
+
+                if Config.DEDUPLICATE_FILES and (
+                    digest in attachments or self.session_manager.find_attachment(session_id, digest)
+                ):
+                    # Unchanged file already in the conversation, refer back to it
+                    reference = Config.PROMPT_FILE_UNCHANGED_FORMAT.format(filename=file['filename'])
+                    prompt += reference
+                    if digest not in attachments:
+                        references.append(digest)
+                    saved_bytes += len(block) - len(reference)
+                    saved_tokens += estimate_tokens(block) - estimate_tokens(reference)
+                    anchor = digest
+                elif (
+                    Config.DEDUPLICATE_FILES and file.get("change") is not None
+                    and (anchor in attachments or self.session_manager.find_attachment(session_id, anchor))
+                    and estimate_tokens(file["change"]) <= Config.DIFF_PROMPT_RATIO * estimate_tokens(file['content'])
+                ):
+                    # Earlier version already in the conversation, describe only the change
+                    update = Config.PROMPT_FILE_DIFF_FORMAT.format(filename=file['filename'], diff=file["change"])
+                    prompt += update
+                    if anchor not in attachments and anchor not in references:
+                        references.append(anchor)
+                    patch_tokens += estimate_tokens(block) - estimate_tokens(update)
+                elif outlined is not None:
+                    # Only the outline reaches the prompt, so the file is not recorded as an attachment
+                    prompt += Config.PROMPT_FILE_OUTLINE_FORMAT.format(
+                        filename=file['filename'],
+                        language=language,
+                        content=outlined
+                    )
+                    tokens = estimate_tokens(outlined)
+                    self.outline_source_tokens += outline.tokens
+                    self.outline_tokens += tokens
+                    logger.info(
+                        f"Outlined {file['filename']} for session {session_id}: "
+                        f"~{outline.tokens} -> ~{tokens} tokens ({tokens / max(outline.tokens, 1):.0%})"
+                    )
+                elif position in indexed:
+                    # Only excerpts reach the prompt, so the file is not recorded as an attachment
+                    retrieved[digest] = estimate_tokens(block)
+                else:
+                    prompt += block
+                    attachments.append(digest)
+                    anchor = digest
+                self.versions.add(session_id, digest, file['content'], anchor)
+
+            if retrieved:
+                excerpts = self.format_excerpts(self.indexes[session_id].select(data["message"], retrieved))
+                prompt += excerpts
+                saved = sum(retrieved.values()) - estimate_tokens(excerpts)
+                self.retrieval_tokens_saved += saved
+                logger.info(
+                    f"Retrieved excerpts of {len(retrieved)} files for session {session_id}: saved ~{saved} tokens"
+                )
+
+            if patch_tokens:
+                self.patch_tokens_saved += patch_tokens
+                logger.info(f"Described changed files by their diff for session {session_id}: saved ~{patch_tokens} tokens")
+
+            if saved_bytes:
+                self.dedup_bytes_saved += saved_bytes
+                self.dedup_tokens_saved += saved_tokens
+                logger.info(
+                    f"Deduplicated attached files for session {session_id}: "
+                    f"saved {saved_bytes} bytes, ~{saved_tokens} tokens"
+                )
+
+        return prompt, attachments, references
+
+    @staticmethod
+    def format_excerpts(chunks: List[Chunk]) -> str:
+        """
+        Format retrieved chunks for the prompt, merging adjacent chunks of a file
+        @param chunks: Chunks in file and line order
+        @returns: Prompt text of the excerpts
+        """
+        text = ""
+        merged: List[Chunk] = []
+        for chunk in chunks:
+            last = merged[-1] if merged else None
+            if last is not None and last.digest == chunk.digest and last.end + 1 >= chunk.start:
+                merged[-1] = Chunk(last.digest, last.filename, last.start, chunk.end,
+                                   last.text + "\n" + chunk.text, last.tokens + chunk.tokens)
+            else:
+                merged.append(chunk)
+        for chunk in merged:
+            ext = chunk.filename.split(".")[-1] if "." in chunk.filename else ""
+            text += Config.PROMPT_FILE_EXCERPT_FORMAT.format(
+                filename=chunk.filename,
+                start=chunk.start,
+                end=chunk.end,
+                language=Config.LANGUAGE_EXTENSIONS.get(ext, ""),
+                content=chunk.text
+            )
+        return text
 
     async def send_error(self, websocket: websockets.WebSocketServerProtocol, message: str, session_id: str) -> None:
         """
@@ -111,8 +632,26 @@ class MessageHandler:
             "message": message,
             "session_id": session_id
         }
-        logger.error(f"Sending error response: {response}")
-        await websocket.send(json.dumps(response))
+        ERRORS.inc()
+        logger.error("Sending error response: %s", response)
+        await self.send(websocket, session_id, response)
+
+    async def send_session(self, websocket: websockets.WebSocketServerProtocol, session_id: str,
+                           resume_token: str, resumed: bool) -> None:
+        """
+        Tell the client which session it is attached to and how to resume it
+        @param websocket: Active WebSocket connection
+        @param session_id: Current session identifier
+        @param resume_token: Token to present when reconnecting
+        @param resumed: Whether an existing session was resumed
+        """
+        await self.send(websocket, session_id, {
+            "type": "session",
+            "session_id": session_id,
+            "resume_token": resume_token,
+            "resumed": resumed,
+            "format": self.codecs.get(session_id, JSON).name
+        })
 
     async def send_acknowledgement(self, websocket: websockets.WebSocketServerProtocol, message: str, session_id: str) -> None:
         """
@@ -126,5 +665,5 @@ class MessageHandler:
             "message": message,
             "session_id": session_id
         }
-        logger.info(f"Sending acknowledgement: {response}")
-        await websocket.send(json.dumps(response)) 
\ No newline at end of file
+        logger.info("Sending acknowledgement: %s", response)
+        await self.send(websocket, session_id, response) 
\ No newline at end of file
@@ -0,0 +1,162 @@
+"""
+Incremental file updates.
+A client that attached a file before may send a unified diff against that
+version instead of the full content. The base version is identified by the
+SHA-256 of its content, which the server keeps per session. The diff is
+applied to rebuild the new version, and when the model has already seen an
+earlier version in full, the prompt can carry only the change.
+"""
+
+import difflib
+import re
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from modules.config.config import Config
+
+_HUNK = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+
+class PatchError(Exception):
+    """Raised when a diff cannot be applied"""
+
+
+def apply_patch(base: str, diff: str) -> str:
+    """
+    Apply a unified diff to a text.
+    File headers and anything outside hunks are ignored, context and removed
+    lines must match the base exactly (apart from line endings).
+    @param base: Text the diff was made against
+    @param diff: Unified diff of a single file
+    @returns: The patched text
+    @raises PatchError: If the diff is malformed or does not match the base
+    """
+    lines = base.splitlines(keepends=True)
+    patch = diff.splitlines(keepends=True)
+    result: List[str] = []
+    position = 0  # Next base line not yet copied
+    index = 0
+    hunks = 0
+    while index < len(patch):
+        match = _HUNK.match(patch[index])
+        index += 1
+        if not match:
+            continue
+        hunks += 1
+        old_count = int(match.group(2) or 1)
+        new_count = int(match.group(4) or 1)
+        # An empty old range is given as the line after which the hunk is inserted
+        start = int(match.group(1)) - (1 if old_count else 0)
+        if start < position or start > len(lines):
+            raise PatchError(f"Hunk {hunks} starts outside the file or overlaps the previous one")
+        result.extend(lines[position:start])
+        position = start
+        last = ""
+        while index < len(patch) and (old_count or new_count or patch[index].startswith("\\")):
+            line = patch[index]
+            index += 1
+            tag, text = (" ", "\n") if line in ("\n", "\r\n") else (line[0], line[1:])
+            if tag == "\\":
+                # "\ No newline at end of file" applies to the preceding line
+                if last in (" ", "+") and result:
+                    result[-1] = result[-1].rstrip("\r\n")
+                continue
+            if tag in (" ", "-"):
+                if position >= len(lines) or lines[position].rstrip("\r\n") != text.rstrip("\r\n"):
+                    raise PatchError(f"Hunk {hunks} does not match the base at line {position + 1}")
+                if tag == " ":
+                    result.append(lines[position])
+                    new_count -= 1
+                position += 1
+                old_count -= 1
+            elif tag == "+":
+                result.append(text)
+                new_count -= 1
+            else:
+                raise PatchError(f"Hunk {hunks} has an invalid line")
+            last = tag
+            if old_count < 0 or new_count < 0:
+                raise PatchError(f"Hunk {hunks} is longer than its header says")
+        if old_count > 0 or new_count > 0:
+            raise PatchError(f"Hunk {hunks} is truncated")
+    if not hunks and diff.strip():
+        raise PatchError("Diff contains no hunks")
+    result.extend(lines[position:])
+    return "".join(result)
+
+
+def make_diff(filename: str, old: str, new: str) -> str:
+    """
+    Create a unified diff between two versions of a file
+    @param filename: Name of the file, used in the headers
+    @param old: Previous content
+    @param new: Current content
+    @returns: The diff, empty if the versions are equal
+    """
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    # Keep the last lines well-formed so hunks do not run into each other
+    if old_lines and not old_lines[-1].endswith("\n"):
+        old_lines[-1] += "\n\\ No newline at end of file\n"
+    if new_lines and not new_lines[-1].endswith("\n"):
+        new_lines[-1] += "\n\\ No newline at end of file\n"
+    return "".join(difflib.unified_diff(old_lines, new_lines, f"a/{filename}", f"b/{filename}"))
+
+
+class FileVersions:
+    """
+    File contents seen by each session, addressed by content hash.
+    Every version remembers its anchor: the hash of the version the model was
+    last shown in full, which a change can be described against. Versions
+    are evicted least recently used first once a session exceeds its byte budget.
+    """
+    def __init__(self, budget: Optional[int] = None):
+        """
+        Initialize without versions
+        @param budget: Bytes of file content kept per session, defaults to Config.FILE_VERSIONS_SESSION_BYTES
+        """
+        self.budget = budget or Config.FILE_VERSIONS_SESSION_BYTES
+        # Session -> content hash -> (content, anchor hash)
+        self.versions: Dict[str, "OrderedDict[str, Tuple[str, Optional[str]]]"] = {}
+        self.sizes: Dict[str, int] = {}  # Session -> bytes of content kept
+
+    def get(self, session_id: str, digest: str) -> Optional[Tuple[str, Optional[str]]]:
+        """
+        Look up a version and mark it as recently used
+        @param session_id: Session the version belongs to
+        @param digest: Content hash of the version
+        @returns: Tuple of content and anchor hash, None if the version is unknown
+        """
+        versions = self.versions.get(session_id)
+        if versions is None or digest not in versions:
+            return None
+        versions.move_to_end(digest)
+        return versions[digest]
+
+    def add(self, session_id: str, digest: str, content: str, anchor: Optional[str]) -> None:
+        """
+        Remember a version, replacing the anchor of a known one
+        @param session_id: Session the version belongs to
+        @param digest: Content hash of the version
+        @param content: File content
+        @param anchor: Hash of the version shown in full that changes are described against, None if there is none
+        """
+        versions = self.versions.setdefault(session_id, OrderedDict())
+        if digest in versions:
+            versions[digest] = (content, anchor)
+            versions.move_to_end(digest)
+            return
+        versions[digest] = (content, anchor)
+        size = self.sizes.get(session_id, 0) + len(content)
+        while size > self.budget and len(versions) > 1:
+            _, (evicted, _) = versions.popitem(last=False)
+            size -= len(evicted)
+        self.sizes[session_id] = size
+
+    def discard_session(self, session_id: str) -> None:
+        """
+        Drop all versions of a session
+        @param session_id: Session whose versions are dropped
+        """
+        self.versions.pop(session_id, None)
+        self.sizes.pop(session_id, None)
@@ -1,12 +1,20 @@
 """
 Session management module for handling client sessions.
 Provides functionality for creating, tracking, and managing client sessions
-and their associated message history.
+and their associated message history, including resumption after a dropped
+connection.
 """
 
+import hashlib
+import hmac
+import secrets
+import time
+from collections import OrderedDict
 from uuid import uuid4
 from typing import Optional, Dict
 from modules.utils.logger import logger
+from modules.config.config import Config
+from modules.conversation.store import ConversationStore
 from .types import Session
 
 class SessionManager:
@@ -14,19 +22,115 @@ class SessionManager:
     Manages client sessions and their associated data.
     Handles session lifecycle including creation, retrieval, and cleanup.
     """
-    def __init__(self):
-        """Initialize the session manager with an empty session store"""
+    def __init__(self, store: Optional[ConversationStore] = None):
+        """
+        Initialize the session manager with an empty session store
+        @param store: Conversation store shared with the LLM service
+        """
         self.sessions: Dict[str, Session] = {}
+        self.store = store if store is not None else ConversationStore()
+        self.detached: "OrderedDict[str, float]" = OrderedDict()  # Sessions waiting for a reconnect, oldest first
+        self.secret = (Config.SESSION_SECRET or secrets.token_hex(32)).encode("utf-8")
+        self.resumed_sessions = 0
+        self.expired_sessions = 0
 
     def create_session(self) -> str:
         """
         Create a new session and return its ID
         @returns: Unique identifier for the new session
         """
+        self.expire_detached()
         session_id = str(uuid4())
         self.sessions[session_id] = Session(id=session_id)
+        self.store.add(session_id)
+        return session_id
+
+    def issue_resume_token(self, session_id: str) -> str:
+        """
+        Create the token a client presents to resume a session after reconnecting
+        @param session_id: ID of the session
+        @returns: Session ID signed with the server secret
+        """
+        return f"{session_id}.{self._sign(session_id)}"
+
+    async def resume_session(self, token: str) -> Optional[str]:
+        """
+        Reattach a client to the session its resume token was issued for.
+        Sessions unknown to this process are resumed while their history is
+        still held, e.g. by another worker or in the persistent store.
+        @param token: Resume token from issue_resume_token()
+        @returns: ID of the resumed session, or None if the token is invalid or the session is gone
+        """
+        session_id, _, signature = token.partition(".")
+        if not hmac.compare_digest(signature.encode("utf-8"), self._sign(session_id).encode("utf-8")):
+            logger.warning("Rejected resume token with an invalid signature")
+            return None
+        self.expire_detached()
+
+        session = self.sessions.get(session_id)
+        if session is not None and self.store.backend is not None:
+            # Another worker may have served or closed the session since, reload the recorded history
+            self.store.release(session_id)
+            if await self.store.load(session_id) is None and session.detached_at is not None:
+                del self.sessions[session_id]
+                self.detached.pop(session_id, None)
+                session = None
+        if session is None:
+            if await self.store.load(session_id) is None:
+                logger.info(f"Session {session_id} cannot be resumed, its history is gone")
+                return None
+            session = self.sessions[session_id] = Session(id=session_id)
+        session.detached_at = None
+        self.detached.pop(session_id, None)
+        self.resumed_sessions += 1
+        logger.info(f"Session {session_id} resumed")
         return session_id
 
+    def detach_session(self, session_id: str) -> None:
+        """
+        Keep a session whose connection dropped so the client can resume it
+        @param session_id: ID of the session
+        """
+        session = self.sessions.get(session_id)
+        if session is None:
+            return
+        session.detached_at = time.monotonic()
+        self.detached[session_id] = session.detached_at
+        self.expire_detached()
+        logger.info(
+            f"Session {session_id} detached with {self.store.session_bytes(session_id)} bytes of history, "
+            f"resumable for {Config.SESSION_RESUME_GRACE:.0f}s"
+        )
+
+    def expire_detached(self) -> int:
+        """
+        Drop detached sessions whose grace period has passed.
+        Only the local copy of the history is released, recorded history stays
+        in the store's backend until its idle eviction.
+        @returns: Number of expired sessions
+        """
+        expired = 0
+        cutoff = time.monotonic() - Config.SESSION_RESUME_GRACE
+        while self.detached:
+            session_id, detached_at = next(iter(self.detached.items()))
+            if detached_at > cutoff:
+                break
+            del self.detached[session_id]
+            self.sessions.pop(session_id, None)
+            released = self.store.release(session_id)
+            self.expired_sessions += 1
+            expired += 1
+            logger.info(f"Detached session {session_id} expired, released {released} bytes of history.")
+        return expired
+
+    def _sign(self, session_id: str) -> str:
+        """
+        Compute the signature of a session ID
+        @param session_id: ID of the session
+        @returns: Hex HMAC of the ID
+        """
+        return hmac.new(self.secret, session_id.encode("utf-8"), hashlib.sha256).hexdigest()
+
     def get_session(self, session_id: str) -> Optional[Session]:
         """
         Get a session by its ID
@@ -35,26 +139,30 @@ class SessionManager:
         """
         return self.sessions.get(session_id)
     
-    def save_message(self, session_id: str, message: str) -> None:
+    def find_attachment(self, session_id: str, digest: str) -> bool:
         """
-        Save a message to a session's history
-        @param session_id: ID of the session to save to
-        @param message: Message content to save
-        @raises ValueError: If session is not found
+        Check whether a file is still held in full in a session's history
+        @param session_id: ID of the session
+        @param digest: Content hash of the file
+        @returns: True if a retained message contains the file
         """
-        session = self.get_session(session_id)
-        if not session:
-            raise ValueError(f"Session {session_id} not found.")
-        session.messages.append(message)
+        conversation = self.store.get(session_id)
+        return conversation is not None and conversation.find_attachment(digest) is not None
 
-    def close_session(self, session_id: str) -> None:
+    def close_session(self, session_id: str, keep_history: bool = False) -> None:
         """
         Close and cleanup a session
         @param session_id: ID of the session to close
+        @param keep_history: Leave the history in the store, e.g. when the server shuts down
         @raises ValueError: If session is not found
         """
         if session_id in self.sessions:
             del self.sessions[session_id]
-            logger.info(f"Session {session_id} closed.")
+            self.detached.pop(session_id, None)
+            if keep_history:
+                logger.info(f"Session {session_id} closed, history kept.")
+                return
+            released = self.store.remove(session_id)
+            logger.info(f"Session {session_id} closed, released {released} bytes of history.")
         else:
             raise ValueError(f"Session {session_id} not found.") 
\ No newline at end of file
@@ -1,11 +1,20 @@
-from dataclasses import dataclass, field
-from typing import List, Dict, TypedDict
+from dataclasses import dataclass
+from typing import Optional, TypedDict
 from enum import Enum
 from modules.config.config import Config
 
 class MessageType(Enum):
     ERROR = "error"
     ACK = "ack"
+    RESPONSE = "response"
+    RESPONSE_CHUNK = "response_chunk"
+    CANCEL = "cancel"
+    CANCELLED = "cancelled"
+    QUEUE = "queue"
+    SESSION = "session"
+    UPLOAD_START = "upload_start"
+    UPLOAD_CHUNK = "upload_chunk"
+    UPLOAD_COMPLETE = "upload_complete"
 
 class WebSocketResponse(TypedDict):
     type: str
@@ -18,11 +27,18 @@ class ServerConfig:
     port: int
     max_size: int = Config.MAX_MESSAGE_SIZE
     max_connections: int = Config.MAX_CONNECTIONS
-    timeout: float = Config.CONNECTION_TIMEOUT
-    ping_interval: None = Config.PING_INTERVAL
-    ping_timeout: None = Config.PING_TIMEOUT
+    timeout: Optional[float] = Config.CONNECTION_TIMEOUT
+    ping_interval: Optional[float] = Config.PING_INTERVAL
+    ping_timeout: Optional[float] = Config.PING_TIMEOUT
+    reuse_port: bool = False  # Let several worker processes accept connections on the same port
+    worker: Optional[int] = None  # Index of this worker process, None when running a single process
+    metrics_port: Optional[int] = None  # Port of this worker's own metrics endpoint
+    compression: bool = Config.WS_COMPRESSION
+    deflate_level: int = Config.WS_DEFLATE_LEVEL
+    deflate_window_bits: int = Config.WS_DEFLATE_WINDOW_BITS
+    deflate_mem_level: int = Config.WS_DEFLATE_MEM_LEVEL
 
 @dataclass
 class Session:
-    id: str
-    messages: List[str] = field(default_factory=list) 
\ No newline at end of file
+    id: str  # Conversation history lives in the shared ConversationStore under this ID
+    detached_at: Optional[float] = None  # When the connection dropped, None while a client is attached 
\ No newline at end of file
@@ -0,0 +1,212 @@
+"""
+Chunked file uploads.
+Large attachments are sent as binary WebSocket frames instead of inline JSON.
+Every frame carries the upload ID and a slice of the file, which is appended
+to a spooled buffer that moves to disk once it grows large. The finished
+upload is referenced by its ID in the "files" of a later message. Connections
+using MessagePack send "upload_chunk" messages with the same content instead.
+"""
+
+import hashlib
+import tempfile
+from typing import Dict, Iterable, Optional, Tuple
+
+from modules.utils.logger import logger
+from modules.config.config import Config
+
+
+class UploadError(Exception):
+    """Raised when an upload request or frame is rejected"""
+
+
+class Upload:
+    """A single file being assembled from binary frames"""
+    def __init__(self, upload_id: str, filename: str, size: int):
+        """
+        Create an empty upload
+        @param upload_id: Client chosen identifier of the upload
+        @param filename: Name of the uploaded file
+        @param size: Announced total size in bytes
+        """
+        self.upload_id = upload_id
+        self.filename = filename
+        self.size = size
+        self.received = 0
+        self.buffer = tempfile.SpooledTemporaryFile(max_size=Config.UPLOAD_SPOOL_SIZE)
+        self.sha256 = hashlib.sha256()
+
+    @property
+    def complete(self) -> bool:
+        """Whether all announced bytes have arrived"""
+        return self.received == self.size
+
+    def write(self, data: bytes) -> None:
+        """
+        Append a slice of the file
+        @param data: Next bytes of the file
+        @raises UploadError: If the data exceeds the announced size
+        """
+        if self.received + len(data) > self.size:
+            raise UploadError(f"Upload {self.upload_id} exceeds its announced size of {self.size} bytes")
+        self.buffer.write(data)
+        self.sha256.update(data)
+        self.received += len(data)
+
+    def read_text(self) -> str:
+        """
+        Read the whole file as text, may touch the disk
+        @returns: File content decoded as UTF-8, invalid bytes replaced
+        """
+        self.buffer.seek(0)
+        return self.buffer.read().decode("utf-8", errors="replace")
+
+    def close(self) -> None:
+        """Release the buffer"""
+        self.buffer.close()
+
+
+class UploadManager:
+    """
+    Uploads of all sessions.
+    Every session may hold uploads up to a byte quota, counted from the
+    announced sizes so a frame never pushes a session over it. An upload
+    leaves the quota when it is consumed by a message or discarded.
+    """
+    def __init__(self, quota: Optional[int] = None):
+        """
+        Initialize without uploads
+        @param quota: Bytes a session may hold in uploads, defaults to Config.UPLOAD_SESSION_QUOTA
+        """
+        self.quota = quota or Config.UPLOAD_SESSION_QUOTA
+        self.uploads: Dict[str, Dict[str, Upload]] = {}  # Session -> upload ID -> upload
+        self.reserved: Dict[str, int] = {}  # Session -> announced bytes of its uploads
+        self.bytes_received = 0
+
+    def start(self, session_id: str, upload_id: str, filename: str, size: int) -> Upload:
+        """
+        Begin an upload
+        @param session_id: Session the upload belongs to
+        @param upload_id: Client chosen identifier, unique within the session
+        @param filename: Name of the uploaded file
+        @param size: Total size in bytes
+        @returns: The new upload
+        @raises UploadError: If the request is invalid or exceeds the session's quota
+        """
+        if not upload_id or len(upload_id.encode("utf-8")) > 255:
+            raise UploadError("Upload ID must be 1 to 255 bytes long")
+        if not isinstance(size, int) or size < 0:
+            raise UploadError("Upload size must be a non-negative integer")
+        uploads = self.uploads.setdefault(session_id, {})
+        if upload_id in uploads:
+            raise UploadError(f"Upload {upload_id} already exists")
+        reserved = self.reserved.get(session_id, 0)
+        if reserved + size > self.quota:
+            raise UploadError(Config.ERROR_UPLOAD_QUOTA)
+        upload = uploads[upload_id] = Upload(upload_id, filename, size)
+        self.reserved[session_id] = reserved + size
+        logger.debug(f"Upload {upload_id} started for session {session_id}: {filename}, {size} bytes")
+        return upload
+
+    def receive(self, session_id: str, upload_id: str, data: bytes) -> Upload:
+        """
+        Append data to an upload
+        @param session_id: Session the data arrived on
+        @param upload_id: Identifier of the upload
+        @param data: Next bytes of the file
+        @returns: The upload the data was appended to
+        @raises UploadError: If the upload is unknown to the session or the data exceeds its size
+        """
+        upload = self.uploads.get(session_id, {}).get(upload_id)
+        if upload is None:
+            raise UploadError(f"Unknown upload {upload_id}")
+        try:
+            upload.write(data)
+        except UploadError:
+            self.discard(session_id, upload_id)
+            raise
+        self.bytes_received += len(data)
+        return upload
+
+    @staticmethod
+    def parse_frame(frame: bytes) -> Tuple[str, bytes]:
+        """
+        Split a binary frame into upload ID and data.
+        A frame is one byte holding the length of the upload ID, the UTF-8
+        encoded upload ID and the next bytes of the file.
+        @param frame: Raw binary frame
+        @returns: Tuple of the upload ID and the file data
+        @raises UploadError: If the frame is too short
+        """
+        if not frame or len(frame) < 1 + frame[0]:
+            raise UploadError("Malformed upload frame")
+        end = 1 + frame[0]
+        return frame[1:end].decode("utf-8", errors="replace"), frame[end:]
+
+    def take(self, session_id: str, upload_id: str) -> Upload:
+        """
+        Remove a finished upload so a message can use it.
+        The caller closes the upload when done with it.
+        @param session_id: Session the upload belongs to
+        @param upload_id: Identifier of the upload
+        @returns: The upload
+        @raises UploadError: If the upload is unknown or incomplete
+        """
+        upload = self.uploads.get(session_id, {}).get(upload_id)
+        if upload is None:
+            raise UploadError(f"Unknown upload {upload_id}")
+        if not upload.complete:
+            raise UploadError(f"Upload {upload_id} is incomplete ({upload.received}/{upload.size} bytes)")
+        self._forget(session_id, upload)
+        return upload
+
+    def take_all(self, session_id: str, upload_ids: Iterable[str]) -> Dict[str, Upload]:
+        """
+        Remove several finished uploads at once, none of them if one is unusable.
+        The caller closes the uploads when done with them.
+        @param session_id: Session the uploads belong to
+        @param upload_ids: Identifiers of the uploads, repetitions are taken once
+        @returns: The uploads by identifier
+        @raises UploadError: If an upload is unknown or incomplete
+        """
+        upload_ids = list(dict.fromkeys(upload_ids))
+        uploads = self.uploads.get(session_id, {})
+        for upload_id in upload_ids:
+            upload = uploads.get(upload_id)
+            if upload is None:
+                raise UploadError(f"Unknown upload {upload_id}")
+            if not upload.complete:
+                raise UploadError(f"Upload {upload_id} is incomplete ({upload.received}/{upload.size} bytes)")
+        return {upload_id: self.take(session_id, upload_id) for upload_id in upload_ids}
+
+    def discard(self, session_id: str, upload_id: str) -> None:
+        """
+        Drop an upload and release its buffer
+        @param session_id: Session the upload belongs to
+        @param upload_id: Identifier of the upload
+        """
+        upload = self.uploads.get(session_id, {}).get(upload_id)
+        if upload is not None:
+            self._forget(session_id, upload)
+            upload.close()
+
+    def discard_session(self, session_id: str) -> None:
+        """
+        Drop all uploads of a session
+        @param session_id: Session whose uploads are dropped
+        """
+        for upload in self.uploads.pop(session_id, {}).values():
+            upload.close()
+        self.reserved.pop(session_id, None)
+
+    def _forget(self, session_id: str, upload: Upload) -> None:
+        """
+        Remove an upload from the bookkeeping and return its bytes to the quota
+        @param session_id: Session the upload belongs to
+        @param upload: Upload to remove
+        """
+        uploads = self.uploads[session_id]
+        del uploads[upload.upload_id]
+        self.reserved[session_id] -= upload.size
+        if not uploads:
+            del self.uploads[session_id]
+            del self.reserved[session_id]
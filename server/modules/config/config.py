@@ -1,25 +1,93 @@
 # Description: Configuration file for the server
+import os
 from typing import Dict
 
 class Config:
     # Server settings
     HOST = "0.0.0.0"
-    PORT = 8765
-    LOG_LEVEL = "DEBUG"
+    PORT = int(os.environ.get("SERVER_PORT", "8765"))  # Overridable with a SERVER_PORT environment variable
+    LOG_LEVEL = os.environ.get("LOG_LEVEL", "DEBUG")
+    LOG_MAX_MESSAGE_CHARS = 4000  # Longer log messages and arguments are cut, 0 keeps them whole
+    LOG_RATE_LIMIT = 20  # Log records per second from a single call site, 0 disables the limit
+    # Worker processes sharing the port via SO_REUSEPORT, overridable with a SERVER_WORKERS environment variable
+    SERVER_WORKERS = int(os.environ.get("SERVER_WORKERS", "1"))
 
     # WebSocket settings
     MAX_MESSAGE_SIZE = 1024 * 1024  # 1MB
     MAX_CONNECTIONS = 100
-    CONNECTION_TIMEOUT = 60.0
-    PING_INTERVAL = None  # Disable ping/pong timeouts
-    PING_TIMEOUT = None   # Disable ping/pong timeouts
+    CONNECTION_TIMEOUT = 1800.0  # Seconds without client messages before the connection and its session are closed, None disables it
+    PING_INTERVAL = 30.0  # Quiet seconds before a connection is pinged, paused while a response is generated, None disables pings
+    PING_TIMEOUT = 120.0  # Seconds to wait for the pong before the connection is treated as dead
+    WS_COMPRESSION = True  # Offer permessage-deflate to clients
+    WS_DEFLATE_LEVEL = 6  # zlib compression level, lower trades ratio for CPU
+    WS_DEFLATE_WINDOW_BITS = 12  # Server compression window, 2^bits bytes, bounds memory per connection
+    WS_DEFLATE_MEM_LEVEL = 5  # zlib memory level of the compressor
+    WS_FORMATS = ("json", "msgpack")  # Wire formats clients may select with the "format" query parameter
 
     # LLM settings
+    # Ollama nodes, overridable with a comma separated OLLAMA_HOSTS environment variable
+    LLM_HOSTS = os.environ.get("OLLAMA_HOSTS", "http://ollama:11434").split(",")
+    LLM_HTTP_TIMEOUT = 600.0  # Seconds a request to Ollama may wait for data
+    LLM_HTTP_CONNECT_TIMEOUT = 5.0  # Seconds to establish a connection, also bounds health checks
+    LLM_HTTP_MAX_CONNECTIONS = 32  # Connection pool size per Ollama node
+    LLM_HTTP_KEEPALIVE_CONNECTIONS = 8  # Idle connections kept open per Ollama node
+    LLM_HTTP_KEEPALIVE_EXPIRY = 60.0  # Seconds an idle connection stays open
+    LLM_HEALTH_CHECK_INTERVAL = 10.0  # Seconds between health checks of the Ollama nodes
     LLM_MODEL = "codellama"
-    LLM_STREAM = False
-    LLM_MAX_HISTORY = 100  # Maximum number of messages to keep in history
+    LLM_KEEP_ALIVE = "24h"  # How long Ollama keeps the model loaded after a request
+    LLM_READY_TIMEOUT = 300.0  # Seconds to wait for Ollama and the model during startup
+    LLM_READY_POLL_INTERVAL = 1.0  # Seconds between readiness checks
+    LLM_STREAM = False  # Default for clients that do not set "stream" in their message
+    LLM_CONTEXT_SIZE = 8192  # Context window passed to Ollama as num_ctx, in tokens
+    LLM_RESPONSE_RESERVE = 1024  # Tokens of the context kept free for the response
+    LLM_CHARS_PER_TOKEN = 4  # Heuristic used to estimate token counts
+    LLM_SYSTEM_PROMPT = None  # Optional system message pinned at the start of every conversation
+    LLM_PIN_FIRST_MESSAGE = False  # Keep the first user turn when older history is trimmed
+    LLM_SESSION_TTL = 3600.0  # Idle seconds before a session's context is evicted
+    LLM_MAX_CONTEXT_BYTES = 512 * 1024 * 1024  # Memory cap for the contexts of all sessions
+    # SQLite file persisting conversations across restarts, overridable with a SESSION_DB_PATH environment variable
+    SESSION_DB_PATH = os.environ.get("SESSION_DB_PATH") or None
+    SESSION_DB_FLUSH_INTERVAL = 0.5  # Seconds between write-behind batches
+    SESSION_DB_BATCH_SIZE = 256  # Queued changes that trigger an early batch write
+    SESSION_RESUME_GRACE = 300.0  # Seconds a dropped connection's session waits for the client to reconnect
+    # Key signing resume tokens, overridable with a SESSION_SECRET environment variable.
+    # Without it a random key is used and tokens do not survive a restart.
+    SESSION_SECRET = os.environ.get("SESSION_SECRET") or None
+    LLM_MAX_INFLIGHT = 4  # Maximum concurrent requests sent to Ollama
+    LLM_MAX_QUEUE_DEPTH = 64  # Waiting requests before new ones are rejected as busy
+    LLM_CACHE_ENABLED = False  # Serve identical prompt + history requests from a response cache
+    LLM_CACHE_TTL = 24 * 3600.0  # Seconds a cached response stays valid
+    LLM_CACHE_MAX_BYTES = 64 * 1024 * 1024  # Memory cap of the in-process cache tier
+    LLM_CACHE_DB_PATH = None  # SQLite file for a persistent cache tier, None keeps the cache in memory only
+
+    # Metrics settings
+    METRICS_ENABLED = True  # Serve Prometheus metrics over HTTP on the WebSocket port, or per worker with several workers
+    # With several workers, worker N serves its metrics on this port plus N instead of the shared port
+    METRICS_WORKER_PORT = int(os.environ.get("METRICS_WORKER_PORT", str(PORT + 1)))
+    METRICS_PATH = "/metrics"  # Path of the metrics endpoint
+    METRICS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)  # Latency histogram bounds in seconds
+
+    # Tracing settings
+    TRACE_FILE = os.environ.get("TRACE_FILE", "")  # JSON lines file for request traces, off unless a path is set
+    TRACE_MAX_BYTES = 10 * 1024 * 1024  # Size at which the trace file is rotated
+    TRACE_BACKUP_COUNT = 5  # Rotated trace files kept
+    TRACE_SLOW_THRESHOLD = 30.0  # Seconds after which a request is logged with its span breakdown, None disables it
 
     # File handling settings
+    UPLOAD_SPOOL_SIZE = 1024 * 1024  # Bytes of an upload kept in memory before it moves to a temporary file
+    UPLOAD_SESSION_QUOTA = 64 * 1024 * 1024  # Bytes a session may hold in unconsumed uploads
+    DEDUPLICATE_FILES = True  # Refer back to files already sent in the conversation instead of repeating them
+    FILE_VERSIONS_SESSION_BYTES = 16 * 1024 * 1024  # File contents kept per session as bases for diff updates
+    DIFF_PROMPT_RATIO = 0.5  # Describe a changed file by its diff while the diff is at most this share of the file
+    OUTLINE_ENABLED = True  # Send oversized Python files as an outline of signatures and docstrings
+    OUTLINE_FILE_TOKEN_BUDGET = 4096  # Python files estimated above this many tokens are outlined, referenced bodies are kept within it
+    OUTLINE_STATEMENT_LINES = 3  # Longer module and class level statements are cut to their first line
+    OUTLINE_CACHE_SIZE = 256  # Parsed outlines kept by content hash
+    RETRIEVAL_ENABLED = False  # Send only the chunks of large files that are relevant to the question
+    RETRIEVAL_MIN_FILE_TOKENS = 1024  # Files estimated below this many tokens are always sent in full
+    RETRIEVAL_TOKEN_BUDGET = 2048  # Prompt tokens available to retrieved chunks per message
+    RETRIEVAL_TOP_K = 8  # Maximum retrieved chunks per message
+    RETRIEVAL_CHUNK_LINES = 40  # Maximum lines per chunk
     LANGUAGE_EXTENSIONS: Dict[str, str] = {
         "py": "python",
         "js": "javascript",
@@ -32,6 +100,15 @@ class Config:
     # Message templates
     PROMPT_FILE_HEADER = "\n\nHere are the relevant files:\n\n"
     PROMPT_FILE_FORMAT = "File: {filename}\n```{language}\n{content}\n```\n\n"
+    PROMPT_FILE_UNCHANGED_FORMAT = "File: {filename} (unchanged, see the earlier message)\n\n"
+    PROMPT_FILE_DIFF_FORMAT = "File: {filename} (changed since the earlier message)\n```diff\n{diff}```\n\n"
+    PROMPT_FILE_OUTLINE_FORMAT = "File: {filename} (outline, function bodies elided)\n```{language}\n{content}\n```\n\n"
+    PROMPT_FILE_EXCERPT_FORMAT = "File: {filename} (excerpt, lines {start}-{end})\n```{language}\n{content}\n```\n\n"
     ERROR_INTERNAL = "Internal server error"
     ERROR_MESSAGE_REQUIRED = "Message is required"
-    ACK_MESSAGE = "Prompt received and being processed"
\ No newline at end of file
+    ERROR_BUSY = "Server is busy, please try again shortly"
+    ERROR_UPLOAD_QUOTA = "Upload quota of the session exceeded"
+    ERROR_UNKNOWN_BASE = "Base version of {filename} is unknown, send the file in full"
+    ACK_MESSAGE = "Prompt received and being processed"
+    CANCELLED_MESSAGE = "Generation cancelled"
+    NOTHING_TO_CANCEL_MESSAGE = "No generation in progress"
\ No newline at end of file
@@ -0,0 +1,14 @@
+from .store import Message, Conversation, ConversationStore, estimate_tokens
+from .backends import SessionBackend, SessionRegistry, SharedBackend, SQLiteBackend, SharedStoreManager
+
+__all__ = [
+    'Message',
+    'Conversation',
+    'ConversationStore',
+    'estimate_tokens',
+    'SessionBackend',
+    'SessionRegistry',
+    'SharedBackend',
+    'SQLiteBackend',
+    'SharedStoreManager'
+]
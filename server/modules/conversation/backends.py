@@ -0,0 +1,416 @@
+"""
+Storage backends behind the conversation store.
+The in-process ConversationStore keeps working copies of conversations, a
+backend records every change so a conversation can be rehydrated by another
+worker process, after the local copy was evicted or after a restart.
+"""
+
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing.util import Finalize
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.managers import BaseManager
+from typing import Dict, List, Optional, Set, Tuple
+
+from modules.utils.logger import logger
+from modules.config.config import Config
+
+# (sequence number, role, content, attachment hashes)
+Record = Tuple[int, str, str, Tuple[str, ...]]
+
+
+class SessionBackend:
+    """
+    Interface of a conversation backend.
+    The base class keeps nothing, so conversations only live in the process
+    that created them.
+    """
+    def load(self, session_id: str) -> Optional[List[Record]]:
+        """
+        Read a session's retained messages
+        @param session_id: Session identifier
+        @returns: Records in conversation order, or None if the session is unknown
+        """
+        return None
+
+    def append(self, session_id: str, record: Record) -> None:
+        """
+        Record a new message
+        @param session_id: Session identifier
+        @param record: Message record
+        """
+
+    def discard(self, session_id: str, seq: int) -> None:
+        """
+        Record that a message left the conversation
+        @param session_id: Session identifier
+        @param seq: Sequence number of the message
+        """
+
+    def remove(self, session_id: str) -> None:
+        """
+        Delete a session's conversation
+        @param session_id: Session identifier
+        """
+
+    def close(self) -> None:
+        """Flush pending writes and release resources"""
+
+
+class SQLiteBackend(SessionBackend):
+    """
+    Backend persisting conversations in a SQLite database in WAL mode.
+    Changes are queued and written behind in batches by a background thread,
+    so the request path never waits for the disk. Loading a session first
+    writes out the changes still queued for it.
+    """
+    def __init__(self, db_path: Optional[str] = None, ttl: Optional[float] = None,
+                 flush_interval: Optional[float] = None, batch_size: Optional[int] = None):
+        """
+        Open the database and start the writer thread
+        @param db_path: SQLite file, defaults to Config.SESSION_DB_PATH
+        @param ttl: Idle seconds after which a stored session is deleted, defaults to Config.LLM_SESSION_TTL
+        @param flush_interval: Seconds between batch writes, defaults to Config.SESSION_DB_FLUSH_INTERVAL
+        @param batch_size: Queued changes that trigger an early write, defaults to Config.SESSION_DB_BATCH_SIZE
+        """
+        self.db_path = db_path or Config.SESSION_DB_PATH
+        self.ttl = ttl or Config.LLM_SESSION_TTL
+        self.flush_interval = flush_interval or Config.SESSION_DB_FLUSH_INTERVAL
+        self.batch_size = batch_size or Config.SESSION_DB_BATCH_SIZE
+        self.db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")  # WAL commits skip fsync, only checkpoints sync
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS messages (session_id TEXT NOT NULL, seq INTEGER NOT NULL, "
+            "role TEXT NOT NULL, content TEXT NOT NULL, attachments TEXT NOT NULL, "
+            "PRIMARY KEY (session_id, seq)) WITHOUT ROWID"
+        )
+        self.db.execute("CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, last_used REAL NOT NULL)")
+        self.db.commit()
+        self.db_lock = threading.Lock()  # Serializes use of the connection
+
+        self.pending: List[tuple] = []  # Queued changes in order
+        self.pending_sessions: Set[str] = set()  # Sessions with queued changes
+        self.condition = threading.Condition()
+        self.closed = False
+        self.batches_written = 0
+        self.changes_written = 0
+        self._next_expiry = 0.0
+        self._writer = threading.Thread(target=self._run, name="session-db", daemon=True)
+        self._writer.start()
+        logger.info(f"Session store persisted to {self.db_path}")
+
+    def load(self, session_id: str) -> Optional[List[Record]]:
+        try:
+            with self.db_lock:
+                with self.condition:
+                    queued = session_id in self.pending_sessions
+                if queued:
+                    self._flush()
+                rows = self.db.execute(
+                    "SELECT seq, role, content, attachments FROM messages WHERE session_id = ? ORDER BY seq",
+                    (session_id,)
+                ).fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Failed to load session {session_id} from {self.db_path}: {str(e)}")
+            return None
+        if not rows:
+            return None
+        return [(seq, role, content, tuple(attachments.split())) for seq, role, content, attachments in rows]
+
+    def append(self, session_id: str, record: Record) -> None:
+        self._queue(("append", session_id, record))
+
+    def discard(self, session_id: str, seq: int) -> None:
+        self._queue(("discard", session_id, seq))
+
+    def remove(self, session_id: str) -> None:
+        self._queue(("remove", session_id, None))
+
+    def close(self) -> None:
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.condition.notify()
+        self._writer.join()
+        with self.db_lock:
+            self._flush()
+            self.db.close()
+        logger.info(f"Session store closed after {self.batches_written} batches, {self.changes_written} changes")
+
+    def flush(self) -> None:
+        """Write all queued changes in one transaction"""
+        with self.db_lock:
+            self._flush()
+
+    def _flush(self) -> None:
+        """Take the queued changes and write them (caller holds the database lock)"""
+        with self.condition:
+            batch, self.pending = self.pending, []
+            self.pending_sessions.clear()
+        if batch:
+            self._write(batch)
+
+    def _queue(self, change: tuple) -> None:
+        """
+        Queue a change for the writer thread
+        @param change: Tuple of operation, session ID and argument
+        """
+        with self.condition:
+            self.pending.append(change)
+            self.pending_sessions.add(change[1])
+            if len(self.pending) >= self.batch_size:
+                self.condition.notify()
+
+    def _run(self) -> None:
+        """Write queued changes in batches until the backend is closed (runs in the writer thread)"""
+        while True:
+            with self.condition:
+                if not self.closed and len(self.pending) < self.batch_size:
+                    self.condition.wait(self.flush_interval)
+                if self.closed:
+                    return
+            self.flush()
+
+    def _write(self, batch: List[tuple]) -> None:
+        """
+        Apply a batch of changes and drop expired sessions (caller holds the database lock)
+        @param batch: Changes in the order they were made
+        """
+        now = time.time()
+        touched = {}
+        try:
+            for operation, session_id, argument in batch:
+                if operation == "append":
+                    seq, role, content, attachments = argument
+                    self.db.execute(
+                        "INSERT OR REPLACE INTO messages (session_id, seq, role, content, attachments) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (session_id, seq, role, content, " ".join(attachments))
+                    )
+                    touched[session_id] = now
+                elif operation == "discard":
+                    self.db.execute("DELETE FROM messages WHERE session_id = ? AND seq = ?", (session_id, argument))
+                else:
+                    self.db.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+                    self.db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+                    touched.pop(session_id, None)
+            self.db.executemany(
+                "INSERT OR REPLACE INTO sessions (session_id, last_used) VALUES (?, ?)",
+                touched.items()
+            )
+            if now >= self._next_expiry:
+                self._expire(now)
+            self.db.commit()
+            self.batches_written += 1
+            self.changes_written += len(batch)
+        except sqlite3.Error as e:
+            self.db.rollback()
+            logger.error(f"Failed to write {len(batch)} session changes to {self.db_path}: {str(e)}")
+
+    def _expire(self, now: float) -> None:
+        """Delete sessions idle for longer than the TTL (caller holds the database lock)"""
+        cutoff = now - self.ttl
+        self.db.execute(
+            "DELETE FROM messages WHERE session_id IN (SELECT session_id FROM sessions WHERE last_used < ?)",
+            (cutoff,)
+        )
+        self.db.execute("DELETE FROM sessions WHERE last_used < ?", (cutoff,))
+        self._next_expiry = now + self.ttl / 10
+
+
+class SessionRegistry:
+    """
+    Conversations of all workers, held by the shared store manager process.
+    Every worker connection is served by its own thread, so access is locked.
+    Sessions idle for longer than the TTL are dropped, and the least recently
+    used ones while the total memory exceeds the cap. Sessions unknown to the
+    registry are looked up in an optional persistent backend, which also
+    receives every change.
+    """
+    def __init__(self, ttl: Optional[float] = None, max_bytes: Optional[int] = None,
+                 backend: Optional[SessionBackend] = None):
+        """
+        Initialize an empty registry
+        @param ttl: Idle seconds after which a session is dropped, defaults to Config.LLM_SESSION_TTL
+        @param max_bytes: Memory cap for all sessions, defaults to Config.LLM_MAX_CONTEXT_BYTES
+        @param backend: Optional persistent backend behind the registry
+        """
+        self.ttl = ttl or Config.LLM_SESSION_TTL
+        self.max_bytes = max_bytes or Config.LLM_MAX_CONTEXT_BYTES
+        self.backend = backend or SessionBackend()
+        self.sessions: Dict[str, Dict[int, Record]] = {}
+        self.last_used: "OrderedDict[str, float]" = OrderedDict()  # Least recently used first
+        self.bytes: Dict[str, int] = {}  # Memory held by the contents of each session's records
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self._next_expiry = time.monotonic() + self.ttl
+
+    def load(self, session_id: str) -> Optional[List[Record]]:
+        """Read a session's records and mark it as used"""
+        with self.lock:
+            records = self._records(session_id)
+            if records is None:
+                return None
+            self._touch(session_id)
+            self._enforce_cap()
+            return list(records.values())
+
+    def append(self, session_id: str, record: Record) -> None:
+        """Store a message record and drop idle sessions now and then"""
+        with self.lock:
+            records = self._records(session_id)
+            if records is None:
+                records = self.sessions[session_id] = {}
+            previous = records.get(record[0])
+            records[record[0]] = record
+            size = sys.getsizeof(record[2]) - (sys.getsizeof(previous[2]) if previous is not None else 0)
+            self.bytes[session_id] = self.bytes.get(session_id, 0) + size
+            self.total_bytes += size
+            self.backend.append(session_id, record)
+            now = self._touch(session_id)
+            if now >= self._next_expiry:
+                self._expire(now)
+            self._enforce_cap()
+
+    def discard(self, session_id: str, seq: int) -> None:
+        """Delete a message record"""
+        with self.lock:
+            records = self.sessions.get(session_id)
+            if records is not None:
+                record = records.pop(seq, None)
+                if record is not None:
+                    size = sys.getsizeof(record[2])
+                    self.bytes[session_id] -= size
+                    self.total_bytes -= size
+            self.backend.discard(session_id, seq)
+
+    def remove(self, session_id: str) -> None:
+        """Delete a session"""
+        with self.lock:
+            self._drop(session_id)
+            self.backend.remove(session_id)
+
+    def _records(self, session_id: str) -> Optional[Dict[int, Record]]:
+        """
+        Get a session's records, reading them from the persistent backend if
+        the registry does not hold them, e.g. after they were dropped (caller holds the lock)
+        @param session_id: Session identifier
+        @returns: Records by sequence number, None if the session is unknown
+        """
+        records = self.sessions.get(session_id)
+        if records is None:
+            stored = self.backend.load(session_id)
+            if stored is None:
+                return None
+            records = self.sessions[session_id] = {record[0]: record for record in stored}
+            self.bytes[session_id] = size = sum(sys.getsizeof(record[2]) for record in stored)
+            self.total_bytes += size
+        return records
+
+    def _touch(self, session_id: str) -> float:
+        """Mark a session as most recently used (caller holds the lock)"""
+        self.last_used[session_id] = now = time.monotonic()
+        self.last_used.move_to_end(session_id)
+        return now
+
+    def _drop(self, session_id: str) -> None:
+        """Forget a session's records, the persistent backend keeps them (caller holds the lock)"""
+        self.sessions.pop(session_id, None)
+        self.last_used.pop(session_id, None)
+        self.total_bytes -= self.bytes.pop(session_id, 0)
+
+    def _expire(self, now: float) -> None:
+        """Drop sessions idle for longer than the TTL (caller holds the lock)"""
+        while self.last_used:
+            session_id, last_used = next(iter(self.last_used.items()))
+            if now - last_used < self.ttl:
+                break
+            self._drop(session_id)
+        self._next_expiry = now + self.ttl / 10
+
+    def _enforce_cap(self) -> None:
+        """Drop the least recently used sessions while over the memory cap, keeping the newest (caller holds the lock)"""
+        while self.total_bytes > self.max_bytes and len(self.last_used) > 1:
+            session_id = next(iter(self.last_used))
+            logger.info(f"Shared store dropped session {session_id} ({self.bytes.get(session_id, 0)} bytes) to stay under its memory cap")
+            self._drop(session_id)
+
+
+_registry: Optional[SessionRegistry] = None
+
+
+def _get_registry() -> SessionRegistry:
+    """Return the registry of the manager process, creating it on first use"""
+    global _registry
+    if _registry is None:
+        backend = SQLiteBackend() if Config.SESSION_DB_PATH else None
+        _registry = SessionRegistry(backend=backend)
+        if backend is not None:
+            # Write out queued changes when the manager process shuts down
+            Finalize(_registry, backend.close, exitpriority=10)
+    return _registry
+
+
+class SharedStoreManager(BaseManager):
+    """Manager process serving the SessionRegistry to all workers"""
+
+
+SharedStoreManager.register("get_registry", callable=_get_registry)
+
+
+class SharedBackend(SessionBackend):
+    """
+    Backend talking to the SessionRegistry of a SharedStoreManager.
+    Writes are sent from a single background thread in order, so the request
+    path never waits for the manager process.
+    """
+    def __init__(self, address, authkey: bytes):
+        """
+        Connect to a running manager
+        @param address: Address of the SharedStoreManager
+        @param authkey: Authentication key of the manager
+        """
+        manager = SharedStoreManager(address=address, authkey=authkey)
+        manager.connect()
+        self.registry = manager.get_registry()
+        # One thread keeps writes ordered, loads queue behind pending writes
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-store")
+        logger.info(f"Connected to shared session store at {address}")
+
+    def load(self, session_id: str) -> Optional[List[Record]]:
+        # Waits for the queued writes, ConversationStore.load calls it from a worker thread
+        try:
+            return self._executor.submit(self.registry.load, session_id).result()
+        except Exception as e:
+            logger.error(f"Failed to load session {session_id} from shared store: {str(e)}")
+            return None
+
+    def append(self, session_id: str, record: Record) -> None:
+        self._submit(self.registry.append, session_id, record)
+
+    def discard(self, session_id: str, seq: int) -> None:
+        self._submit(self.registry.discard, session_id, seq)
+
+    def remove(self, session_id: str) -> None:
+        self._submit(self.registry.remove, session_id)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+    def _submit(self, method, *args) -> None:
+        """
+        Run a registry call in the background, logging failures
+        @param method: Registry proxy method
+        @param args: Call arguments
+        """
+        def call():
+            try:
+                method(*args)
+            except Exception as e:
+                logger.error(f"Shared session store write failed: {str(e)}")
+        self._executor.submit(call)
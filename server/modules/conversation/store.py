@@ -0,0 +1,443 @@
+"""
+Conversation store shared by the session manager and the LLM service.
+Holds every session's chat history once, as compact message records trimmed
+to a token budget derived from the model's context size, and evicts idle
+conversations to keep memory bounded. An optional SessionBackend records every
+change so conversations can be rehydrated after their local copy is gone.
+"""
+
+import asyncio
+import sys
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+from modules.utils.logger import logger
+from modules.config.config import Config
+from .backends import Record, SessionBackend
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of tokens in a text
+    @param text: Text to measure
+    @returns: Approximate token count
+    """
+    return len(text) // Config.LLM_CHARS_PER_TOKEN + 1
+
+
+def token_budget() -> int:
+    """
+    Number of prompt tokens available for the history
+    @returns: Model context size minus the space reserved for the response
+    """
+    return max(Config.LLM_CONTEXT_SIZE - Config.LLM_RESPONSE_RESERVE, 1)
+
+
+class Message:
+    """
+    A single chat message with its token count and size computed once.
+    Behaves like a read-only mapping with "role" and "content" keys, so it can
+    be passed to the Ollama client without conversion.
+    """
+    __slots__ = ("role", "content", "tokens", "size", "attachments", "seq")
+
+    _KEYS: Tuple[str, str] = ("role", "content")
+
+    def __init__(self, role: str, content: str, attachments: Tuple[str, ...] = ()):
+        """
+        Create a message record
+        @param role: Chat role (system, user or assistant)
+        @param content: Message text
+        @param attachments: Content hashes of the files included in full in this message
+        """
+        self.role = role
+        self.content = content
+        self.tokens = estimate_tokens(content)
+        self.size = sys.getsizeof(content)
+        self.attachments = attachments
+        self.seq = 0  # Position in the conversation, assigned when the message is appended
+
+    def keys(self) -> Tuple[str, str]:
+        return self._KEYS
+
+    def __getitem__(self, key: str) -> str:
+        if key not in self._KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __repr__(self) -> str:
+        return f"Message(role={self.role!r}, tokens={self.tokens}, size={self.size})"
+
+
+class Conversation:
+    """
+    Chat history of a single session, trimmed from the oldest end to a token budget.
+    Token counts are kept in a running total, so trimming only touches the
+    messages that are dropped.
+    """
+    def __init__(self, budget: Optional[int] = None, system_prompt: Optional[str] = None,
+                 pin_first: bool = False, session_id: Optional[str] = None,
+                 storage: Optional[SessionBackend] = None):
+        """
+        Initialize an empty conversation
+        @param budget: Token budget for the history, defaults to token_budget()
+        @param system_prompt: Optional system message that is always sent first
+        @param pin_first: Keep the first user turn even when older history is trimmed
+        @param session_id: Session the conversation belongs to, used as key in the storage backend
+        @param storage: Optional backend that records every appended and dropped message
+        """
+        self.budget = budget or token_budget()
+        self.session_id = session_id
+        self.storage = storage
+        self.next_seq = 1
+        self.pin_first = pin_first
+        self.pinned: List[Message] = []
+        self.messages: Deque[Message] = deque()
+        self.tokens = 0  # Tokens of all retained messages
+        self.bytes = 0  # Memory held by the contents of all retained messages
+        self.last_used = time.monotonic()
+        self.attachments: Dict[str, Message] = {}  # Content hash -> retained message holding the full file
+        self.backend: Optional[str] = None  # Ollama node that last served the conversation and holds its KV cache
+        if system_prompt:
+            self._pin(Message("system", system_prompt))
+
+    def __len__(self) -> int:
+        return len(self.pinned) + len(self.messages)
+
+    def _pin(self, message: Message) -> None:
+        """
+        Add a message that is never trimmed
+        @param message: Message to pin
+        """
+        self.pinned.append(message)
+        self.tokens += message.tokens
+        self.bytes += message.size
+
+    def append(self, role: str, content: str, attachments: Sequence[str] = (),
+               references: Sequence[str] = ()) -> Message:
+        """
+        Add a message and trim the oldest history to fit the budget
+        @param role: Chat role of the message
+        @param content: Message text
+        @param attachments: Content hashes of files included in full in this message
+        @param references: Content hashes of files this message refers back to instead of repeating them
+        @returns: The stored message record
+        """
+        message = self._add(role, content, tuple(attachments))
+        if self.storage is not None:
+            self.storage.append(self.session_id, (message.seq, role, content, message.attachments))
+        if self.pin_first and role == "user" and not any(m.role == "user" for m in self.pinned):
+            self._pin(message)
+            return message
+        self.messages.append(message)
+        self.tokens += message.tokens
+        self.bytes += message.size
+
+        # Messages holding files referenced by the new message must survive trimming
+        keep = {self.attachments[digest] for digest in references if digest in self.attachments}
+        if len(keep) < len(set(references)):
+            logger.warning("Message refers to a file that is no longer in the conversation")
+        self.trim(keep)
+        return message
+
+    def _add(self, role: str, content: str, attachments: Tuple[str, ...], seq: int = 0) -> Message:
+        """
+        Create a message record and index the files it holds
+        @param role: Chat role of the message
+        @param content: Message text
+        @param attachments: Content hashes of files included in full in this message
+        @param seq: Sequence number of a restored message, 0 assigns the next one
+        @returns: The new message record
+        """
+        message = Message(role, content, attachments)
+        message.seq = seq or self.next_seq
+        self.next_seq = max(self.next_seq, message.seq) + 1
+        for digest in message.attachments:
+            self.attachments[digest] = message
+        return message
+
+    def restore(self, records: Sequence[Record]) -> None:
+        """
+        Rebuild the history from backend records without recording them again
+        @param records: Records of the retained messages in conversation order
+        """
+        for seq, role, content, attachments in records:
+            message = self._add(role, content, tuple(attachments), seq)
+            if self.pin_first and role == "user" and not any(m.role == "user" for m in self.pinned):
+                self._pin(message)
+                continue
+            self.messages.append(message)
+            self.tokens += message.tokens
+            self.bytes += message.size
+        self.trim()
+
+    def trim(self, keep: Optional[Set[Message]] = None) -> int:
+        """
+        Drop the oldest messages until the conversation fits the budget.
+        The newest message is always kept, even if it alone exceeds the budget.
+        @param keep: Messages that must not be dropped
+        @returns: Number of messages dropped
+        """
+        dropped = 0
+        index = 0
+        while self.tokens > self.budget and index < len(self.messages) - 1:
+            message = self.messages[index]
+            if keep and message in keep:
+                index += 1
+                continue
+            del self.messages[index]
+            self._forget(message)
+            dropped += 1
+        return dropped
+
+    def _forget(self, message: Message) -> None:
+        """
+        Update the accounting for a message that left the conversation
+        @param message: Removed message
+        """
+        self.tokens -= message.tokens
+        self.bytes -= message.size
+        for digest in message.attachments:
+            if self.attachments.get(digest) is message:
+                del self.attachments[digest]
+        if self.storage is not None:
+            self.storage.discard(self.session_id, message.seq)
+
+    def find_attachment(self, digest: str) -> Optional[Message]:
+        """
+        Find the retained message that holds a file in full
+        @param digest: Content hash of the file
+        @returns: The message, or None if no retained message holds the file
+        """
+        return self.attachments.get(digest)
+
+    def discard_last(self, message: Message) -> bool:
+        """
+        Remove the newest message if it is the given one, e.g. an unanswered prompt
+        @param message: Message expected at the end of the conversation
+        @returns: True if the message was removed
+        """
+        if self.messages and self.messages[-1] is message:
+            self.messages.pop()
+        elif not self.messages and self.pinned and self.pinned[-1] is message:
+            self.pinned.pop()
+        else:
+            return False
+        self._forget(message)
+        return True
+
+    def to_list(self) -> List[Message]:
+        """
+        Messages in the order they are sent to the model
+        @returns: Pinned messages followed by the retained history
+        """
+        return self.pinned + list(self.messages)
+
+
+class ConversationStore:
+    """
+    Conversations of all sessions with LRU and idle-time eviction.
+    Conversations are kept in least recently used order. Those idle for longer
+    than the TTL are evicted, and the least recently used ones are evicted
+    while the total memory exceeds the cap. Eviction only drops the local copy,
+    a conversation recorded in the backend is rehydrated by load() off the
+    event loop. Sessions created in this process or already looked up in the
+    backend are remembered, so load() only reaches the backend once for others.
+    """
+    def __init__(self, ttl: Optional[float] = None, max_bytes: Optional[int] = None,
+                 backend: Optional[SessionBackend] = None):
+        """
+        Initialize an empty store
+        @param ttl: Idle seconds after which a conversation is evicted, defaults to Config.LLM_SESSION_TTL
+        @param max_bytes: Memory cap for all conversations, defaults to Config.LLM_MAX_CONTEXT_BYTES
+        @param backend: Optional backend recording the conversations, e.g. one shared by all workers
+        """
+        self.ttl = ttl or Config.LLM_SESSION_TTL
+        self.max_bytes = max_bytes or Config.LLM_MAX_CONTEXT_BYTES
+        self.backend = backend
+        self.conversations: "OrderedDict[str, Conversation]" = OrderedDict()
+        self.evicted_sessions = 0
+        self.bytes_reclaimed = 0
+        self.in_use: Dict[str, int] = {}  # Sessions whose prompt is being built or answered -> number of holders
+        self.loaded: Set[str] = set()  # Sessions without a local copy whose backend records need no lookup
+
+    def __len__(self) -> int:
+        return len(self.conversations)
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self.conversations
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.conversations)
+
+    @property
+    def total_bytes(self) -> int:
+        """Memory held by all conversations"""
+        return sum(conversation.bytes for conversation in self.conversations.values())
+
+    def session_bytes(self, session_id: str) -> int:
+        """
+        Memory held by one session's conversation
+        @param session_id: Session identifier
+        @returns: Size of the retained message contents in bytes, 0 without a local copy
+        """
+        conversation = self.conversations.get(session_id)
+        return conversation.bytes if conversation is not None else 0
+
+    def get(self, session_id: str) -> Optional[Conversation]:
+        """
+        Get a session's local conversation and mark it as most recently used.
+        Never reads the backend, an evicted conversation is rehydrated by load().
+        @param session_id: Session identifier
+        @returns: The conversation, or None if the session has no local copy
+        """
+        conversation = self.conversations.get(session_id)
+        if conversation is None:
+            return None
+        conversation.last_used = time.monotonic()
+        self.conversations.move_to_end(session_id)
+        return conversation
+
+    def _new_conversation(self, session_id: str) -> Conversation:
+        """
+        Create an empty conversation with the configured system prompt
+        @param session_id: Session identifier
+        @returns: The new conversation, not yet added to the store
+        """
+        return Conversation(
+            system_prompt=Config.LLM_SYSTEM_PROMPT,
+            pin_first=Config.LLM_PIN_FIRST_MESSAGE,
+            session_id=session_id,
+            storage=self.backend
+        )
+
+    def add(self, session_id: str) -> None:
+        """
+        Note a session created in this process, the backend holds no records of it
+        @param session_id: Session identifier
+        """
+        if session_id not in self.conversations:
+            self.loaded.add(session_id)
+
+    async def load(self, session_id: str) -> Optional[Conversation]:
+        """
+        Get a session's conversation, rehydrating it in a worker thread so the
+        backend lookup does not block the event loop
+        @param session_id: Session identifier
+        @returns: The conversation, or None if the session has none
+        """
+        if session_id in self.conversations or session_id in self.loaded or self.backend is None:
+            return self.get(session_id)
+        records = await asyncio.to_thread(self.backend.load, session_id)
+        if session_id in self.conversations or session_id in self.loaded:
+            # Created or rehydrated while the backend was queried
+            return self.get(session_id)
+        return self._restore(session_id, records)
+
+    def _restore(self, session_id: str, records: Optional[List[Record]]) -> Optional[Conversation]:
+        """
+        Add a conversation rebuilt from backend records to the store
+        @param session_id: Session identifier
+        @param records: Records returned by the backend, None if it does not know the session
+        @returns: The restored conversation, or None without records
+        """
+        if records is None:
+            self.loaded.add(session_id)
+            return None
+        conversation = self._new_conversation(session_id)
+        conversation.restore(records)
+        self.conversations[session_id] = conversation
+        logger.debug(f"Rehydrated conversation of session {session_id} ({len(records)} messages)")
+        return conversation
+
+    def get_or_create(self, session_id: str) -> Conversation:
+        """
+        Get a session's conversation, creating it if needed.
+        Sessions with a backend are load()ed first, so recorded history is not replaced.
+        @param session_id: Session identifier
+        @returns: The session's conversation
+        """
+        conversation = self.get(session_id)
+        if conversation is None:
+            if self.backend is not None and session_id not in self.loaded:
+                # Its recorded messages would be overwritten by the new ones
+                logger.warning(f"Created conversation of session {session_id} without loading its recorded history")
+            conversation = self.conversations[session_id] = self._new_conversation(session_id)
+            self.loaded.discard(session_id)
+            logger.debug(f"Created conversation for session {session_id}")
+        return conversation
+
+    def remove(self, session_id: str) -> int:
+        """
+        Remove a session's conversation, including its backend records
+        @param session_id: Session identifier
+        @returns: Bytes released, 0 if the session had no conversation
+        """
+        if self.backend is not None:
+            self.backend.remove(session_id)
+        self.loaded.discard(session_id)
+        conversation = self.conversations.pop(session_id, None)
+        return conversation.bytes if conversation is not None else 0
+
+    def release(self, session_id: str) -> int:
+        """
+        Drop the local copy of a session's conversation, keeping its backend records
+        @param session_id: Session identifier
+        @returns: Bytes released, 0 if there was no local copy
+        """
+        self.loaded.discard(session_id)
+        conversation = self.conversations.pop(session_id, None)
+        return conversation.bytes if conversation is not None else 0
+
+    @contextmanager
+    def hold(self, session_id: str) -> Iterator[None]:
+        """
+        Protect a session's conversation from eviction, e.g. while its prompt
+        waits for an LLM slot after referring back to files in the history
+        @param session_id: Session identifier
+        """
+        self.in_use[session_id] = self.in_use.get(session_id, 0) + 1
+        try:
+            yield
+        finally:
+            if self.in_use[session_id] == 1:
+                del self.in_use[session_id]
+            else:
+                self.in_use[session_id] -= 1
+
+    def evict(self) -> int:
+        """
+        Evict idle conversations and enforce the memory cap.
+        The most recently used conversation and held conversations are never evicted.
+        Without a backend an evicted history is gone, so evicting one that is
+        not idle yet to stay under the cap is logged as a warning.
+        @returns: Number of evicted conversations
+        """
+        evicted = 0
+        now = time.monotonic()
+        total = self.total_bytes
+        for session_id, conversation in list(self.conversations.items())[:-1]:
+            if now - conversation.last_used < self.ttl and total <= self.max_bytes:
+                break
+            if session_id in self.in_use:
+                continue
+            del self.conversations[session_id]
+            total -= conversation.bytes
+            self.evicted_sessions += 1
+            self.bytes_reclaimed += conversation.bytes
+            evicted += 1
+            if self.backend is None and now - conversation.last_used < self.ttl:
+                logger.warning(
+                    f"Evicted conversation of session {session_id} ({conversation.bytes} bytes) to stay under "
+                    f"the memory cap, its history is lost"
+                )
+            else:
+                logger.info(f"Evicted conversation of session {session_id} ({conversation.bytes} bytes)")
+        return evicted
+
+    def close(self) -> None:
+        """Flush pending backend writes and release the backend"""
+        if self.backend is not None:
+            self.backend.close()
@@ -1,3 +1,6 @@
 from .llm import LLM
+from .backends import Backend, BackendPool, NoBackendAvailableError
+from .cache import ResponseCache
+from .scheduler import LLMScheduler, SchedulerBusyError
 
-__all__ = ['LLM']
+__all__ = ['LLM', 'Backend', 'BackendPool', 'NoBackendAvailableError', 'ResponseCache', 'LLMScheduler', 'SchedulerBusyError']
@@ -0,0 +1,139 @@
+"""
+Pool of Ollama backends.
+Routes requests to the backend with the fewest outstanding requests, keeps a
+conversation on the node that already holds its KV cache, and ejects nodes
+that fail health checks until they recover.
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, List, Optional
+
+import httpx
+from ollama import AsyncClient
+
+from modules.utils.logger import logger
+from modules.config.config import Config
+
+
+class NoBackendAvailableError(Exception):
+    """Raised when no Ollama backend is configured"""
+
+
+class Backend:
+    """A single Ollama node with its own pooled HTTP client"""
+    def __init__(self, host: str):
+        """
+        Create the client for a node
+        @param host: Base URL of the Ollama API
+        """
+        self.host = host
+        # AsyncClient builds its own httpx client, the connection pool is owned here so it can be closed
+        self.transport = httpx.AsyncHTTPTransport(limits=httpx.Limits(
+            max_connections=Config.LLM_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=Config.LLM_HTTP_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=Config.LLM_HTTP_KEEPALIVE_EXPIRY
+        ))
+        self.client = AsyncClient(
+            host=host,
+            timeout=httpx.Timeout(Config.LLM_HTTP_TIMEOUT, connect=Config.LLM_HTTP_CONNECT_TIMEOUT),
+            transport=self.transport
+        )
+        self.outstanding = 0
+        self.healthy = True
+
+    def __repr__(self) -> str:
+        return f"Backend({self.host!r}, outstanding={self.outstanding}, healthy={self.healthy})"
+
+
+class BackendPool:
+    """
+    Routes LLM requests across several Ollama nodes.
+    A session sticks to the node it was last served by while that node is
+    healthy, otherwise the healthy node with the fewest outstanding requests wins.
+    """
+    def __init__(self, hosts: Optional[List[str]] = None):
+        """
+        Initialize the pool
+        @param hosts: Ollama base URLs, defaults to Config.LLM_HOSTS
+        """
+        self.backends = [Backend(host) for host in (hosts or Config.LLM_HOSTS)]
+        if not self.backends:
+            raise NoBackendAvailableError("No Ollama hosts configured")
+        self._health_task: Optional[asyncio.Task] = None
+
+    def select(self, preferred: Optional[str] = None) -> Backend:
+        """
+        Choose the backend for a request
+        @param preferred: Host that served the conversation before
+        @returns: The preferred backend if healthy, else the healthy backend with the fewest outstanding requests
+        """
+        healthy = [backend for backend in self.backends if backend.healthy]
+        if preferred is not None:
+            for backend in healthy:
+                if backend.host == preferred:
+                    return backend
+        # With every node ejected, still try one rather than failing outright
+        return min(healthy or self.backends, key=lambda backend: backend.outstanding)
+
+    @asynccontextmanager
+    async def lease(self, preferred: Optional[str] = None) -> AsyncGenerator[Backend, None]:
+        """
+        Use a backend for the duration of the context, counting it as outstanding
+        @param preferred: Host that served the conversation before
+        @yields: The selected backend
+        """
+        backend = self.select(preferred)
+        backend.outstanding += 1
+        try:
+            yield backend
+        finally:
+            backend.outstanding -= 1
+
+    def mark_unhealthy(self, backend: Backend, reason: str) -> None:
+        """
+        Eject a backend until the next successful health check
+        @param backend: Backend that failed
+        @param reason: Failure description for the log
+        """
+        if backend.healthy:
+            logger.warning(f"Ejecting Ollama backend {backend.host}: {reason}")
+        backend.healthy = False
+
+    async def check_health(self) -> int:
+        """
+        Probe every backend and update its health state
+        @returns: Number of healthy backends
+        """
+        async def probe(backend: Backend) -> None:
+            try:
+                await asyncio.wait_for(backend.client.list(), timeout=Config.LLM_HTTP_CONNECT_TIMEOUT)
+            except Exception as e:
+                self.mark_unhealthy(backend, str(e) or type(e).__name__)
+                return
+            if not backend.healthy:
+                logger.info(f"Ollama backend {backend.host} recovered")
+            backend.healthy = True
+
+        await asyncio.gather(*(probe(backend) for backend in self.backends))
+        return sum(1 for backend in self.backends if backend.healthy)
+
+    def start_health_checks(self) -> None:
+        """Start the periodic health check task"""
+        if self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def _health_loop(self) -> None:
+        """Run health checks every Config.LLM_HEALTH_CHECK_INTERVAL seconds"""
+        while True:
+            await asyncio.sleep(Config.LLM_HEALTH_CHECK_INTERVAL)
+            await self.check_health()
+
+    async def close(self) -> None:
+        """Stop health checks and close all HTTP clients"""
+        if self._health_task is not None:
+            self._health_task.cancel()
+            await asyncio.gather(self._health_task, return_exceptions=True)
+            self._health_task = None
+        for backend in self.backends:
+            await backend.transport.aclose()
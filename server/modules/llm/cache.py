@@ -0,0 +1,164 @@
+"""
+Response cache for LLM generations.
+Caches complete responses keyed by model, normalized prompt and a hash of the
+conversation history, with an in-memory LRU tier and an optional SQLite tier
+that survives restarts.
+"""
+
+import asyncio
+import hashlib
+import sqlite3
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Optional, Tuple
+
+from modules.utils.logger import logger
+from modules.config.config import Config
+
+
+class ResponseCache:
+    """
+    Two-tier cache of LLM responses.
+    The memory tier is an LRU bounded by total size in bytes, the optional disk
+    tier is a SQLite table. Entries in both tiers expire after the TTL.
+    """
+    def __init__(self, max_bytes: Optional[int] = None, ttl: Optional[float] = None,
+                 db_path: Optional[str] = None):
+        """
+        Initialize the cache
+        @param max_bytes: Memory tier size cap, defaults to Config.LLM_CACHE_MAX_BYTES
+        @param ttl: Seconds an entry stays valid, defaults to Config.LLM_CACHE_TTL
+        @param db_path: SQLite file for the disk tier, defaults to Config.LLM_CACHE_DB_PATH (None disables it)
+        """
+        self.max_bytes = max_bytes or Config.LLM_CACHE_MAX_BYTES
+        self.ttl = ttl or Config.LLM_CACHE_TTL
+        self.entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()  # key -> (response, stored at)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._pending = set()  # Disk writes in progress
+
+        self.db: Optional[sqlite3.Connection] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        db_path = db_path or Config.LLM_CACHE_DB_PATH
+        if db_path:
+            # A single worker thread serializes all access to the connection
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="response-cache")
+            self.db = sqlite3.connect(db_path, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT NOT NULL, stored_at REAL NOT NULL)"
+            )
+            self.db.commit()
+            logger.info(f"Response cache disk tier at {db_path}")
+
+    @staticmethod
+    def make_key(model: str, prompt: str, history: Iterable) -> str:
+        """
+        Build the cache key for a request
+        @param model: Model name
+        @param prompt: User prompt, whitespace is normalized
+        @param history: Messages preceding the prompt
+        @returns: Hex digest identifying the request
+        """
+        key = hashlib.sha256()
+        key.update(model.encode("utf-8") + b"\0")
+        for message in history:
+            key.update(message["role"].encode("utf-8") + b"\0")
+            key.update(message["content"].encode("utf-8") + b"\0")
+        key.update(" ".join(prompt.split()).encode("utf-8"))
+        return key.hexdigest()
+
+    async def get(self, key: str) -> Optional[str]:
+        """
+        Look up a response
+        @param key: Cache key from make_key()
+        @returns: Cached response, or None on a miss
+        """
+        now = time.time()
+        entry = self.entries.get(key)
+        if entry is not None:
+            if now - entry[1] < self.ttl:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self._remove(key)
+
+        if self.db is not None:
+            row = await asyncio.get_running_loop().run_in_executor(self._executor, self._db_get, key)
+            if row is not None and now - row[1] < self.ttl:
+                self._store(key, row[0], row[1])
+                self.hits += 1
+                return row[0]
+
+        self.misses += 1
+        return None
+
+    def put(self, key: str, response: str) -> None:
+        """
+        Store a response. Disk writes happen in the background.
+        @param key: Cache key from make_key()
+        @param response: Complete response text
+        """
+        stored_at = time.time()
+        self._store(key, response, stored_at)
+        if self.db is not None:
+            future = asyncio.get_running_loop().run_in_executor(self._executor, self._db_put, key, response, stored_at)
+            self._pending.add(future)
+            future.add_done_callback(self._pending.discard)
+
+    def close(self) -> None:
+        """Wait for pending disk writes and close the database"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def _store(self, key: str, response: str, stored_at: float) -> None:
+        """
+        Insert into the memory tier and evict least recently used entries over the size cap
+        @param key: Cache key
+        @param response: Response text
+        @param stored_at: Time the response was generated
+        """
+        if key in self.entries:
+            self._remove(key)
+        size = sys.getsizeof(response)
+        if size > self.max_bytes:
+            return
+        self.entries[key] = (response, stored_at)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            oldest = next(iter(self.entries))
+            self._remove(oldest)
+
+    def _remove(self, key: str) -> None:
+        """
+        Remove an entry from the memory tier
+        @param key: Cache key
+        """
+        response, _ = self.entries.pop(key)
+        self.bytes -= sys.getsizeof(response)
+
+    def _db_get(self, key: str) -> Optional[Tuple[str, float]]:
+        """Read an entry from the disk tier, a failed read counts as a miss (runs in the cache thread)"""
+        try:
+            return self.db.execute("SELECT response, stored_at FROM responses WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"Failed to read response cache entry: {str(e)}")
+            return None
+
+    def _db_put(self, key: str, response: str, stored_at: float) -> None:
+        """Write an entry and purge expired ones from the disk tier (runs in the cache thread)"""
+        try:
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses (key, response, stored_at) VALUES (?, ?, ?)",
+                (key, response, stored_at)
+            )
+            self.db.execute("DELETE FROM responses WHERE stored_at < ?", (stored_at - self.ttl,))
+            self.db.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Failed to write response cache entry: {str(e)}")
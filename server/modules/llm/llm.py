@@ -1,64 +1,326 @@
-from ollama import Client
+import asyncio
+import time
+from typing import Awaitable, Callable, List, Optional, Sequence, Tuple
+
+import httpx
+from ollama import AsyncClient
 
 from modules.utils.logger import logger
 from modules.config.config import Config
+from modules.utils.metrics import metrics, stage
+from modules.utils.tracing import Trace
+from modules.conversation.store import Conversation, ConversationStore, Message
+from .backends import BackendPool
+from .cache import ResponseCache
+from .scheduler import LLMScheduler, SchedulerBusyError
+
+LLM_SECONDS = stage("llm")
+TTFT_SECONDS = metrics.histogram("rubberduck_llm_ttft_seconds", "Seconds from sending a request to Ollama to its first token")
+CACHE_HITS = metrics.counter("rubberduck_llm_cache_hits_total", "Responses served from the response cache")
+LLM_ERRORS = metrics.counter("rubberduck_llm_errors_total", "LLM requests that failed")
 
 class LLM:
     """
     Wrapper class for the Ollama API
     """
-    def __init__(self):
+    def __init__(self, store: Optional[ConversationStore] = None):
         """
         Initialize the LLM object
+        @param store: Conversation store shared with the session manager
         """
         logger.info("Initializing LLM service")
-        self.ollama = Client(host="http://ollama:11434")
-        self.sessions = {}
+        self.backends = BackendPool()
+        self.store = store if store is not None else ConversationStore()
+        self.scheduler = LLMScheduler()
+        self.cache = ResponseCache() if Config.LLM_CACHE_ENABLED else None
         logger.info("LLM service initialized successfully")
 
-    async def generate_response(self, session_id: str, prompt: str) -> dict:
-        """Generate a response to a prompt"""
+    async def generate_response(
+        self,
+        session_id: str,
+        prompt: str,
+        on_chunk: Optional[Callable[[str], Awaitable[None]]] = None,
+        on_queue: Optional[Callable[[int], Awaitable[None]]] = None,
+        attachments: Sequence[str] = (),
+        references: Sequence[str] = (),
+        trace: Optional[Trace] = None
+    ) -> dict:
+        """
+        Generate a response to a prompt
+        @param session_id: Session the prompt belongs to
+        @param prompt: Formatted user prompt
+        @param on_chunk: Optional coroutine called with every streamed token chunk.
+                         When given, the response is streamed from Ollama.
+        @param on_queue: Optional coroutine called with the queue position while waiting for a backend slot
+        @param attachments: Content hashes of files included in full in the prompt
+        @param references: Content hashes of earlier files the prompt refers back to
+        @param trace: Optional trace receiving the queue, LLM and Ollama timings
+        @returns: Dict with the session ID, the complete message and the time to first token
+        @raises SchedulerBusyError: If the admission queue is full
+        """
+        trace = trace if trace is not None else Trace(session_id)
+        user_message = None
         try:
             logger.info(f"Generating response for session {session_id}")
-            logger.debug(f"Prompt: {prompt}")
-
-            if len(self.sessions) == 0 or session_id not in self.sessions:
-                self.sessions[session_id] = [{"role": "user", "content": prompt}]
-                logger.debug("Added new session and user message to context")
-            else:
-                # Manage message history size
-                if len(self.sessions[session_id]) >= Config.LLM_MAX_HISTORY:
-                    self.sessions[session_id] = self.sessions[session_id][-Config.LLM_MAX_HISTORY:]
-                    logger.debug(f"Trimmed message history to {Config.LLM_MAX_HISTORY} messages")
-
-                # Append the user message to the messages list
-                self.sessions[session_id].append({"role": "user", "content": prompt})
-                logger.debug("Added user message to context")
-            
-            # Create a chat response
-            logger.info("Sending request to Ollama")
-            response = self.ollama.chat(
-                model=Config.LLM_MODEL,
-                messages=self.sessions[session_id],
-                stream=Config.LLM_STREAM
-            )
+            logger.debug("Prompt: %s", prompt)
+
+            # A history evicted since the prompt was built is read back off the event loop
+            await self.store.load(session_id)
+
+            # Serve identical requests from the cache without touching the backend
+            cache_key = None
+            if self.cache is not None:
+                conversation = self.store.get(session_id)
+                history = conversation.to_list() if conversation is not None else []
+                cache_key = ResponseCache.make_key(Config.LLM_MODEL, prompt, history)
+                with trace.span("cache"):
+                    cached = await self.cache.get(cache_key)
+                if cached is not None:
+                    trace.set(cached=True)
+                    return await self._serve_cached(session_id, prompt, cached, on_chunk, attachments, references)
+
+            queued = time.perf_counter()
+            async with self.scheduler.slot(session_id, on_queue):
+                trace.add("queue", queued)
+                conversation = self.store.get_or_create(session_id)
+
+                # Append the user message, trimming old history to the token budget
+                user_message = conversation.append("user", prompt, attachments, references)
+                self.store.evict()
+                logger.debug(f"Added user message to context ({conversation.tokens}/{conversation.budget} tokens)")
+
+                # Create a chat response
+                logger.info("Sending request to Ollama")
+                started = time.perf_counter()
+                content, ttft = await self._chat(conversation, on_chunk, trace)
+                trace.add("llm", started)
+                LLM_SECONDS.observe(trace.last - started)
+                if on_chunk is not None:
+                    # Without streaming the first token only arrives with the whole response
+                    TTFT_SECONDS.observe(ttft)
+                trace.set(ttft=round(ttft, 6), backend=conversation.backend)
             logger.debug("Received response from Ollama")
+            logger.info(f"Time to first token for session {session_id}: {ttft:.3f}s")
             
-            # Append the response to the messages list
-            self.sessions[session_id].append(response["message"])
+            # Append the response to the conversation
+            conversation.append("assistant", content)
             logger.debug("Added response to context")
+            if cache_key is not None and content:
+                self.cache.put(cache_key, content)
             
             result = {
                 "session_id": session_id,
-                "message": response["message"]["content"]
+                "message": content,
+                "ttft": ttft
             }
             logger.info(f"Successfully generated response for session {session_id}")
             return result
             
+        except asyncio.CancelledError:
+            # Drop the unanswered prompt so a rephrased question replaces it
+            conversation = self.store.get(session_id)
+            if conversation is not None and user_message is not None:
+                conversation.discard_last(user_message)
+            logger.info(f"Generation cancelled for session {session_id}")
+            raise
+        except SchedulerBusyError:
+            raise
         except Exception as e:
+            LLM_ERRORS.inc()
+            trace.set(error=str(e))
             logger.error(f"Error generating response for session {session_id}: {str(e)}")
             return {
                 "session_id": session_id,
                 "message": f"Error generating response: {str(e)}"
             }
 
+    async def warm_up(self) -> bool:
+        """
+        Wait for Ollama to accept requests and load the configured model,
+        so the first user request does not pay for a cold model load.
+        A model that cannot be loaded yet, e.g. because it is still being
+        pulled after Ollama started, counts as not ready and is retried.
+        @returns: True if the model is resident, False if it did not become ready in time
+        """
+        started = time.perf_counter()
+        deadline = started + Config.LLM_READY_TIMEOUT
+        hosts = ", ".join(backend.host for backend in self.backends.backends)
+        while not await self.backends.check_health():
+            if time.perf_counter() >= deadline:
+                logger.error(f"Ollama not ready after {Config.LLM_READY_TIMEOUT:.0f}s, model will load on first request")
+                self.backends.start_health_checks()
+                return False
+            logger.debug(f"Waiting for Ollama at {hosts}")
+            await asyncio.sleep(Config.LLM_READY_POLL_INTERVAL)
+        ready = time.perf_counter()
+        logger.info(f"Ollama ready after {ready - started:.2f}s")
+        self.backends.start_health_checks()
+
+        # A chat request without messages loads the model and keeps it resident
+        async def preload(client: AsyncClient) -> None:
+            await client.chat(model=Config.LLM_MODEL, messages=[], keep_alive=Config.LLM_KEEP_ALIVE)
+
+        failed = set()  # Hosts whose preload failure was already logged
+        while True:
+            healthy = [backend for backend in self.backends.backends if backend.healthy]
+            results = await asyncio.gather(*(preload(backend.client) for backend in healthy), return_exceptions=True)
+            loaded = 0
+            for backend, result in zip(healthy, results):
+                if not isinstance(result, Exception):
+                    loaded += 1
+                elif backend.host not in failed:
+                    failed.add(backend.host)
+                    logger.warning(f"Model {Config.LLM_MODEL} not available on {backend.host} yet, retrying: {str(result)}")
+                else:
+                    logger.debug(f"Preloading model {Config.LLM_MODEL} on {backend.host} failed: {str(result)}")
+            if loaded:
+                break
+            if time.perf_counter() >= deadline:
+                logger.error(f"Model {Config.LLM_MODEL} could not be loaded within {Config.LLM_READY_TIMEOUT:.0f}s")
+                return False
+            await asyncio.sleep(Config.LLM_READY_POLL_INTERVAL)
+        logger.info(f"Model {Config.LLM_MODEL} loaded on {loaded}/{len(self.backends.backends)} backends in {time.perf_counter() - ready:.2f}s")
+        return True
+
+    async def _serve_cached(
+        self,
+        session_id: str,
+        prompt: str,
+        content: str,
+        on_chunk: Optional[Callable[[str], Awaitable[None]]],
+        attachments: Sequence[str],
+        references: Sequence[str]
+    ) -> dict:
+        """
+        Answer a request from the response cache.
+        Both turns are still recorded so later turns see a consistent history.
+        @param session_id: Session the prompt belongs to
+        @param prompt: Formatted user prompt
+        @param content: Cached response text
+        @param on_chunk: Optional coroutine receiving the response as a single chunk
+        @param attachments: Content hashes of files included in full in the prompt
+        @param references: Content hashes of earlier files the prompt refers back to
+        @returns: Result dict in the same format as generate_response
+        """
+        conversation = self.store.get_or_create(session_id)
+        conversation.append("user", prompt, attachments, references)
+        self.store.evict()
+        conversation.append("assistant", content)
+        if on_chunk is not None:
+            await on_chunk(content)
+        CACHE_HITS.inc()
+        logger.info(f"Served cached response for session {session_id}")
+        return {
+            "session_id": session_id,
+            "message": content,
+            "ttft": 0.0,
+            "cached": True
+        }
+
+    async def close(self) -> None:
+        """Release resources held by the service"""
+        await self.backends.close()
+        if self.cache is not None:
+            self.cache.close()
+
+    async def _chat(
+        self,
+        conversation: Conversation,
+        on_chunk: Optional[Callable[[str], Awaitable[None]]] = None,
+        trace: Optional[Trace] = None
+    ) -> Tuple[str, float]:
+        """
+        Send the conversation to an Ollama backend.
+        The conversation stays on the node that served it before while that node
+        is healthy, so its prompt prefix is still cached there.
+        @param conversation: Chat history including the new user message
+        @param on_chunk: Optional coroutine called with every streamed token chunk
+        @param trace: Optional trace receiving the timings reported by Ollama
+        @returns: Tuple of the response text and the time to first token in seconds
+        """
+        messages = conversation.to_list()
+        while True:
+            async with self.backends.lease(conversation.backend) as backend:
+                try:
+                    result = await self._chat_on(backend.client, messages, on_chunk, trace)
+                except httpx.ConnectError as e:
+                    # The request never reached the node, so it is safe to retry elsewhere
+                    self.backends.mark_unhealthy(backend, str(e) or type(e).__name__)
+                    if not any(other.healthy for other in self.backends.backends):
+                        raise
+                    continue
+            conversation.backend = backend.host
+            return result
+
+    async def _chat_on(
+        self,
+        client: AsyncClient,
+        messages: List[Message],
+        on_chunk: Optional[Callable[[str], Awaitable[None]]] = None,
+        trace: Optional[Trace] = None
+    ) -> Tuple[str, float]:
+        """
+        Send messages to a single Ollama backend
+        @param client: Client of the selected backend
+        @param messages: Chat history including the new user message
+        @param on_chunk: Optional coroutine called with every streamed token chunk
+        @param trace: Optional trace receiving the timings reported by Ollama
+        @returns: Tuple of the response text and the time to first token in seconds
+        """
+        started = time.perf_counter()
+        if on_chunk is None:
+            response = await client.chat(
+                model=Config.LLM_MODEL,
+                messages=messages,
+                stream=False,
+                options={"num_ctx": Config.LLM_CONTEXT_SIZE},
+                keep_alive=Config.LLM_KEEP_ALIVE
+            )
+            # Without streaming the first token arrives together with the last one
+            self._record_timings(response, trace)
+            return response["message"]["content"], time.perf_counter() - started
+
+        ttft = None
+        parts = []
+        stream = await client.chat(
+            model=Config.LLM_MODEL,
+            messages=messages,
+            stream=True,
+            options={"num_ctx": Config.LLM_CONTEXT_SIZE},
+            keep_alive=Config.LLM_KEEP_ALIVE
+        )
+        try:
+            async for part in stream:
+                if part.get("done"):
+                    self._record_timings(part, trace)
+                content = part["message"]["content"]
+                if not content:
+                    continue
+                if ttft is None:
+                    ttft = time.perf_counter() - started
+                parts.append(content)
+                await on_chunk(content)
+        finally:
+            # Closes the HTTP stream so Ollama stops decoding on cancellation
+            await stream.aclose()
+        if ttft is None:
+            ttft = time.perf_counter() - started
+        return "".join(parts), ttft
+
+    @staticmethod
+    def _record_timings(response, trace: Optional[Trace]) -> None:
+        """
+        Copy the prefill and decode statistics of a final Ollama response into a trace
+        @param response: Final (done) chat response
+        @param trace: Trace to update, may be None
+        """
+        if trace is None:
+            return
+        for field in ("prompt_eval_duration", "eval_duration", "load_duration"):
+            nanoseconds = response.get(field)
+            if nanoseconds is not None:
+                trace.set(**{field: nanoseconds / 1e9})
+        for field in ("prompt_eval_count", "eval_count"):
+            count = response.get(field)
+            if count is not None:
+                trace.set(**{field: count})
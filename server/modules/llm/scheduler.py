@@ -0,0 +1,193 @@
+"""
+Admission scheduler for LLM requests.
+Caps the number of requests in flight to the Ollama backend and queues the rest
+per session, granting free slots to sessions in round-robin order.
+"""
+
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, Awaitable, Callable, Deque, Dict, List, Optional
+
+from modules.utils.logger import logger
+from modules.utils.metrics import metrics, stage
+from modules.config.config import Config
+
+
+QUEUE_SECONDS = stage("queue")
+REJECTED = metrics.counter("rubberduck_llm_rejected_total", "LLM requests rejected because the queue was full")
+
+
+class SchedulerBusyError(Exception):
+    """Raised when the admission queue is full"""
+    def __init__(self, depth: int):
+        self.depth = depth
+        super().__init__(f"LLM queue is full ({depth} waiting requests)")
+
+
+class _Waiter:
+    """A queued request waiting for a backend slot"""
+    __slots__ = ("session_id", "future", "on_position", "position")
+
+    def __init__(self, session_id: str, future: asyncio.Future,
+                 on_position: Optional[Callable[[int], Awaitable[None]]]):
+        self.session_id = session_id
+        self.future = future
+        self.on_position = on_position
+        self.position = 0
+
+
+class LLMScheduler:
+    """
+    Fair admission control in front of the LLM backend.
+    At most `max_inflight` requests run at once. Waiting requests are kept in
+    one FIFO per session and sessions take turns, so a single heavy user cannot
+    starve everyone else.
+    """
+    def __init__(self, max_inflight: Optional[int] = None, max_queue_depth: Optional[int] = None):
+        """
+        Initialize the scheduler
+        @param max_inflight: Maximum number of concurrent backend requests,
+                             defaults to this worker's share of Config.LLM_MAX_INFLIGHT
+        @param max_queue_depth: Maximum number of waiting requests before new ones are rejected,
+                                defaults to this worker's share of Config.LLM_MAX_QUEUE_DEPTH
+        """
+        # Every worker process runs its own scheduler, so the configured limits are split between them
+        workers = max(Config.SERVER_WORKERS, 1)
+        self.max_inflight = max_inflight or -(-Config.LLM_MAX_INFLIGHT // workers)
+        self.max_queue_depth = max_queue_depth or -(-Config.LLM_MAX_QUEUE_DEPTH // workers)
+        self.inflight = 0
+        self.depth = 0
+        self.queues: Dict[str, Deque[_Waiter]] = {}
+        self.rotation: Deque[str] = deque()  # Sessions with waiting requests, next to be served first
+        self._notifications = set()  # Pending position updates, referenced until delivered
+
+    @asynccontextmanager
+    async def slot(self, session_id: str,
+                   on_position: Optional[Callable[[int], Awaitable[None]]] = None) -> AsyncGenerator[None, None]:
+        """
+        Hold a backend slot for the duration of the context
+        @param session_id: Session the request belongs to
+        @param on_position: Optional coroutine called with the 1-based queue position while waiting
+        @raises SchedulerBusyError: If the queue is full
+        """
+        await self.acquire(session_id, on_position)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, session_id: str,
+                      on_position: Optional[Callable[[int], Awaitable[None]]] = None) -> None:
+        """
+        Wait until a backend slot is granted to the session
+        @param session_id: Session the request belongs to
+        @param on_position: Optional coroutine called with the 1-based queue position while waiting
+        @raises SchedulerBusyError: If the queue is full
+        """
+        if self.inflight < self.max_inflight and self.depth == 0:
+            self.inflight += 1
+            QUEUE_SECONDS.observe(0.0)
+            return
+        if self.depth >= self.max_queue_depth:
+            logger.warning(f"LLM queue full, rejecting request from session {session_id}")
+            REJECTED.inc()
+            raise SchedulerBusyError(self.depth)
+        started = time.perf_counter()
+
+        waiter = _Waiter(session_id, asyncio.get_running_loop().create_future(), on_position)
+        queue = self.queues.get(session_id)
+        if queue is None:
+            queue = self.queues[session_id] = deque()
+            self.rotation.append(session_id)
+        queue.append(waiter)
+        self.depth += 1
+        logger.debug(f"Queued LLM request for session {session_id} (depth {self.depth})")
+        self._notify_positions()
+
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # The slot was granted just before the cancellation arrived
+                self.release()
+            else:
+                self._remove(waiter)
+                self._notify_positions()
+            raise
+        QUEUE_SECONDS.observe(time.perf_counter() - started)
+
+    def release(self) -> None:
+        """Return a slot and hand it to the next session in turn"""
+        self.inflight -= 1
+        self._grant()
+
+    def _grant(self) -> None:
+        """Grant free slots to waiting requests in round-robin order"""
+        granted = False
+        while self.inflight < self.max_inflight and self.rotation:
+            session_id = self.rotation.popleft()
+            queue = self.queues[session_id]
+            waiter = queue.popleft()
+            if queue:
+                self.rotation.append(session_id)
+            else:
+                del self.queues[session_id]
+            self.depth -= 1
+            self.inflight += 1
+            waiter.future.set_result(None)
+            granted = True
+        if granted:
+            self._notify_positions()
+
+    def _remove(self, waiter: _Waiter) -> None:
+        """
+        Remove a cancelled waiter from its session queue
+        @param waiter: Waiter to remove
+        """
+        queue = self.queues.get(waiter.session_id)
+        if queue is None or waiter not in queue:
+            return
+        queue.remove(waiter)
+        self.depth -= 1
+        if not queue:
+            del self.queues[waiter.session_id]
+            self.rotation.remove(waiter.session_id)
+
+    def _schedule_order(self) -> List[_Waiter]:
+        """
+        Order in which waiting requests will be served
+        @returns: Waiters interleaved by session in round-robin order
+        """
+        order = []
+        round_index = 0
+        while len(order) < self.depth:
+            for session_id in self.rotation:
+                queue = self.queues[session_id]
+                if round_index < len(queue):
+                    order.append(queue[round_index])
+            round_index += 1
+        return order
+
+    def _notify_positions(self) -> None:
+        """Push queue positions to waiters whose position changed"""
+        for position, waiter in enumerate(self._schedule_order(), start=1):
+            if waiter.position != position and waiter.on_position is not None:
+                waiter.position = position
+                task = asyncio.create_task(self._send_position(waiter, position))
+                self._notifications.add(task)
+                task.add_done_callback(self._notifications.discard)
+
+    async def _send_position(self, waiter: _Waiter, position: int) -> None:
+        """
+        Deliver a queue position update, ignoring delivery failures
+        @param waiter: Waiter to notify
+        @param position: New 1-based queue position
+        """
+        if waiter.future.done():
+            return
+        try:
+            await waiter.on_position(position)
+        except Exception as e:
+            logger.debug(f"Failed to send queue position to session {waiter.session_id}: {str(e)}")
@@ -0,0 +1,12 @@
+from .bm25 import BM25Index, Chunk, split_chunks, tokenize
+from .outline import Outline, OutlineCache, referenced_lines
+
+__all__ = [
+    'BM25Index',
+    'Chunk',
+    'split_chunks',
+    'tokenize',
+    'Outline',
+    'OutlineCache',
+    'referenced_lines'
+]
@@ -0,0 +1,219 @@
+"""
+BM25 retrieval over attached files.
+Splits files into code-aware chunks at top-level definitions and blank-line
+boundaries, indexes them in an in-memory inverted index and ranks them
+against the user's question with Okapi BM25.
+"""
+
+import math
+import re
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Set
+
+from modules.config.config import Config
+from modules.conversation.store import estimate_tokens
+
+_IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|\d+")
+_CAMEL_PART = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+# Lines that start a new top-level unit in common languages
+_BOUNDARY = re.compile(
+    r"^(?:@|def |async def |class |function |export |public |private |protected |static |"
+    r"interface |struct |enum |fn |func |impl |module |const |let |var )"
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split text into lower-case search terms.
+    Identifiers are kept whole and also split into their snake_case and
+    camelCase parts, so "parseConfig" matches "config".
+    @param text: Code or natural language
+    @returns: Terms in order of occurrence
+    """
+    terms = []
+    for identifier in _IDENTIFIER.findall(text):
+        lower = identifier.lower()
+        terms.append(lower)
+        parts = [part.lower() for piece in identifier.split("_") for part in _CAMEL_PART.findall(piece)]
+        if len(parts) > 1:
+            terms.extend(parts)
+    return terms
+
+
+@dataclass
+class Chunk:
+    """A contiguous range of lines of an attached file"""
+    digest: str  # Content hash of the file
+    filename: str
+    start: int  # First line, 1-based
+    end: int  # Last line, inclusive
+    text: str
+    tokens: int  # Estimated prompt tokens of the text
+
+
+def split_chunks(filename: str, content: str, digest: str, max_lines: Optional[int] = None) -> List[Chunk]:
+    """
+    Split a file into chunks that follow its structure.
+    A chunk ends before a top-level definition, at a blank line once it is
+    half full, or when it reaches the line limit.
+    @param filename: Name of the file
+    @param content: File content
+    @param digest: Content hash of the file
+    @param max_lines: Maximum lines per chunk, defaults to Config.RETRIEVAL_CHUNK_LINES
+    @returns: Chunks in file order
+    """
+    max_lines = max_lines or Config.RETRIEVAL_CHUNK_LINES
+    lines = content.splitlines()
+    chunks: List[Chunk] = []
+    start = 0
+
+    def close(end: int) -> None:
+        text = "\n".join(lines[start:end])
+        if text.strip():
+            chunks.append(Chunk(digest, filename, start + 1, end, text, estimate_tokens(text)))
+
+    for index, line in enumerate(lines):
+        size = index - start
+        if size and (
+            size >= max_lines
+            or (_BOUNDARY.match(line) and not lines[index - 1].startswith("@"))
+            or (not line.strip() and size >= max_lines // 2)
+        ):
+            close(index)
+            start = index
+    close(len(lines))
+    return chunks
+
+
+class BM25Index:
+    """
+    Inverted index over the chunks of a session's attached files.
+    Files are added incrementally and identified by content hash, so a file
+    attached again is not indexed twice and a changed file replaces its
+    previous version. Adding files may run in a worker thread, access is locked.
+    """
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        """
+        Initialize an empty index
+        @param k1: Term frequency saturation
+        @param b: Document length normalization
+        """
+        self.k1 = k1
+        self.b = b
+        self.chunks: Dict[int, Chunk] = {}
+        self.lengths: Dict[int, int] = {}  # Chunk ID -> number of terms
+        self.postings: Dict[str, Dict[int, int]] = {}  # Term -> chunk ID -> term frequency
+        self.files: Dict[str, List[int]] = {}  # Content hash -> chunk IDs
+        self.versions: Dict[str, str] = {}  # Filename -> content hash of the indexed version
+        self.total_length = 0
+        self.lock = threading.Lock()
+        self._next_id = 0
+
+    def __contains__(self, digest: str) -> bool:
+        return digest in self.files
+
+    def add_file(self, filename: str, content: str, digest: str) -> int:
+        """
+        Index a file, replacing the previous version of the same filename
+        @param filename: Name of the file
+        @param content: File content
+        @param digest: Content hash of the file
+        @returns: Number of chunks added, 0 if the file was already indexed
+        """
+        if digest in self.files:
+            return 0
+        chunks = split_chunks(filename, content, digest)
+        terms = [Counter(tokenize(chunk.text)) for chunk in chunks]
+        with self.lock:
+            if digest in self.files:
+                return 0
+            previous = self.versions.get(filename)
+            if previous is not None and previous != digest:
+                self._remove_file(previous)
+            self.versions[filename] = digest
+            ids = self.files[digest] = []
+            for chunk, counts in zip(chunks, terms):
+                chunk_id = self._next_id
+                self._next_id += 1
+                ids.append(chunk_id)
+                self.chunks[chunk_id] = chunk
+                length = sum(counts.values())
+                self.lengths[chunk_id] = length
+                self.total_length += length
+                for term, frequency in counts.items():
+                    self.postings.setdefault(term, {})[chunk_id] = frequency
+        return len(chunks)
+
+    def _remove_file(self, digest: str) -> None:
+        """
+        Remove a file's chunks from the index (caller holds the lock)
+        @param digest: Content hash of the file
+        """
+        for chunk_id in self.files.pop(digest, []):
+            chunk = self.chunks.pop(chunk_id)
+            self.total_length -= self.lengths.pop(chunk_id)
+            for term in set(tokenize(chunk.text)):
+                posting = self.postings.get(term)
+                if posting is not None:
+                    posting.pop(chunk_id, None)
+                    if not posting:
+                        del self.postings[term]
+
+    def search(self, query: str, digests: Iterable[str]) -> List[Chunk]:
+        """
+        Rank the chunks of some files against a query
+        @param query: The user's question
+        @param digests: Content hashes of the files to search
+        @returns: Matching chunks, best first
+        """
+        with self.lock:
+            allowed: Set[int] = {chunk_id for digest in digests for chunk_id in self.files.get(digest, ())}
+            if not allowed:
+                return []
+            count = len(self.chunks)
+            average = self.total_length / count if count else 0.0
+            scores: Dict[int, float] = {}
+            for term in set(tokenize(query)):
+                posting = self.postings.get(term)
+                if not posting:
+                    continue
+                idf = math.log(1 + (count - len(posting) + 0.5) / (len(posting) + 0.5))
+                for chunk_id, frequency in posting.items():
+                    if chunk_id not in allowed:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * self.lengths[chunk_id] / (average or 1))
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+            ranked = sorted(scores, key=scores.get, reverse=True)
+            return [self.chunks[chunk_id] for chunk_id in ranked]
+
+    def select(self, query: str, digests: Iterable[str], top_k: Optional[int] = None,
+               budget: Optional[int] = None) -> List[Chunk]:
+        """
+        Pick the best chunks that fit a token budget.
+        If no chunk matches the query, the files are taken from the top.
+        @param query: The user's question
+        @param digests: Content hashes of the files to search
+        @param top_k: Maximum number of chunks, defaults to Config.RETRIEVAL_TOP_K
+        @param budget: Maximum prompt tokens of all chunks, defaults to Config.RETRIEVAL_TOKEN_BUDGET
+        @returns: Selected chunks in file and line order
+        """
+        top_k = top_k or Config.RETRIEVAL_TOP_K
+        budget = budget or Config.RETRIEVAL_TOKEN_BUDGET
+        selected: List[Chunk] = []
+        used = 0
+        digests = list(digests)
+        candidates = self.search(query, digests)
+        if not candidates:
+            with self.lock:
+                candidates = [self.chunks[chunk_id] for digest in digests for chunk_id in self.files.get(digest, ())]
+        for chunk in candidates:
+            if len(selected) >= top_k:
+                break
+            if used + chunk.tokens > budget:
+                continue
+            selected.append(chunk)
+            used += chunk.tokens
+        selected.sort(key=lambda chunk: (chunk.filename, chunk.start))
+        return selected
@@ -0,0 +1,230 @@
+"""
+Structural outlines of Python files.
+An oversized Python attachment is reduced to its imports, class and function
+signatures and docstrings, with function bodies elided. Bodies of the
+functions the user refers to, by line number or by name, are kept as long as
+they fit the token budget. Parsed outlines are cached by content hash.
+"""
+
+import ast
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Set, Tuple
+
+from modules.config.config import Config
+from modules.conversation.store import estimate_tokens
+
+_LINE_REFERENCE = re.compile(r"\b(?:lines?|l\.?)\s*(\d+)(?:\s*(?:-|–|to)\s*(\d+))?", re.IGNORECASE)
+_MAX_REFERENCED_RANGE = 200  # Longest line range taken from a single reference
+
+
+@dataclass
+class Elision:
+    """A range of lines the outline replaces by an ellipsis"""
+    start: int  # First elided line, 1-based
+    end: int  # Last elided line, inclusive
+    indent: int  # Columns of the ellipsis
+    name: str = ""  # Function whose body is elided, empty for other statements
+    first: int = 0  # First line of the whole function including decorators
+    last: int = 0  # Last line of the whole function
+
+
+def referenced_lines(message: str, filename: str) -> List[int]:
+    """
+    Find the line numbers a message refers to, like "line 12", "lines 40-55" or "main.py:80"
+    @param message: The user's question
+    @param filename: Name of the file, references to other files are ignored
+    @returns: Referenced line numbers in order of mention
+    """
+    lines: List[int] = []
+    basename = filename.replace("\\", "/").rsplit("/", 1)[-1]
+    patterns = [_LINE_REFERENCE]
+    if basename:
+        patterns.append(re.compile(re.escape(basename) + r":(\d+)(?:-(\d+))?"))
+    for pattern in patterns:
+        for match in pattern.finditer(message):
+            start = int(match.group(1))
+            end = int(match.group(2) or start)
+            if start <= end <= start + _MAX_REFERENCED_RANGE:
+                lines.extend(range(start, end + 1))
+            else:
+                lines.append(start)
+    return lines
+
+
+class Outline:
+    """The elidable structure of a parsed Python file"""
+    def __init__(self, source: str):
+        """
+        Parse a file
+        @param source: Python source code
+        @raises SyntaxError: If the source cannot be parsed
+        """
+        self.lines = source.splitlines()
+        self.tokens = estimate_tokens(source)
+        self.elisions: List[Elision] = []
+        self._collect(ast.parse(source).body)
+        # An ellipsis longer than the lines it replaces would only grow the outline
+        self.elisions = sorted(
+            (elision for elision in self.elisions
+             if len(_marker(elision)) < len("\n".join(self.lines[elision.start - 1:elision.end]))),
+            key=lambda elision: elision.start
+        )
+
+    def _collect(self, body: List[ast.stmt]) -> None:
+        """
+        Record the elisions of a module or class body
+        @param body: Statements of the body
+        """
+        for node in body:
+            if isinstance(node, ast.ClassDef):
+                self._collect(node.body)
+            elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                statements = node.body
+                if _is_docstring(statements[0]):
+                    statements = statements[1:]
+                # Bodies of a single line are kept, the ellipsis would not be shorter
+                if not statements or statements[0].lineno == node.lineno or statements[0].lineno == node.end_lineno:
+                    continue
+                first = node.decorator_list[0].lineno if node.decorator_list else node.lineno
+                self.elisions.append(Elision(
+                    statements[0].lineno, node.end_lineno, statements[0].col_offset,
+                    node.name, first, node.end_lineno
+                ))
+            elif not isinstance(node, (ast.Import, ast.ImportFrom)) and not _is_docstring(node):
+                # Keep the first line of long statements such as large literals
+                if node.end_lineno - node.lineno + 1 > Config.OUTLINE_STATEMENT_LINES:
+                    self.elisions.append(Elision(node.lineno + 1, node.end_lineno, node.col_offset + 4))
+
+    def render(self, message: str = "", filename: str = "", budget: Optional[int] = None) -> Optional[str]:
+        """
+        Build the outline text, keeping the bodies the message refers to as
+        long as the outline stays within the budget
+        @param message: The user's question
+        @param filename: Name of the file, for references like "main.py:80"
+        @param budget: Prompt tokens the outline may use, defaults to Config.OUTLINE_FILE_TOKEN_BUDGET
+        @returns: The outline, None if it is not smaller than the file
+        """
+        budget = budget or Config.OUTLINE_FILE_TOKEN_BUDGET
+        functions = [elision for elision in self.elisions if elision.name]
+        kept: Set[int] = set()
+        text = self._text(kept)
+        used = estimate_tokens(text)
+        if not self.elisions or used >= self.tokens:
+            return None
+        for index in self._referenced(functions, message, filename):
+            body = estimate_tokens("\n".join(self.lines[functions[index].start - 1:functions[index].end]))
+            if used + body <= budget:
+                kept.add(functions[index].start)
+                used += body
+        return self._text(kept) if kept else text
+
+    def _referenced(self, functions: List[Elision], message: str, filename: str) -> Iterable[int]:
+        """
+        Order the functions by how directly the message refers to them.
+        A referenced line selects the function containing it, or the nearest one.
+        @param functions: Elided function bodies
+        @param message: The user's question
+        @param filename: Name of the file
+        @returns: Indexes into functions, without duplicates
+        """
+        seen: Set[int] = set()
+        if not functions:
+            return
+        for line in referenced_lines(message, filename):
+            index = min(
+                range(len(functions)),
+                key=lambda i: 0 if functions[i].first <= line <= functions[i].last
+                else min(abs(line - functions[i].first), abs(line - functions[i].last))
+            )
+            if index not in seen:
+                seen.add(index)
+                yield index
+        words = set(re.findall(r"[A-Za-z_][A-Za-z0-9_]*", message))
+        for index, function in enumerate(functions):
+            if function.name in words and index not in seen:
+                seen.add(index)
+                yield index
+
+    def _text(self, kept: Set[int]) -> str:
+        """
+        Join the lines that are not elided
+        @param kept: First lines of the function bodies that are kept
+        @returns: The outline text
+        """
+        out: List[str] = []
+        line = 1
+        for elision in self.elisions:
+            if elision.start < line or elision.start in kept:
+                continue
+            out.extend(self.lines[line - 1:elision.start - 1])
+            out.append(_marker(elision))
+            line = elision.end + 1
+        out.extend(self.lines[line - 1:])
+        return "\n".join(out)
+
+
+def _marker(elision: Elision) -> str:
+    return f"{' ' * elision.indent}...  # lines {elision.start}-{elision.end} elided"
+
+
+def _is_docstring(node: ast.stmt) -> bool:
+    return isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant) and isinstance(node.value.value, str)
+
+
+class OutlineCache:
+    """
+    Parsed outlines by content hash, least recently used evicted first.
+    Files that do not parse are cached as None so they are not parsed again.
+    Filled from worker threads, access is locked.
+    """
+    def __init__(self, size: Optional[int] = None):
+        """
+        Initialize an empty cache
+        @param size: Maximum number of outlines, defaults to Config.OUTLINE_CACHE_SIZE
+        """
+        self.size = size or Config.OUTLINE_CACHE_SIZE
+        self.outlines: "OrderedDict[str, Optional[Outline]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, digest: str) -> bool:
+        return digest in self.outlines
+
+    def get(self, digest: str, source: str) -> Optional[Outline]:
+        """
+        Look up the outline of a file, parsing it on a miss
+        @param digest: Content hash of the file
+        @param source: Python source code
+        @returns: The outline, None if the file does not parse
+        """
+        with self.lock:
+            if digest in self.outlines:
+                self.hits += 1
+                self.outlines.move_to_end(digest)
+                return self.outlines[digest]
+            self.misses += 1
+        try:
+            outline = Outline(source)
+        except (SyntaxError, ValueError, RecursionError):
+            outline = None
+        with self.lock:
+            self.outlines[digest] = outline
+            while len(self.outlines) > self.size:
+                self.outlines.popitem(last=False)
+        return outline
+
+    def peek(self, digest: str) -> Tuple[bool, Optional[Outline]]:
+        """
+        Look up the outline of a file without parsing it
+        @param digest: Content hash of the file
+        @returns: Tuple of whether the file is cached and its outline
+        """
+        with self.lock:
+            if digest not in self.outlines:
+                return False, None
+            self.outlines.move_to_end(digest)
+            return True, self.outlines[digest]
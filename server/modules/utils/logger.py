@@ -1,4 +1,10 @@
+import atexit
 import logging
+import os
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, List, Tuple
+
 import colorlog
 from modules.config.config import Config  # Konfigurationsklasse importieren
 
@@ -12,6 +18,136 @@ def success(self, message, *args, **kwargs):
 
 logging.Logger.success = success
 
+
+class RateLimitFilter(logging.Filter):
+    """
+    Limits how many records a single call site may log per second.
+    Suppressed records are counted and reported with the next record that passes.
+    """
+    def __init__(self, limit: int):
+        """
+        @param limit: Records per second and call site, 0 disables the limit
+        """
+        super().__init__()
+        self.limit = limit
+        self.windows: Dict[Tuple[str, int], List] = {}  # Call site -> [window start, count, suppressed]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not self.limit:
+            return True
+        site = (record.pathname, record.lineno)
+        window = self.windows.get(site)
+        if window is None or record.created - window[0] >= 1.0:
+            suppressed = window[2] if window is not None else 0
+            self.windows[site] = [record.created, 1, 0]
+            if suppressed:
+                record.suppressed = suppressed
+            return True
+        window[1] += 1
+        if window[1] > self.limit:
+            window[2] += 1
+            return False
+        return True
+
+
+class TruncateFilter(logging.Filter):
+    """
+    Formats the message of a record and cuts it to a maximum length.
+    Runs on the listener thread, so large payloads are never formatted on the event loop.
+    """
+    def __init__(self, max_chars: int):
+        """
+        @param max_chars: Maximum characters of a message, 0 disables truncation
+        """
+        super().__init__()
+        self.max_chars = max_chars
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.args:
+            # Große Argumente vor dem Formatieren kürzen
+            record.args = tuple(self._cut(arg) for arg in record.args) if isinstance(record.args, tuple) else record.args
+        message = self._cut(record.getMessage())
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            message += f" ({suppressed} similar messages suppressed)"
+        record.msg = message
+        record.args = None
+        return True
+
+    def _cut(self, value):
+        if not self.max_chars:
+            return value
+        if not isinstance(value, str):
+            if isinstance(value, (int, float, bool)) or value is None:
+                return value
+            value = str(value)
+        if len(value) <= self.max_chars:
+            return value
+        return f"{value[:self.max_chars]}... [{len(value)} chars]"
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    Puts records on the queue unformatted.
+    The standard QueueHandler formats the message in the calling thread, which is
+    exactly the work that should move off the event loop.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class _Pipeline:
+    """A queue with a listener thread that feeds records to the real handlers"""
+    def __init__(self, handlers: List[logging.Handler]):
+        self.handlers = handlers
+        self.queue_handler = LazyQueueHandler(queue.SimpleQueue())
+        self.listener = None
+        self.start()
+
+    def start(self) -> None:
+        self.listener = QueueListener(self.queue_handler.queue, *self.handlers, respect_handler_level=True)
+        self.listener.start()
+
+    def restart(self) -> None:
+        # Nach fork() läuft der Listener-Thread im Kindprozess nicht mehr
+        self.queue_handler.queue = queue.SimpleQueue()
+        self.start()
+
+    def stop(self) -> None:
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+
+_pipelines: List[_Pipeline] = []
+
+
+def queued(*handlers: logging.Handler) -> QueueHandler:
+    """
+    Wrap handlers so they run on a background thread
+    @param handlers: Handlers doing the actual formatting and I/O
+    @returns: Handler to attach to a logger, it only enqueues records
+    """
+    pipeline = _Pipeline(list(handlers))
+    _pipelines.append(pipeline)
+    return pipeline.queue_handler
+
+
+def _stop_pipelines() -> None:
+    # Restliche Einträge beim Beenden noch schreiben
+    for pipeline in _pipelines:
+        pipeline.stop()
+
+
+def _restart_pipelines() -> None:
+    for pipeline in _pipelines:
+        pipeline.restart()
+
+
+atexit.register(_stop_pipelines)
+os.register_at_fork(after_in_child=_restart_pipelines)
+
+
 # Logger einrichten und Log-Level aus Config laden
 def setup_logger():
     # Log-Level aus Config-Klasse laden
@@ -32,12 +168,18 @@ def setup_logger():
         },
         datefmt='%H:%M:%S'  # Uhrzeit ohne Datum
     ))
+    # Nachrichten werden erst im Listener-Thread formatiert und gekürzt
+    handler.addFilter(TruncateFilter(Config.LOG_MAX_MESSAGE_CHARS))
+
+    # Der Event-Loop legt Einträge nur in die Queue, Ausgabe im Hintergrund
+    queue_handler = queued(handler)
+    queue_handler.addFilter(RateLimitFilter(Config.LOG_RATE_LIMIT))
 
     # Logger konfigurieren
     logger = logging.getLogger(__name__)
-    logger.addHandler(handler)
+    logger.addHandler(queue_handler)
     logger.setLevel(log_level)
     return logger
 
 # Logger für Testzwecke
-logger = setup_logger()
\ No newline at end of file
+logger = setup_logger()
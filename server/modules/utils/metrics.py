@@ -0,0 +1,232 @@
+"""
+In-process metrics in the Prometheus text format.
+Counters and histograms are plain attribute updates on objects created once
+at import time. Everything is updated from the event loop thread, so no
+locks are needed, and histogram buckets are fixed up front so an observation
+is a binary search and two additions. Gauges are read from callbacks only
+when the metrics are scraped. Every worker process reports its own metrics,
+labelled with the worker and served on a port of its own.
+"""
+
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from modules.config.config import Config
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _format_labels(labels: Labels, extra: str = "") -> str:
+    """
+    Format labels for the exposition format
+    @param labels: Label names and values
+    @param extra: Additional preformatted label, e.g. the bucket bound
+    @returns: Label set in braces, empty if there are no labels
+    """
+    parts = [f'{name}="{value}"' for name, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    """A monotonically increasing count"""
+    __slots__ = ("labels", "value")
+
+    def __init__(self, labels: Labels):
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def samples(self, name: str, common: Labels = ()) -> List[str]:
+        return [f"{name}{_format_labels(common + self.labels)} {_format_value(self.value)}"]
+
+
+class Histogram:
+    """Observations counted into fixed buckets"""
+    __slots__ = ("labels", "bounds", "counts", "sum", "count")
+
+    def __init__(self, labels: Labels, bounds: Sequence[float]):
+        self.labels = labels
+        self.bounds = tuple(sorted(bounds))
+        self.counts = [0] * (len(self.bounds) + 1)  # Last bucket is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self) -> "_Timer":
+        """
+        Time a block of code
+        @returns: Context manager observing the elapsed seconds
+        """
+        return _Timer(self)
+
+    def samples(self, name: str, common: Labels = ()) -> List[str]:
+        lines = []
+        labels = common + self.labels
+        cumulative = 0
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else _format_value(bound)
+            bucket = f'le="{le}"'
+            lines.append(f"{name}_bucket{_format_labels(labels, bucket)} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(self.sum)}")
+        lines.append(f"{name}_count{_format_labels(labels)} {self.count}")
+        return lines
+
+
+class _Timer:
+    """Context manager observing the duration of a block"""
+    __slots__ = ("histogram", "started")
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+        self.started = 0.0
+
+    def __enter__(self) -> "_Timer":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.histogram.observe(time.perf_counter() - self.started)
+
+
+class Gauge:
+    """A value read from a callback at scrape time"""
+    __slots__ = ("labels", "read")
+
+    def __init__(self, labels: Labels, read: Callable[[], float]):
+        self.labels = labels
+        self.read = read
+
+    def samples(self, name: str, common: Labels = ()) -> List[str]:
+        return [f"{name}{_format_labels(common + self.labels)} {_format_value(self.read())}"]
+
+
+class _Family:
+    """Metrics of one name with different label values"""
+    def __init__(self, name: str, kind: str, help: str):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.children: Dict[Labels, object] = {}
+
+
+class MetricsRegistry:
+    """
+    All metrics of the process.
+    Asking for a metric that already exists returns it, so modules can
+    declare the metrics they update at import time.
+    """
+    def __init__(self):
+        self.families: Dict[str, _Family] = {}
+        self.common: Labels = ()  # Labels of every sample, e.g. the worker process
+
+    def label_all(self, **labels: str) -> None:
+        """
+        Add labels to every sample, e.g. to tell the metrics of worker processes apart
+        @param labels: Label names and values
+        """
+        self.common = tuple(sorted(labels.items()))
+
+    def _child(self, name: str, kind: str, help: str, labels: Dict[str, str], create: Callable[[Labels], object]):
+        family = self.families.get(name)
+        if family is None:
+            family = self.families[name] = _Family(name, kind, help)
+        elif family.kind != kind:
+            raise ValueError(f"Metric {name} is already registered as a {family.kind}")
+        key = tuple(sorted(labels.items()))
+        child = family.children.get(key)
+        if child is None:
+            child = family.children[key] = create(key)
+        return child
+
+    def counter(self, name: str, help: str, **labels: str) -> Counter:
+        """
+        Get or create a counter
+        @param name: Metric name
+        @param help: Description shown in the exposition
+        @param labels: Label values of this counter
+        @returns: The counter
+        """
+        return self._child(name, "counter", help, labels, Counter)
+
+    def histogram(self, name: str, help: str, buckets: Optional[Sequence[float]] = None, **labels: str) -> Histogram:
+        """
+        Get or create a histogram
+        @param name: Metric name
+        @param help: Description shown in the exposition
+        @param buckets: Upper bounds of the buckets, defaults to Config.METRICS_BUCKETS
+        @param labels: Label values of this histogram
+        @returns: The histogram
+        """
+        bounds = buckets or Config.METRICS_BUCKETS
+        return self._child(name, "histogram", help, labels, lambda key: Histogram(key, bounds))
+
+    def gauge(self, name: str, help: str, read: Callable[[], float], **labels: str) -> Gauge:
+        """
+        Register a gauge, replacing the callback of an existing one
+        @param name: Metric name
+        @param help: Description shown in the exposition
+        @param read: Callback returning the current value
+        @param labels: Label values of this gauge
+        @returns: The gauge
+        """
+        gauge = self._child(name, "gauge", help, labels, lambda key: Gauge(key, read))
+        gauge.read = read
+        return gauge
+
+    def counter_from(self, name: str, help: str, read: Callable[[], float], **labels: str) -> Gauge:
+        """
+        Register a counter whose total is kept elsewhere and read at scrape time,
+        replacing the callback of an existing one
+        @param name: Metric name
+        @param help: Description shown in the exposition
+        @param read: Callback returning the current total
+        @param labels: Label values of this counter
+        @returns: The counter
+        """
+        counter = self._child(name, "counter", help, labels, lambda key: Gauge(key, read))
+        counter.read = read
+        return counter
+
+    def render(self) -> str:
+        """
+        Format all metrics in the Prometheus text exposition format
+        @returns: The exposition
+        """
+        lines = []
+        for family in self.families.values():
+            lines.append(f"# HELP {family.name} {family.help}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            for child in family.children.values():
+                lines.extend(child.samples(family.name, self.common))
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+# Latency of every stage a prompt passes through: routing a received frame,
+# decoding it, assembling the prompt, waiting for an LLM slot, the Ollama
+# request and writing a frame to the client
+STAGES = ("receive", "parse", "prompt", "queue", "llm", "send")
+
+
+def stage(name: str) -> Histogram:
+    """
+    Histogram of the seconds spent in a request stage
+    @param name: One of STAGES
+    @returns: The stage's histogram
+    """
+    return metrics.histogram("rubberduck_stage_seconds", "Seconds spent in each request stage", stage=name)
@@ -0,0 +1,145 @@
+"""
+Per-request tracing.
+Every prompt gets a request ID and a trace that collects timing spans at each
+stage boundary, from receiving the frame to sending the response, together
+with the durations Ollama reports for prompt evaluation and decoding. A
+finished trace is written as one JSON line to a rotating file, and requests
+slower than a threshold are logged with their full breakdown.
+"""
+
+import json
+import logging
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from modules.config.config import Config
+from modules.utils.logger import logger, queued
+
+
+class Trace:
+    """Timing spans and fields of a single request"""
+    __slots__ = ("request_id", "session_id", "started", "wall", "spans", "fields", "last")
+
+    def __init__(self, session_id: str, started: Optional[float] = None):
+        """
+        Start a trace
+        @param session_id: Session the request belongs to
+        @param started: perf_counter() value at which the request arrived, defaults to now
+        """
+        self.request_id = uuid.uuid4().hex[:16]
+        self.session_id = session_id
+        self.started = started if started is not None else time.perf_counter()
+        self.wall = time.time() - (time.perf_counter() - self.started)
+        self.spans: List[Tuple[str, float, float]] = []  # (name, offset from start, duration) in seconds
+        self.fields: Dict[str, Any] = {}
+        self.last = self.started  # perf_counter() value at which the latest span ended
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """
+        Record the duration of a block as a span
+        @param name: Stage name
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start)
+
+    def add(self, name: str, start: float, end: Optional[float] = None) -> None:
+        """
+        Record a span measured by the caller
+        @param name: Stage name
+        @param start: perf_counter() value at the start of the stage, e.g. `last` for the gap since the previous span
+        @param end: perf_counter() value at the end of the stage, defaults to now
+        """
+        end = end if end is not None else time.perf_counter()
+        self.spans.append((name, start - self.started, end - start))
+        self.last = max(self.last, end)
+
+    def set(self, **fields: Any) -> None:
+        """
+        Attach fields to the trace
+        @param fields: Names and JSON-serializable values
+        """
+        self.fields.update(fields)
+
+    @property
+    def elapsed(self) -> float:
+        """Seconds since the request arrived"""
+        return time.perf_counter() - self.started
+
+    def to_dict(self, status: str) -> dict:
+        """
+        Build the trace record
+        @param status: Outcome of the request
+        @returns: JSON-serializable record
+        """
+        return {
+            "request_id": self.request_id,
+            "session_id": self.session_id,
+            "time": datetime.fromtimestamp(self.wall, timezone.utc).isoformat(timespec="milliseconds"),
+            "status": status,
+            "duration": round(self.elapsed, 6),
+            "spans": [
+                {"name": name, "offset": round(offset, 6), "duration": round(duration, 6)}
+                for name, offset, duration in self.spans
+            ],
+            **self.fields
+        }
+
+    def breakdown(self) -> str:
+        """
+        Format the spans for a log line
+        @returns: Stages with their durations in milliseconds
+        """
+        return ", ".join(f"{name} {duration * 1000:.1f}ms" for name, _, duration in self.spans)
+
+
+_writer: Optional[logging.Logger] = None
+
+
+def _trace_logger() -> Optional[logging.Logger]:
+    """
+    Create the logger writing trace records on first use.
+    Records are written by a background thread, not on the event loop.
+    @returns: The logger, None if no trace file is configured
+    """
+    global _writer
+    if _writer is None and Config.TRACE_FILE:
+        path = Config.TRACE_FILE
+        if Config.SERVER_WORKERS > 1:
+            # A rotating file cannot be shared between processes
+            root, ext = os.path.splitext(path)
+            path = f"{root}.{os.getpid()}{ext}"
+        handler = RotatingFileHandler(
+            path, maxBytes=Config.TRACE_MAX_BYTES, backupCount=Config.TRACE_BACKUP_COUNT, encoding="utf-8"
+        )
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        _writer = logging.getLogger(f"{__name__}.records")
+        _writer.propagate = False
+        _writer.setLevel(logging.INFO)
+        _writer.addHandler(queued(handler))
+    return _writer
+
+
+def finish(trace: Trace, status: str = "ok") -> None:
+    """
+    Emit a finished trace
+    @param trace: Trace of the request
+    @param status: Outcome of the request, e.g. "ok", "error", "busy" or "cancelled"
+    """
+    writer = _trace_logger()
+    if writer is not None:
+        writer.info(json.dumps(trace.to_dict(status)))
+    threshold = Config.TRACE_SLOW_THRESHOLD
+    if threshold is not None and trace.elapsed >= threshold:
+        logger.warning(
+            f"Slow request {trace.request_id} for session {trace.session_id} took {trace.elapsed:.2f}s: "
+            f"{trace.breakdown()} {json.dumps(trace.fields)}"
+        )
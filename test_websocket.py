@@ -10,6 +10,10 @@ async def test_websocket():
     try:
         async with websockets.connect(uri) as websocket:
             print("Connected! Type your message (or 'quit' to exit)")
+
+            # The server first announces the session and its resume token
+            session = json.loads(await websocket.recv())
+            print(f"Session: {session.get('session_id')}")
             print("Sending test message...")
             
             # Example test message
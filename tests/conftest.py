@@ -0,0 +1,10 @@
+"""
+Shared setup of the server tests.
+The server modules are imported the same way server/main.py does, with the
+server directory on the path.
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "server"))
@@ -0,0 +1,61 @@
+from modules.retrieval.bm25 import BM25Index, split_chunks, tokenize
+
+SOURCE = '''import os
+
+
+def load_config(path):
+    with open(path) as handle:
+        return parse_config(handle.read())
+
+
+def parse_config(text):
+    return dict(line.split("=", 1) for line in text.splitlines() if line)
+
+
+def send_email(recipient, subject, body):
+    smtp = connect_smtp()
+    smtp.send(recipient, subject, body)
+
+
+def connect_smtp():
+    return SMTPClient(os.environ["SMTP_HOST"])
+'''
+
+
+def test_tokenize_splits_identifiers():
+    assert tokenize("parseConfig(load_file)") == ["parseconfig", "parse", "config", "load_file", "load", "file"]
+
+
+def test_chunks_follow_definitions():
+    chunks = split_chunks("mail.py", SOURCE, "d1")
+    assert [chunk.text.split("(")[0] for chunk in chunks[1:]] == [
+        "def load_config", "def parse_config", "def send_email", "def connect_smtp",
+    ]
+    assert chunks[1].start == 4
+
+
+def test_relevant_chunk_ranks_first():
+    index = BM25Index()
+    assert index.add_file("mail.py", SOURCE, "d1") == 5
+    assert index.search("Why does sending an email to the recipient fail?", ["d1"])[0].text.startswith("def send_email")
+    assert index.search("Which function splits the config text?", ["d1"])[0].text.startswith("def parse_config")
+    assert index.search("recipient", ["other"]) == []
+
+
+def test_select_keeps_file_order_within_budget():
+    index = BM25Index()
+    index.add_file("mail.py", SOURCE, "d1")
+    selected = index.select("smtp recipient", ["d1"], top_k=2, budget=1000)
+    assert [chunk.start for chunk in selected] == sorted(chunk.start for chunk in selected)
+    assert {chunk.text.split("(")[0] for chunk in selected} == {"def send_email", "def connect_smtp"}
+    assert index.select("unrelated words", ["d1"], top_k=1, budget=1000)[0].start == 1
+
+
+def test_changed_file_replaces_its_previous_version():
+    index = BM25Index()
+    index.add_file("mail.py", SOURCE, "d1")
+    assert index.add_file("mail.py", SOURCE, "d1") == 0
+    index.add_file("mail.py", "def greet():\n    return 'hello'\n", "d2")
+    assert "d1" not in index
+    assert "recipient" not in index.postings
+    assert index.total_length == sum(index.lengths.values())
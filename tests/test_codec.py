@@ -0,0 +1,59 @@
+import pytest
+
+from modules.api import codec
+from modules.api.codec import JSON, Codec, MessagePackCodec, select_codec
+
+MESSAGE = {"type": "prompt", "message": "Why does this fail? é中", "files": [{"name": "a.py"}], "stream": True}
+
+
+@pytest.fixture(params=["orjson", "json"])
+def json_codec(request, monkeypatch):
+    """The JSON codec with and without orjson"""
+    if request.param == "json":
+        monkeypatch.setattr(codec, "orjson", None)
+    elif codec.orjson is None:
+        pytest.skip("orjson is not installed")
+    return JSON
+
+
+def test_json_round_trip(json_codec):
+    frame = json_codec.encode(MESSAGE)
+    assert isinstance(frame, str)
+    assert json_codec.decode(frame) == MESSAGE
+    assert json_codec.decode(frame.encode("utf-8")) == MESSAGE
+
+
+@pytest.mark.parametrize("frame", ["[1, 2]", '"prompt"', "null", "{", ""])
+def test_json_rejects_non_objects(json_codec, frame):
+    with pytest.raises(ValueError):
+        json_codec.decode(frame)
+
+
+def test_msgpack_round_trip():
+    pytest.importorskip("msgpack")
+    msgpack_codec = MessagePackCodec()
+    frame = msgpack_codec.encode({**MESSAGE, "data": b"\x00\xff"})
+    assert isinstance(frame, bytes)
+    assert msgpack_codec.decode(frame) == {**MESSAGE, "data": b"\x00\xff"}
+
+
+def test_msgpack_rejects_text_frames_and_non_maps():
+    msgpack = pytest.importorskip("msgpack")
+    msgpack_codec = MessagePackCodec()
+    for frame in ("{}", msgpack.packb([1, 2]), b"\xc1", b""):
+        with pytest.raises(ValueError):
+            msgpack_codec.decode(frame)
+
+
+def test_select_codec_falls_back_to_json(monkeypatch):
+    pytest.importorskip("msgpack")
+    assert select_codec("msgpack").name == "msgpack"
+    assert select_codec(None) is JSON
+    assert select_codec("xml") is JSON
+    monkeypatch.setattr(codec.Config, "WS_FORMATS", ("json",))
+    assert select_codec("msgpack") is JSON
+
+
+def test_codec_is_abstract():
+    with pytest.raises(TypeError):
+        Codec()
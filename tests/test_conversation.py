@@ -0,0 +1,59 @@
+from modules.conversation.store import Conversation, ConversationStore, estimate_tokens
+
+
+def _content(tokens: int) -> str:
+    # estimate_tokens adds one, so the content is one token shorter than asked
+    return "x" * ((tokens - 1) * 4)
+
+
+def test_trim_drops_oldest_messages_to_fit_budget():
+    conversation = Conversation(budget=100)
+    for index in range(5):
+        conversation.append("user", f"{index}" + _content(30)[1:])
+    assert conversation.tokens <= 100
+    assert [message.content[0] for message in conversation.to_list()] == ["2", "3", "4"]
+    assert conversation.tokens == sum(message.tokens for message in conversation.to_list())
+
+
+def test_trim_keeps_newest_message_over_budget():
+    conversation = Conversation(budget=10)
+    conversation.append("user", _content(5))
+    conversation.append("user", _content(50))
+    assert len(conversation) == 1
+    assert conversation.tokens == estimate_tokens(_content(50))
+
+
+def test_trim_keeps_pinned_and_referenced_messages():
+    conversation = Conversation(budget=100, system_prompt="system", pin_first=True)
+    conversation.append("user", "first question")
+    conversation.append("user", _content(40), attachments=["file"])
+    conversation.append("user", _content(40))
+    conversation.append("user", _content(40), references=["file"])
+    contents = [message.content for message in conversation.to_list()]
+    assert contents[:2] == ["system", "first question"]
+    assert conversation.find_attachment("file") is not None
+
+
+def test_evict_enforces_memory_cap_in_lru_order():
+    store = ConversationStore(ttl=3600, max_bytes=1000)
+    for session_id in ("a", "b", "c"):
+        store.get_or_create(session_id).append("user", "x" * 400)
+    store.get("a")
+    assert store.evict() == 1
+    assert list(store) == ["c", "a"]
+    assert store.evicted_sessions == 1
+    assert store.bytes_reclaimed > 400
+    assert store.total_bytes <= 1000
+
+
+def test_evict_drops_idle_conversations_but_not_held_ones():
+    store = ConversationStore(ttl=60)
+    for session_id in ("a", "b", "c"):
+        store.get_or_create(session_id).append("user", "hello")
+    store.conversations["a"].last_used -= 120
+    store.conversations["b"].last_used -= 120
+    with store.hold("a"):
+        assert store.evict() == 1
+    assert list(store) == ["a", "c"]
+    assert store.session_bytes("a") > 0
+    assert store.session_bytes("b") == 0
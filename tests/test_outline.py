@@ -0,0 +1,66 @@
+import pytest
+
+from modules.retrieval.outline import Outline, OutlineCache, referenced_lines
+
+
+def _function(name: str, lines: int = 12) -> str:
+    body = "".join(f"    total_{name}_{index} = compute_{name}({index}) + offset * {index}\n" for index in range(lines))
+    return f'def {name}(offset):\n    """Docstring of {name}"""\n{body}    return offset\n\n\n'
+
+
+SOURCE = "import os\n\n\n" + _function("alpha") + _function("beta") + _function("gamma")
+
+
+def test_outline_elides_bodies_and_keeps_signatures():
+    text = Outline(SOURCE).render()
+    assert len(text) < len(SOURCE)
+    for name in ("alpha", "beta", "gamma"):
+        assert f"def {name}(offset):" in text
+        assert f'"""Docstring of {name}"""' in text
+        assert f"compute_{name}" not in text
+    assert "import os" in text
+
+
+def test_keeps_the_body_referenced_by_name():
+    text = Outline(SOURCE).render("Why does beta return the wrong total?")
+    assert "compute_beta" in text
+    assert "compute_alpha" not in text and "compute_gamma" not in text
+
+
+def test_keeps_the_body_referenced_by_line():
+    line = SOURCE.splitlines().index("def gamma(offset):") + 5
+    text = Outline(SOURCE).render(f"What happens in main.py:{line}?", "src/main.py")
+    assert "compute_gamma" in text
+    assert "compute_beta" not in text
+    assert Outline(SOURCE).render(f"What happens in other.py:{line}?", "src/main.py").count("compute_") == 0
+
+
+def test_referenced_bodies_stay_within_the_budget():
+    outline = Outline(SOURCE)
+    small = len(outline.render()) // 4 + 10
+    assert "compute_beta" not in outline.render("alpha and beta", budget=small)
+
+
+@pytest.mark.parametrize("message", ["", "alpha beta gamma", "lines 1-60", "line 1"])
+def test_outline_never_grows_the_file(message):
+    text = Outline(SOURCE).render(message, budget=10 ** 6)
+    assert text is None or len(text) <= len(SOURCE)
+
+
+def test_nothing_to_elide():
+    assert Outline("import os\n\n\ndef short():\n    return 1\n").render() is None
+    assert Outline("def f():\n    a = 1\n    b = 2\n").render() is None
+
+
+def test_referenced_lines():
+    assert referenced_lines("see line 3 and lines 7-9, also a.py:12", "src/a.py") == [3, 7, 8, 9, 12]
+    assert referenced_lines("b.py:12", "a.py") == []
+
+
+def test_cache_remembers_files_that_do_not_parse():
+    cache = OutlineCache(size=1)
+    assert cache.get("bad", "def (:") is None
+    assert cache.peek("bad") == (True, None)
+    cache.get("good", SOURCE)
+    assert "bad" not in cache
+    assert cache.misses == 2
@@ -0,0 +1,48 @@
+import pytest
+
+from modules.api.patches import FileVersions, PatchError, apply_patch, make_diff
+
+BASE = "".join(f"line {number}\n" for number in range(1, 21))
+
+
+@pytest.mark.parametrize("old, new", [
+    (BASE, BASE.replace("line 3\n", "line three\n").replace("line 18\n", "")),
+    (BASE, "header\n" + BASE + "footer\n"),
+    (BASE, BASE.rstrip("\n")),
+    (BASE.rstrip("\n"), BASE + "line 21"),
+    ("", "new file\n"),
+    (BASE, ""),
+    ("a\r\nb\r\n", "a\r\nc\r\n"),
+])
+def test_diff_round_trip(old, new):
+    assert apply_patch(old, make_diff("a.py", old, new)) == new
+
+
+def test_equal_versions_need_no_diff():
+    assert make_diff("a.py", BASE, BASE) == ""
+    assert apply_patch(BASE, "") == BASE
+
+
+@pytest.mark.parametrize("diff", [
+    "not a diff\n",
+    "@@ -3,1 +3,1 @@\n-line 4\n+line four\n",
+    "@@ -3,2 +3,2 @@\n-line 3\n+line three\n",
+    "@@ -3,2 +3,1 @@\n line 3\n+extra\n line 4\n",
+    "@@ -30,1 +30,1 @@\n-line 30\n+line thirty\n",
+    "@@ -5,1 +5,1 @@\n-line 5\n+five\n@@ -2,1 +2,1 @@\n-line 2\n+two\n",
+    "@@ -3,1 +3,1 @@\n*line 3\n+line three\n",
+])
+def test_rejects_diffs_that_do_not_apply(diff):
+    with pytest.raises(PatchError):
+        apply_patch(BASE, diff)
+
+
+def test_versions_are_evicted_least_recently_used_first():
+    versions = FileVersions(budget=10)
+    versions.add("s", "a", "aaaa", None)
+    versions.add("s", "b", "bbbb", "a")
+    assert versions.get("s", "a") == ("aaaa", None)
+    versions.add("s", "c", "cccc", "a")
+    assert versions.get("s", "b") is None
+    assert versions.get("s", "a") is not None
+    assert versions.sizes["s"] == 8
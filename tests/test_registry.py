@@ -0,0 +1,41 @@
+import sys
+
+from modules.conversation.backends import SessionRegistry
+
+
+def _record(seq: int, size: int):
+    return (seq, "user", "x" * size, ())
+
+
+def test_registry_drops_least_recently_used_sessions_over_cap():
+    size = sys.getsizeof("x" * 300)
+    registry = SessionRegistry(max_bytes=2 * size)
+    registry.append("a", _record(1, 300))
+    registry.append("b", _record(1, 300))
+    registry.load("a")
+    registry.append("c", _record(1, 300))
+    assert set(registry.sessions) == {"a", "c"}
+    assert registry.total_bytes == 2 * size
+    assert registry.load("b") is None
+
+
+def test_registry_byte_accounting_follows_changes():
+    registry = SessionRegistry()
+    registry.append("a", _record(1, 100))
+    registry.append("a", _record(2, 200))
+    registry.append("a", _record(2, 50))
+    registry.discard("a", 1)
+    assert registry.total_bytes == registry.bytes["a"] == sys.getsizeof("x" * 50)
+    registry.remove("a")
+    assert registry.total_bytes == 0
+    assert registry.load("a") is None
+
+
+def test_registry_expires_idle_sessions():
+    registry = SessionRegistry(ttl=60)
+    registry.append("old", _record(1, 10))
+    registry.append("new", _record(1, 10))
+    registry.last_used["old"] -= 120
+    registry._expire(registry.last_used["new"])
+    assert list(registry.sessions) == ["new"]
+    assert registry.total_bytes == registry.bytes["new"]
@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+from modules.llm.scheduler import LLMScheduler, SchedulerBusyError
+
+
+async def _served_order(scheduler: LLMScheduler, requests):
+    """Queue requests behind a held slot and record the order they are granted in"""
+    order = []
+
+    async def request(session_id, label):
+        async with scheduler.slot(session_id):
+            order.append(label)
+
+    await scheduler.acquire("holder")
+    tasks = [asyncio.create_task(request(session_id, label)) for session_id, label in requests]
+    await asyncio.sleep(0)
+    scheduler.release()
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_sessions_take_turns():
+    scheduler = LLMScheduler(max_inflight=1, max_queue_depth=10)
+    requests = [("a", "a1"), ("a", "a2"), ("a", "a3"), ("b", "b1"), ("c", "c1"), ("b", "b2")]
+    order = asyncio.run(_served_order(scheduler, requests))
+    assert order == ["a1", "b1", "c1", "a2", "b2", "a3"]
+    assert scheduler.inflight == 0
+    assert scheduler.depth == 0
+
+
+def test_rejects_when_queue_is_full():
+    async def run():
+        scheduler = LLMScheduler(max_inflight=1, max_queue_depth=1)
+        await scheduler.acquire("a")
+        waiting = asyncio.create_task(scheduler.acquire("b"))
+        await asyncio.sleep(0)
+        with pytest.raises(SchedulerBusyError):
+            await scheduler.acquire("c")
+        scheduler.release()
+        await waiting
+        assert scheduler.inflight == 1
+        scheduler.release()
+
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_leaves_queue():
+    async def run():
+        scheduler = LLMScheduler(max_inflight=1, max_queue_depth=10)
+        await scheduler.acquire("a")
+        waiting = asyncio.create_task(scheduler.acquire("b"))
+        await asyncio.sleep(0)
+        assert scheduler.depth == 1
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        assert scheduler.depth == 0
+        assert not scheduler.queues
+        scheduler.release()
+        assert scheduler.inflight == 0
+
+    asyncio.run(run())
@@ -0,0 +1,34 @@
+import asyncio
+
+from modules.api.session import SessionManager
+
+
+def test_resume_token_round_trip():
+    sessions = SessionManager()
+    session_id = sessions.create_session()
+    token = sessions.issue_resume_token(session_id)
+    sessions.detach_session(session_id)
+    assert asyncio.run(sessions.resume_session(token)) == session_id
+    assert sessions.get_session(session_id).detached_at is None
+
+
+def test_tampered_tokens_are_rejected():
+    sessions = SessionManager()
+    session_id = sessions.create_session()
+    token = sessions.issue_resume_token(session_id)
+    signature = token.partition(".")[2]
+    other = SessionManager().create_session()
+    for forged in (
+        f"{other}.{signature}",
+        token[:-1] + ("0" if token[-1] != "0" else "1"),
+        session_id,
+        f"{session_id}.",
+        f"{session_id}.é",
+    ):
+        assert asyncio.run(sessions.resume_session(forged)) is None
+
+
+def test_tokens_do_not_verify_with_another_secret():
+    issuer = SessionManager()
+    session_id = issuer.create_session()
+    assert asyncio.run(SessionManager().resume_session(issuer.issue_resume_token(session_id))) is None
@@ -0,0 +1,72 @@
+import asyncio
+
+from modules.conversation.backends import SessionBackend, SQLiteBackend
+from modules.conversation.store import ConversationStore
+
+
+class CountingBackend(SessionBackend):
+    """Keeps records in a dict and counts the loads"""
+    def __init__(self):
+        self.records = {}
+        self.loads = 0
+
+    def load(self, session_id):
+        self.loads += 1
+        records = self.records.get(session_id)
+        return sorted(records.values()) if records is not None else None
+
+    def append(self, session_id, record):
+        self.records.setdefault(session_id, {})[record[0]] = record
+
+    def discard(self, session_id, seq):
+        self.records.get(session_id, {}).pop(seq, None)
+
+    def remove(self, session_id):
+        self.records.pop(session_id, None)
+
+
+def test_created_sessions_never_reach_the_backend():
+    backend = CountingBackend()
+    store = ConversationStore(backend=backend)
+    store.add("new")
+    assert store.get("new") is None
+    assert asyncio.run(store.load("new")) is None
+    store.get_or_create("new").append("user", "hello")
+    assert backend.loads == 0
+
+
+def test_get_is_memory_only_and_load_rehydrates_once():
+    backend = CountingBackend()
+    store = ConversationStore(backend=backend)
+    store.add("s")
+    store.get_or_create("s").append("user", "hello")
+    store.release("s")
+
+    assert store.get("s") is None
+    assert backend.loads == 0
+    conversation = asyncio.run(store.load("s"))
+    assert [message.content for message in conversation.messages] == ["hello"]
+    assert asyncio.run(store.load("s")) is conversation
+    assert backend.loads == 1
+
+
+def test_unknown_session_is_looked_up_once():
+    backend = CountingBackend()
+    store = ConversationStore(backend=backend)
+    assert asyncio.run(store.load("gone")) is None
+    assert asyncio.run(store.load("gone")) is None
+    assert backend.loads == 1
+
+
+def test_sqlite_backend_round_trip(tmp_path):
+    backend = SQLiteBackend(db_path=str(tmp_path / "sessions.db"))
+    try:
+        backend.append("s", (1, "user", "question", ("digest",)))
+        backend.append("s", (2, "assistant", "answer", ()))
+        backend.append("s", (3, "user", "dropped", ()))
+        backend.discard("s", 3)
+        assert backend.load("s") == [(1, "user", "question", ("digest",)), (2, "assistant", "answer", ())]
+        backend.remove("s")
+        assert backend.load("s") is None
+    finally:
+        backend.close()
@@ -0,0 +1,69 @@
+import pytest
+
+from modules.api.uploads import UploadError, UploadManager
+
+
+def _frame(upload_id: str, data: bytes) -> bytes:
+    encoded = upload_id.encode("utf-8")
+    return bytes([len(encoded)]) + encoded + data
+
+
+def test_parse_frame_splits_id_and_data():
+    assert UploadManager.parse_frame(_frame("up-1", b"hello")) == ("up-1", b"hello")
+    assert UploadManager.parse_frame(_frame("up-1", b"")) == ("up-1", b"")
+
+
+@pytest.mark.parametrize("frame", [b"", b"\x05abc", b"\xff" + b"x" * 10])
+def test_parse_frame_rejects_short_frames(frame):
+    with pytest.raises(UploadError):
+        UploadManager.parse_frame(frame)
+
+
+def test_start_enforces_the_session_quota():
+    uploads = UploadManager(quota=100)
+    uploads.start("s", "a", "a.py", 60)
+    with pytest.raises(UploadError):
+        uploads.start("s", "b", "b.py", 41)
+    uploads.start("other", "b", "b.py", 100)
+    uploads.discard("s", "a")
+    uploads.start("s", "b", "b.py", 100)
+    assert uploads.reserved == {"s": 100, "other": 100}
+
+
+@pytest.mark.parametrize("upload_id, size", [("", 1), ("x" * 256, 1), ("a", -1), ("a", 1.5)])
+def test_start_rejects_invalid_requests(upload_id, size):
+    with pytest.raises(UploadError):
+        UploadManager(quota=100).start("s", upload_id, "a.py", size)
+
+
+def test_data_past_the_announced_size_discards_the_upload():
+    uploads = UploadManager(quota=100)
+    uploads.start("s", "a", "a.py", 4)
+    uploads.receive("s", "a", b"abc")
+    with pytest.raises(UploadError):
+        uploads.receive("s", "a", b"de")
+    assert uploads.uploads == {}
+    assert uploads.reserved == {}
+
+
+def test_take_all_takes_nothing_if_one_upload_is_unusable():
+    uploads = UploadManager(quota=100)
+    uploads.start("s", "a", "a.py", 3)
+    uploads.receive("s", "a", b"abc")
+    uploads.start("s", "b", "b.py", 3)
+    with pytest.raises(UploadError):
+        uploads.take_all("s", ["a", "b"])
+    with pytest.raises(UploadError):
+        uploads.take_all("s", ["a", "missing"])
+    assert set(uploads.uploads["s"]) == {"a", "b"}
+    uploads.receive("s", "b", b"def")
+    taken = uploads.take_all("s", ["a", "b", "a"])
+    assert {upload_id: upload.read_text() for upload_id, upload in taken.items()} == {"a": "abc", "b": "def"}
+    assert uploads.uploads == {}
+    assert uploads.reserved == {}
+
+
+def test_empty_upload_is_complete_at_start():
+    uploads = UploadManager(quota=100)
+    assert uploads.start("s", "a", "empty.txt", 0).complete
+    assert uploads.take("s", "a").read_text() == ""